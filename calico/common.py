@@ -30,6 +30,8 @@ import logging.handlers
 import netaddr
 import netaddr.core
 import os
+import re
+import socket
 import sys
 
 _log = logging.getLogger(__name__)
@@ -43,6 +45,10 @@ FORMAT_STRING = '%(asctime)s [%(levelname)s][%(process)s/%(tid)d] %(name)s %(lin
 # string used by the logger.
 SYSLOG_FORMAT_STRING = '{excname}[%(process)s]: %(module)s@%(lineno)d %(message)s'
 
+# Level for log handlers that have been disabled by config.  Above CRITICAL
+# so that they emit nothing.
+_DISABLED_LEVEL = logging.CRITICAL + 1
+
 tid_storage = gevent.local.local()
 tid_counter = itertools.count()
 # Ought to do itertools.count(start=1), but python 2.6 does not support it.
@@ -77,12 +83,49 @@ def validate_port(port):
         return False
 
 
+_FAMILIES_FOR_VERSION = {
+    4: ((socket.AF_INET, 32),),
+    6: ((socket.AF_INET6, 128),),
+    None: ((socket.AF_INET, 32), (socket.AF_INET6, 128)),
+}
+"""Map from IP version to (address family, max prefix length) to try."""
+
+_PREFIX_LEN_RE = re.compile(r"^(0|[1-9][0-9]{0,2})\Z")
+
+
+def _fast_validate(addr, prefix_len, version):
+    """
+    Fast path for the IP validation functions, for the common case of an
+    address in its canonical form.  Uses socket.inet_pton(), which is
+    stricter than netaddr, so if this returns True, netaddr would accept the
+    address too.  If this returns False, the caller should fall back to
+    netaddr, which accepts some less common forms, such as "10.1" or
+    netmasks.
+
+    :param addr: the address, without any prefix length.
+    :param prefix_len: the prefix length string, or None for an address.
+    :returns bool: True if the address is definitely valid.
+    """
+    if prefix_len is not None and not _PREFIX_LEN_RE.match(prefix_len):
+        return False
+    for family, max_prefix_len in _FAMILIES_FOR_VERSION.get(version, ()):
+        try:
+            socket.inet_pton(family, addr)
+        except (socket.error, ValueError, TypeError):
+            continue
+        if prefix_len is None or int(prefix_len) <= max_prefix_len:
+            return True
+    return False
+
+
 def validate_ip_addr(addr, version):
     """
     Validates that an IP address is valid. Returns true if valid, false if
     not. Version can be "4", "6", None for "IPv4", "IPv6", or "either"
     respectively.
     """
+    if isinstance(addr, basestring) and _fast_validate(addr, None, version):
+        return True
     try:
         ip = netaddr.IPAddress(addr, version=version)
         return True
@@ -96,6 +139,10 @@ def validate_cidr(cidr, version):
     not. Version can be "4", "6", None for "IPv4", "IPv6", or "either"
     respectively.
     """
+    if isinstance(cidr, basestring):
+        addr, slash, prefix_len = cidr.partition("/")
+        if _fast_validate(addr, prefix_len if slash else None, version):
+            return True
     try:
         ip = netaddr.IPNetwork(cidr, version=version)
         return True
@@ -175,9 +222,10 @@ def complete_logging(logfile=None,
     logging is available as early in execution as possible, i.e. before the
     config file has been parsed.
 
-    This function must only be called once, after
-    :meth:`default_logging() <calico.common.default_logging>`
-    has been called.
+    This function must be called after
+    :meth:`default_logging() <calico.common.default_logging>`.  It may be
+    called again to apply changed configuration.  A handler whose level is
+    None is disabled rather than removed, so that it can be re-enabled.
     """
     root_logger = logging.getLogger()
 
@@ -185,22 +233,21 @@ def complete_logging(logfile=None,
     # Update their levels.
     file_handler = None
     for handler in root_logger.handlers[:]:
-        if isinstance(handler, logging.handlers.SysLogHandler):
-            if syslog_level is None:
-                root_logger.removeHandler(handler)
-            else:
-                handler.setLevel(syslog_level)
-        elif isinstance(handler, logging.StreamHandler):
-            if stream_level is None:
-                root_logger.removeHandler(handler)
-            else:
-                handler.setLevel(stream_level)
-        elif isinstance(handler, logging.handlers.TimedRotatingFileHandler):
-            file_handler = handler
-            if file_level is None:
+        # TimedRotatingFileHandler is a subclass of StreamHandler, so check
+        # for it first.
+        if isinstance(handler, logging.handlers.TimedRotatingFileHandler):
+            if (file_level is None or not logfile or
+                    handler.baseFilename != os.path.abspath(logfile)):
+                # Logging to file disabled or the path has changed.
                 root_logger.removeHandler(handler)
+                handler.close()
             else:
+                file_handler = handler
                 handler.setLevel(file_level)
+        elif isinstance(handler, logging.handlers.SysLogHandler):
+            handler.setLevel(_handler_level(syslog_level))
+        elif isinstance(handler, logging.StreamHandler):
+            handler.setLevel(_handler_level(stream_level))
 
     # If we've been given a log file, log to file as well.
     if logfile and file_level is not None:
@@ -215,4 +262,21 @@ def complete_logging(logfile=None,
             file_handler.setFormatter(formatter)
             root_logger.addHandler(file_handler)
 
+    # Only generate log records at the lowest level that some handler will
+    # actually emit.  default_logging() sets the root logger to DEBUG, which
+    # means that every debug log on the hot paths would otherwise create (and
+    # then discard) a LogRecord.
+    levels = [l for l in (file_level if logfile else None,
+                          syslog_level,
+                          stream_level) if l is not None]
+    root_logger.setLevel(min(levels) if levels else logging.CRITICAL)
+
     _log.info("Logging initialized")
+
+
+def _handler_level(level):
+    """
+    Returns the level to give a handler for the configured level, which may
+    be None to disable the handler.
+    """
+    return _DISABLED_LEVEL if level is None else level
@@ -33,6 +33,14 @@ until the result is available and returns it as-is. As a convenience,
 Actors may call their own decorated methods without passing async=...;
 such calls are treated as normal, synchronous method calls.
 
+Callers that have no interest in the result may instead pass oneway=True.
+A one-way message has no AsyncResult at all (the method returns None), which
+saves allocating and tracking a TrackedAsyncResult for every message on the
+hot update paths.  Since there is no caller to report a failure to, an
+exception raised while processing a one-way message is passed to the
+recipient's _on_oneway_exception() method; by default, that treats it like
+a leaked exception and terminates the process.
+
 Each time it is scheduled, the main loop of the Actor
 
 * pulls all pending messages off the queue as a batch
@@ -72,6 +80,46 @@ the beginning.  To make use of that function, an Actor must:
   ensuring, of course, that it did not leave any resources
   partially-modified.
 
+Splitting can take many retries to narrow down a single bad message.  If the
+actor can work out which message(s) caused the failure, it may instead raise
+FailMessagesAndRetry, passing the exception to report for each bad message.
+The framework reports those failures and then re-runs the rest of the batch
+in one go.
+
+An actor may also wait for more messages to arrive before starting a batch,
+either by setting a fixed batch_delay or by setting an AdaptiveBatchDelay
+as its batch_delay_policy, which only waits when the actor is busy.
+
+Merging superseded messages
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Some messages only set a piece of state to a new value, so a later message
+for the same piece of state makes any earlier ones redundant.  An
+actor_message may be given a merge_key function, which is called with the
+message's arguments and returns a hashable key identifying the state it
+sets.  When a batch is assembled, if several messages in the batch have the
+same key, only the last one is executed; the AsyncResults of the earlier
+messages are moved to the last message so that all callers still get a
+result.
+
+Keys are shared between all the methods of an actor, so methods that use
+the same key must each completely override the state set by the others.
+For example, DispatchChains' on_endpoint_added(iface, ...) and
+on_endpoint_removed(iface) both use the interface name as their key.
+Such methods must also have the same priority (see below).
+
+Priorities
+~~~~~~~~~~
+
+Each actor_message has a priority, PRIORITY_NORMAL by default.  An actor's
+queue has a lane for each priority and messages are always taken from the
+highest-priority non-empty lane, so latency-sensitive messages (such as
+interface kicks for a newly-booted workload) jump ahead of any bulk work
+that has already been queued (such as a resync).  Within a lane, messages
+are processed in the order they were sent.  There is no ordering between
+lanes so a high-priority message must not depend on the effects of
+normal-priority messages that were sent before it.
+
 Thread safety
 ~~~~~~~~~~~~~
 
@@ -85,30 +133,80 @@ some gotchas:
 * We deliberately use unbounded queues for queueing up messages between
   actors. Bounding the queues would allow deadlock since the sending actor
   can block on a full queue and the receiving actor may be blocked on the
-  queue of the sender, trying to send another message.
+  queue of the sender, trying to send another message.  See the
+  "Backpressure" section for how we limit queue growth instead.
+
+Backpressure
+~~~~~~~~~~~~
+
+An actor may set queue_high_water_mark.  Sends never block but, when a send
+takes the recipient's queue over its high-water mark, the recipient is marked
+as congested.  Once the sending actor has finished its current batch, it
+defers taking its next batch until the congested actor has drained its queue
+to half the high-water mark.  Meanwhile, messages accumulate on the sender's
+own queue, where they are batched (and merged, if they have a merge_key)
+rather than being passed on one by one.  For example, if the IptablesUpdater
+is stalled waiting for the xtables lock, its producers stop converting
+endpoint updates into iptables updates until it catches up.
+
+The wait is bounded by BACKPRESSURE_TIMEOUT, so cycles of congested actors
+slow down rather than deadlocking.  Greenlets that aren't actors may call
+wait_for_backpressure() to wait for any actors that they have congested.
+
+Statistics
+~~~~~~~~~~
+
+Each Actor records some cheap statistics as it processes messages (number of
+messages and batches, a histogram of batch sizes, time spent waiting on the
+queue, per-message-type execution time and the number of batch splits).  The
+stats are held in a module-level registry, keyed on actor name, and can be
+written to the log with dump_actor_stats().  Short-lived actors, such as the
+RefCountedActors, aggregate their stats per-class to avoid growing the
+registry without bound.
+
+Tracing
+~~~~~~~
+
+To measure how long it takes for an external event (such as an etcd update)
+to be fully programmed into the dataplane, the code that receives the event
+may start a Trace, using the start_trace() context manager.  Any messages
+sent while the trace is active carry the Trace and, while an actor is
+processing a message that carries a trace, any messages it sends carry it on
+in turn.
+Messages sent from _finish_msg_batch() carry all the traces from the batch.
+
+The Trace records the timing of each hop and counts the messages that are
+still outstanding.  Once the last of them has been processed (including the
+_finish_msg_batch() that followed it), the total time is logged and recorded
+in the stats under the name "Traces".
 
 Unhandled Exceptions
 ~~~~~~~~~~~~~~~~~~~~
 
-The framework keeps track of pending AsyncResults and tries to detect
-callbacks that were GCed with a pending exception.  If is detects such
-an exception, it terminates the process on the assumption that
+The framework keeps track of AsyncResults that have had an exception set
+and tries to detect ones that were GCed with a pending exception.  If is
+detects such an exception, it terminates the process on the assumption that
 an unhandled exception implies a bug and may leave the system in an
 inconsistent state.
 
+Only AsyncResults that fail are tracked (via a weak reference, registered
+when the exception is set), which keeps the overhead off the common path.
+
 """
+import bisect
 import collections
+import contextlib
 import functools
 import gevent
 import gevent.local
+import itertools
 import logging
 import os
 import sys
-import traceback
-import uuid
+import time
 import weakref
 
-from gevent.event import AsyncResult
+from gevent.event import AsyncResult, Event
 from gevent.queue import Queue
 
 
@@ -117,10 +215,40 @@ _log = logging.getLogger(__name__)
 
 ResultOrExc = collections.namedtuple("ResultOrExc", ("result", "exception"))
 
-# Local storage to allow diagnostics.
+# Local storage to allow diagnostics.  Holds a single _GreenletContext, since
+# each access to a gevent.local attribute is relatively expensive.
 actor_storage = gevent.local.local()
 
 
+class _GreenletContext(object):
+    """
+    Per-greenlet state, stored in actor_storage.
+    """
+    __slots__ = ("name", "msg_uuid", "traces", "congested_peers")
+
+    def __init__(self):
+        self.name = None
+        """Name of the actor that owns the greenlet, if any."""
+        self.msg_uuid = None
+        """ID of the message the actor is processing."""
+        self.traces = _NO_TRACES
+        """Traces to attach to messages sent from this greenlet."""
+        self.congested_peers = None
+        """None or set of actors that this greenlet has congested."""
+
+
+def _greenlet_context():
+    """
+    :returns _GreenletContext: the context for the current greenlet,
+        creating it if necessary.
+    """
+    try:
+        return actor_storage.context
+    except AttributeError:
+        context = actor_storage.context = _GreenletContext()
+        return context
+
+
 class Actor(object):
     """
     Class that contains a queue and a greenlet serving that queue.
@@ -132,11 +260,29 @@ class Actor(object):
     the messages in a batch.  Higher values encourage batching.
     """
 
+    batch_delay_policy = None
+    """
+    Optional AdaptiveBatchDelay.  If set, it overrides batch_delay, choosing
+    the delay for each batch.
+    """
+
     max_ops_before_yield = 10000
     """Number of calls to self._maybe_yield before it yields"""
 
+    queue_high_water_mark = None
+    """
+    If set, the number of queued messages above which this actor counts as
+    congested.  See the "Backpressure" section of the module docstring.
+    """
+
+    per_class_stats = False
+    """
+    If True, all instances of this class share a single ActorStats object,
+    registered under the class name rather than the per-instance name.
+    """
+
     def __init__(self, qualifier=None):
-        self._event_queue = Queue()
+        self._event_queue = _MessageQueue()
         self.greenlet = gevent.Greenlet(self._loop)
         self._op_count = 0
         self._current_msg = None
@@ -152,6 +298,16 @@ class Actor(object):
         else:
             self.name = self.__class__.__name__
 
+        # Cleared while we're congested, see queue_high_water_mark.
+        self._drained = Event()
+        self._drained.set()
+
+        if self.per_class_stats:
+            self._stats = get_actor_stats(self.__class__.__name__)
+        else:
+            self._stats = get_actor_stats(self.name)
+        self._stats.actors[id(self)] = self
+
     def start(self):
         assert not self.greenlet, "Already running"
         _log.debug("Starting %s", self)
@@ -163,8 +319,7 @@ class Actor(object):
         """
         Main greenlet loop, repeatedly runs _step().  Doesn't return normally.
         """
-        actor_storage.name = self.name
-        actor_storage.msg_uuid = None
+        _greenlet_context().name = self.name
 
         try:
             while True:
@@ -183,18 +338,24 @@ class Actor(object):
         """
         # Block waiting for work.
         msg = self._event_queue.get()
-        actor_storage.msg_uuid = msg.uuid
+        context = _greenlet_context()
+        context.msg_uuid = msg.uuid
 
         batch = [msg]
         batches = []
 
+        policy = self.batch_delay_policy
         if not msg.needs_own_batch:
             # Try to pull some more work off the queue to combine into a
             # batch.
-            if self.batch_delay:
+            if policy is not None:
+                batch_delay = policy.get_delay(time.time())
+            else:
+                batch_delay = self.batch_delay
+            if batch_delay:
                 # If requested by our subclass, delay the start of the batch to
                 # allow more work to accumulate.
-                gevent.sleep(self.batch_delay)
+                gevent.sleep(batch_delay)
             while not self._event_queue.empty():
                 # We're the only ones getting from the queue so this should
                 # never fail.
@@ -208,6 +369,16 @@ class Actor(object):
                     batch.append(msg)
         if batch:
             batches.append(batch)
+        if (not self._drained.is_set() and
+                self._event_queue.qsize() <= self.queue_high_water_mark // 2):
+            self._drained.set()
+
+        stats = self._stats
+        num_msgs = sum(len(b) for b in batches)
+        stats.record_queue_len(num_msgs)
+        collected_time = time.time()
+        for ii, batch in enumerate(batches):
+            batches[ii] = self._merge_superseded(batch)
 
         num_splits = 0
         while batches:
@@ -220,12 +391,18 @@ class Actor(object):
             # Give subclass a chance to filter the batch/update its state.
             batch = self._start_msg_batch(batch)
             assert batch is not None, "_start_msg_batch() should return batch."
+            stats.record_batch(len(batch))
             results = []  # Will end up same length as batch.
             for msg in batch:
-                _log.debug("Message %s recd by %s from %s, queue length %d",
-                           msg, msg.recipient, msg.caller,
-                           self._event_queue.qsize())
+                if _log.isEnabledFor(logging.DEBUG):
+                    # Avoid formatting msg.caller unless it will be logged.
+                    _log.debug("Message %s recd by %s from %s, queue length "
+                               "%d", msg, msg.recipient, msg.caller,
+                               self._event_queue.qsize())
                 self._current_msg = msg
+                context.traces = msg.traces
+                start_time = time.time()
+                stats.record_queue_wait(start_time - msg.enqueue_time)
                 try:
                     # Actually execute the per-message method and record its
                     # result.
@@ -237,9 +414,18 @@ class Actor(object):
                     results.append(ResultOrExc(result, None))
                 finally:
                     self._current_msg = None
+                    end_time = time.time()
+                    stats.record_method_time(msg.name, end_time - start_time)
+                    context.traces = _NO_TRACES
+                    for trace in msg.traces:
+                        trace.record_hop(self.name, msg.name,
+                                         start_time - msg.enqueue_time,
+                                         end_time - start_time)
+            finish_start_time = time.time()
             try:
                 # Give subclass a chance to post-process the batch.
                 _log.debug("Finishing message batch")
+                context.traces = _batch_traces(batch)
                 self._finish_msg_batch(batch, results)
             except SplitBatchAndRetry:
                 # The subclass couldn't process the batch as is (probably
@@ -249,23 +435,93 @@ class Actor(object):
                 _log.warn("Splitting batch to retry.")
                 self.__split_batch(batch, batches)
                 num_splits += 1  # For diags.
+                stats.splits += 1
+                continue
+            except FailMessagesAndRetry as e:
+                # The subclass identified the message(s) that caused the
+                # batch to fail.  Fail them and re-run the rest of the batch.
+                _log.warn("Failing %s message(s) and retrying rest of batch.",
+                          len(e.failures))
+                stats.counters["failed and retried"] += len(e.failures)
+                remaining = []
+                for msg in batch:
+                    exc = e.failures.get(msg)
+                    if exc is None:
+                        remaining.append(msg)
+                    else:
+                        self._report_result(msg, None, exc)
+                assert len(remaining) < len(batch), \
+                    "FailMessagesAndRetry didn't fail any messages in batch"
+                if remaining:
+                    batches.insert(0, remaining)
                 continue
             except BaseException as e:
                 # Most-likely a bug.  Report failure to all callers.
                 _log.exception("_finish_msg_batch failed.")
                 results = [(None, e)] * len(results)
+            finally:
+                context.traces = _NO_TRACES
+                stats.record_method_time("_finish_msg_batch",
+                                         time.time() - finish_start_time)
 
             # Batch complete and finalized, set all the results.
             assert len(batch) == len(results)
             for msg, (result, exc) in zip(batch, results):
-                for future in msg.results:
-                    if exc is not None:
-                        future.set_exception(exc)
-                    else:
-                        future.set(result)
+                self._report_result(msg, result, exc)
         if num_splits > 0:
             _log.warn("Split batches complete. Number of splits: %s",
                       num_splits)
+        if policy is not None:
+            policy.record_batch(num_msgs, collected_time, time.time())
+        if context.congested_peers:
+            # Defer our next batch until the actors that we've been feeding
+            # catch up.
+            wait_for_backpressure()
+
+    def _report_result(self, msg, result, exc):
+        """
+        Reports the result of processing a message to its callers.
+        """
+        for future in msg.results:
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set(result)
+        if exc is not None and msg.oneway:
+            self._on_oneway_exception(msg, exc)
+        for trace in msg.traces:
+            trace.release()
+
+    def _merge_superseded(self, batch):
+        """
+        Removes messages that are superseded by a later message in the batch
+        with the same merge key, passing their results to the later message.
+
+        :param list[Message] batch: batch to merge.
+        :returns list[Message]: the merged batch, in the same order.
+        """
+        if len(batch) < 2:
+            return batch
+        latest_msg_by_key = {}
+        merged_batch = []
+        for msg in reversed(batch):
+            key = msg.merge_key
+            if key is not None:
+                later_msg = latest_msg_by_key.get(key)
+                if later_msg is not None:
+                    # Superseded, the later message reports our result.
+                    later_msg.results.extend(msg.results)
+                    later_msg.traces += msg.traces
+                    continue
+                latest_msg_by_key[key] = msg
+            merged_batch.append(msg)
+        num_merged = len(batch) - len(merged_batch)
+        if num_merged:
+            _log.debug("Merged %s superseded messages", num_merged)
+            self._stats.counters["merged messages"] += num_merged
+            merged_batch.reverse()
+            return merged_batch
+        return batch
 
     @staticmethod
     def __split_batch(current_batch, remaining_batches):
@@ -337,6 +593,25 @@ class Actor(object):
         """
         pass
 
+    def _on_oneway_exception(self, msg, exc):
+        """
+        Called when processing a one-way message (i.e. one sent with
+        oneway=True) fails, since there is no AsyncResult to report the
+        failure to.
+
+        May be overridden by actors that can recover from such failures.
+        This implementation treats the exception like a leaked exception and
+        terminates the process.
+
+        :param Message msg: The message that failed.
+        :param BaseException exc: The exception that it raised.
+        """
+        _log.critical("One-way message %s to %s failed with exception %r",
+                      msg, self.name, exc)
+        print >> sys.stderr, "One-way message %s to %s failed with " \
+                             "exception %r" % (msg, self.name, exc)
+        _exit(1)
+
     def _maybe_yield(self):
         """
         With some probability, yields processing to another greenlet.
@@ -348,6 +623,13 @@ class Actor(object):
             gevent.sleep()
             self._op_count = 0
 
+    def estimate_queue_memory(self):
+        """
+        :returns int: Rough estimate of the number of bytes used by the
+            messages on this actor's queue.
+        """
+        return self._event_queue.estimate_memory()
+
     def __str__(self):
         return self.__class__.__name__ + "<queue_len=%s,live=%s,msg=%s>" % (
             self._event_queue.qsize(),
@@ -356,6 +638,60 @@ class Actor(object):
         )
 
 
+PRIORITY_HIGH = 0
+"""Priority for latency-sensitive messages."""
+PRIORITY_NORMAL = 1
+"""Default message priority."""
+NUM_PRIORITIES = 2
+
+
+class _MessageQueue(Queue):
+    """
+    Queue of Messages with a FIFO lane per priority.  Gets return the oldest
+    message from the highest-priority lane that has any messages.
+    """
+    def _init(self, maxsize, items=None):
+        self.queue = [collections.deque() for _ in xrange(NUM_PRIORITIES)]
+        # qsize() is on the hot path (and used for logging), so keep a count
+        # rather than summing the lanes.
+        self._size = 0
+        if items:
+            for item in items:
+                self._put(item)
+
+    def _put(self, msg):
+        self.queue[msg.priority].append(msg)
+        self._size += 1
+
+    def _get(self):
+        for lane in self.queue:
+            if lane:
+                self._size -= 1
+                return lane.popleft()
+        raise IndexError("get from empty _MessageQueue")
+
+    def _peek(self):
+        for lane in self.queue:
+            if lane:
+                return lane[0]
+        raise IndexError("peek from empty _MessageQueue")
+
+    def qsize(self):
+        return self._size
+
+    def estimate_memory(self):
+        """
+        :returns int: Rough estimate of the number of bytes used by the
+            queued messages, including their (top-level) arguments.
+        """
+        total = 0
+        for lane in self.queue:
+            total += sys.getsizeof(lane)
+            for msg in lane:
+                total += msg.estimate_memory()
+        return total
+
+
 class SplitBatchAndRetry(Exception):
     """
     Exception that may be raised by _finish_msg_batch() to cause the
@@ -365,29 +701,455 @@ class SplitBatchAndRetry(Exception):
     pass
 
 
+class AdaptiveBatchDelay(object):
+    """
+    Batch delay policy that adapts to the actor's load.
+
+    When messages are arriving slowly, there's nothing to gain by waiting
+    for more work so the minimum delay is used, giving low latency for
+    one-off changes.  When messages are arriving quickly enough that more
+    are expected to arrive while a batch is being processed, the delay
+    tracks the cost of the last batch (within the configured bounds), so
+    that the fixed cost of each batch (such as an iptables-restore) is
+    amortised over more messages.
+    """
+    def __init__(self, min_delay, max_delay):
+        """
+        :param float min_delay: Minimum delay, in seconds.
+        :param float max_delay: Maximum delay, in seconds.
+        """
+        assert 0 <= min_delay <= max_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.arrival_rate = 0.0
+        """Smoothed rate at which messages arrive, in messages/second."""
+        self.last_cost = 0.0
+        """Time taken to process the last batch, in seconds."""
+        self._last_collected_time = None
+        self._last_finish_time = None
+
+    def get_delay(self, now):
+        """
+        :param float now: Time at which the first message of the batch was
+            received.
+        :returns float: The delay to use for the next batch, in seconds.
+        """
+        if (self._last_finish_time is None or
+                now - self._last_finish_time > self.max_delay):
+            # We've been idle, this is likely a one-off change.
+            return self.min_delay
+        if self.arrival_rate * self.last_cost < 1:
+            # Not expecting any more messages to arrive in the time it would
+            # take to process this batch.
+            return self.min_delay
+        return min(max(self.last_cost, self.min_delay), self.max_delay)
+
+    def record_batch(self, num_msgs, collected_time, finish_time):
+        """
+        Records the processing of a batch.
+
+        :param int num_msgs: Number of messages in the batch.
+        :param float collected_time: Time at which the batch was taken off
+            the queue.
+        :param float finish_time: Time at which processing finished.
+        """
+        if self._last_collected_time is not None:
+            interval = max(collected_time - self._last_collected_time, 1e-6)
+            self.arrival_rate = (self.arrival_rate + num_msgs / interval) / 2
+        self.last_cost = finish_time - collected_time
+        self._last_collected_time = collected_time
+        self._last_finish_time = finish_time
+
+
+class FailMessagesAndRetry(Exception):
+    """
+    Exception that may be raised by _finish_msg_batch() to fail particular
+    messages in the batch, which are known to have caused it to fail.  The
+    remaining messages are then re-executed, as a new batch, and delivered
+    to _finish_msg_batch() again.
+    """
+    def __init__(self, failures):
+        """
+        :param dict[Message,BaseException] failures: Map from message to
+            the exception to report for that message.
+        """
+        super(FailMessagesAndRetry, self).__init__()
+        assert failures, "No failed messages specified"
+        self.failures = failures
+
+
+BACKPRESSURE_TIMEOUT = 5
+"""
+Maximum time, in seconds, that wait_for_backpressure() waits for congested
+actors to drain.
+"""
+
+
+def _mark_congested(actor):
+    """
+    Called after the current greenlet takes actor's queue over its high-water
+    mark.  Marks the actor as congested and records that the current
+    greenlet should wait for it.
+    """
+    if actor._drained.is_set():
+        _log.info("%s congested, queue length %d", actor.name,
+                  actor._event_queue.qsize())
+        actor._drained.clear()
+        actor._stats.counters["congested"] += 1
+    context = _greenlet_context()
+    if context.congested_peers is None:
+        context.congested_peers = set()
+    context.congested_peers.add(actor)
+
+
+def wait_for_backpressure(timeout=BACKPRESSURE_TIMEOUT):
+    """
+    Waits, for at most timeout seconds, for any actors that the current
+    greenlet has congested to drain their queues.  Called by actors after
+    each batch; should be called periodically by any other greenlet that
+    sends a large number of messages.
+    """
+    context = _greenlet_context()
+    peers = context.congested_peers
+    if not peers:
+        return
+    context.congested_peers = None
+    deadline = time.time() + timeout
+    for peer in peers:
+        if peer._drained.is_set() or not peer.greenlet:
+            # Already drained or not running (in which case, waiting would
+            # be pointless).
+            continue
+        peer._stats.counters["backpressure waits"] += 1
+        peer._drained.wait(max(deadline - time.time(), 0))
+        if not peer._drained.is_set():
+            _log.warning("Timed out waiting for %s to drain its queue, "
+                         "queue length %d", peer.name,
+                         peer._event_queue.qsize())
+            peer._stats.counters["backpressure timeouts"] += 1
+
+
 def wait_and_check(async_results):
     for r in async_results:
         r.get()
 
 
+BATCH_SIZE_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+"""Upper bounds of the buckets used for the batch size histogram."""
+
+_stats_by_name = {}
+
+
+class ActorStats(object):
+    """
+    Cheap counters describing the work done by an Actor (or, for actors with
+    per_class_stats set, by all actors of a class).
+
+    Only updated from the owning actor's greenlet.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.messages = 0
+        self.batches = 0
+        self.splits = 0
+        self.max_queue_len = 0
+        self.batch_size_hist = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        """
+        Number of batches in each bucket; the final entry counts batches
+        larger than the largest bucket.
+        """
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.method_times = {}
+        """Map from method name to [count, total time, max time]."""
+        self.counters = collections.defaultdict(int)
+        """Ad-hoc counters that actors may increment for diagnostics."""
+        self.actors = weakref.WeakValueDictionary()
+        """Live actors using these stats, by id(), for the queue gauges."""
+
+    def record_queue_len(self, queue_len):
+        if queue_len > self.max_queue_len:
+            self.max_queue_len = queue_len
+
+    def record_batch(self, batch_size):
+        self.batches += 1
+        self.messages += batch_size
+        self.batch_size_hist[bisect.bisect_left(BATCH_SIZE_BUCKETS,
+                                                batch_size)] += 1
+
+    def record_queue_wait(self, wait):
+        self.total_queue_wait += wait
+        if wait > self.max_queue_wait:
+            self.max_queue_wait = wait
+
+    def record_method_time(self, method_name, duration):
+        try:
+            entry = self.method_times[method_name]
+        except KeyError:
+            entry = self.method_times[method_name] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += duration
+        if duration > entry[2]:
+            entry[2] = duration
+
+    def queue_gauges(self):
+        """
+        :returns tuple[int,int]: The number of messages currently queued
+            for the live actors using these stats and an estimate of the
+            memory that they use, in bytes.
+        """
+        queue_len = 0
+        queue_mem = 0
+        for actor in self.actors.values():
+            queue_len += actor._event_queue.qsize()
+            queue_mem += actor.estimate_queue_memory()
+        return queue_len, queue_mem
+
+    @property
+    def total_time(self):
+        """Total time spent processing messages and batches."""
+        return sum(e[1] for e in self.method_times.itervalues())
+
+    def format(self):
+        """
+        :returns list[str]: Human-readable lines describing the stats.
+        """
+        avg_wait = (self.total_queue_wait / self.messages
+                    if self.messages else 0.0)
+        lines = [
+            "%s: %d msgs in %d batches, %d splits, max queue len %d, "
+            "busy %.3fs, queue wait avg %.1fms max %.1fms" %
+            (self.name, self.messages, self.batches, self.splits,
+             self.max_queue_len, self.total_time, avg_wait * 1000,
+             self.max_queue_wait * 1000)
+        ]
+        queue_len, queue_mem = self.queue_gauges()
+        if queue_len:
+            lines.append("  queued now: %d msgs, ~%.1fkB" %
+                         (queue_len, queue_mem / 1024.0))
+        hist = []
+        for bound, count in zip(BATCH_SIZE_BUCKETS + ["inf"],
+                                self.batch_size_hist):
+            if count:
+                hist.append("<=%s:%d" % (bound, count))
+        if hist:
+            lines.append("  batch sizes: %s" % " ".join(hist))
+        for method_name, (count, total, max_time) in sorted(
+                self.method_times.iteritems(),
+                key=lambda item: item[1][1], reverse=True):
+            lines.append("  %s: %d calls, total %.3fs, avg %.2fms, "
+                         "max %.2fms" % (method_name, count, total,
+                                         total * 1000 / count,
+                                         max_time * 1000))
+        for counter, value in sorted(self.counters.iteritems()):
+            lines.append("  %s: %d" % (counter, value))
+        return lines
+
+
+def get_actor_stats(name):
+    """
+    :returns ActorStats: the stats object registered under the given name,
+        creating it if necessary.
+    """
+    try:
+        return _stats_by_name[name]
+    except KeyError:
+        stats = _stats_by_name[name] = ActorStats(name)
+        return stats
+
+
+def dump_actor_stats():
+    """
+    Writes the stats for all actors to the log, busiest actor first.
+
+    Safe to call from any greenlet, for example from a signal handler.
+    """
+    all_stats = sorted(_stats_by_name.values(),
+                       key=lambda s: s.total_time, reverse=True)
+    total_len = 0
+    total_mem = 0
+    for stats in all_stats:
+        queue_len, queue_mem = stats.queue_gauges()
+        total_len += queue_len
+        total_mem += queue_mem
+    _log.info("Actor stats for %d actors, %d msgs queued (~%.1fkB):",
+              len(all_stats), total_len, total_mem / 1024.0)
+    for stats in all_stats:
+        for line in stats.format():
+            _log.info("%s", line)
+
+
+MAX_TRACE_HOPS = 100
+"""Maximum number of hops for which a Trace records the details."""
+
+TRACE_STATS_NAME = "Traces"
+"""Name under which the end-to-end times of traces are recorded."""
+
+_NO_TRACES = ()
+
+
+class Trace(object):
+    """
+    Tracks the processing of an external event as it propagates through
+    the actors.  See the "Tracing" section of the module docstring.
+
+    Only used from actor greenlets, which are never pre-empted so no
+    locking is needed.
+    """
+    def __init__(self, description, kind):
+        """
+        :param str description: Description of the event, used for logging,
+            for example "etcd index 1234".
+        :param str kind: Kind of event, the key for the stats.
+        """
+        self.description = description
+        self.kind = kind
+        self.start_time = time.time()
+        self.pending = 1
+        """Number of outstanding messages, plus one for the creator."""
+        self.num_hops = 0
+        self.hops = []
+        """List of (actor name, method name, time since start of trace,
+        queue wait, duration) tuples for the first MAX_TRACE_HOPS hops."""
+
+    def record_hop(self, actor_name, method_name, queue_wait, duration):
+        self.num_hops += 1
+        if len(self.hops) < MAX_TRACE_HOPS:
+            self.hops.append((actor_name, method_name,
+                              time.time() - self.start_time,
+                              queue_wait, duration))
+
+    def acquire(self):
+        self.pending += 1
+
+    def release(self):
+        self.pending -= 1
+        if self.pending == 0:
+            self._on_complete()
+
+    def _on_complete(self):
+        duration = time.time() - self.start_time
+        get_actor_stats(TRACE_STATS_NAME).record_method_time(self.kind,
+                                                             duration)
+        _log.info("%s programmed in %.1f ms (%d hops)", self.description,
+                  duration * 1000, self.num_hops)
+        if _log.isEnabledFor(logging.DEBUG):
+            for actor_name, method_name, at, queue_wait, hop_duration in \
+                    self.hops:
+                _log.debug("  %s: %s.%s done at %.1f ms, queue wait %.1f ms, "
+                           "took %.1f ms", self.description, actor_name,
+                           method_name, at * 1000, queue_wait * 1000,
+                           hop_duration * 1000)
+
+    def __str__(self):
+        return self.__class__.__name__ + "<%s,pending=%s>" % (
+            self.description, self.pending)
+
+
+@contextlib.contextmanager
+def start_trace(description, kind):
+    """
+    Context manager that starts a Trace.  Messages sent from inside the
+    context carry the trace.
+
+    :returns Trace: the new trace.
+    """
+    new_trace = Trace(description, kind)
+    context = _greenlet_context()
+    old_traces = context.traces
+    context.traces = (new_trace,)
+    try:
+        yield new_trace
+    finally:
+        context.traces = old_traces
+        new_trace.release()
+
+
+def _batch_traces(batch):
+    """
+    :returns tuple[Trace]: the distinct traces carried by the messages in
+        the batch.
+    """
+    traces = None
+    for msg in batch:
+        if msg.traces:
+            if traces is None:
+                traces = set()
+            traces.update(msg.traces)
+    if traces is None:
+        return _NO_TRACES
+    return tuple(traces)
+
+
 _refs = {}
 _ref_idx = 0
 
+# Source of message IDs.  Much cheaper than generating a UUID per message and
+# unique enough for correlating log lines.
+_msg_ids = itertools.count()
+
 
 class Message(object):
     """
     Message passed to an actor.
     """
-    def __init__(self, method, results, caller_path, recipient,
-                 needs_own_batch):
-        self.uuid = uuid.uuid4().hex[:12]
+    def __init__(self, method, results, caller_info, recipient,
+                 needs_own_batch, merge_key=None, oneway=False,
+                 priority=PRIORITY_NORMAL, traces=_NO_TRACES):
+        """
+        :param caller_info: tuple of (name of calling actor or None,
+            ID of the message the calling actor was processing,
+            (file, line, function) tuple or None).  Only formatted if
+            needed for logging.
+        :param merge_key: None or a key such that this message supersedes
+            any earlier message with the same key.
+        :param oneway: True if the message was sent with oneway=True, so
+            failures must be reported to the recipient rather than to
+            an AsyncResult.
+        :param priority: One of the PRIORITY_* constants.
+        :param traces: Tuple of Traces carried by this message.  The
+            caller should have acquired a reference to each one.
+        """
+        self.uuid = _msg_ids.next()
+        self.enqueue_time = time.time()
         self.method = method
         self.results = results
-        self.caller = caller_path
+        self._caller_info = caller_info
         self.name = method.func.__name__
         self.needs_own_batch = needs_own_batch
+        self.merge_key = merge_key
+        self.oneway = oneway
+        self.priority = priority
+        self.traces = traces
         self.recipient = recipient
 
+    @property
+    def caller(self):
+        """
+        Human-readable description of the sender of this message.
+        """
+        caller_name, caller_msg_id, frame_info = self._caller_info
+        if caller_name is not None:
+            return "%s (processing %s)" % (caller_name, caller_msg_id)
+        calling_file, line_no, func = frame_info
+        return "%s:%s:%s" % (os.path.basename(calling_file), line_no, func)
+
+    def estimate_memory(self):
+        """
+        :returns int: Rough estimate of the number of bytes used by this
+            message and its (top-level) arguments.
+        """
+        partial = self.method
+        total = (sys.getsizeof(self) + sys.getsizeof(self.__dict__) +
+                 sys.getsizeof(partial) + sys.getsizeof(partial.args))
+        for arg in partial.args:
+            total += sys.getsizeof(arg)
+        if partial.keywords:
+            total += sys.getsizeof(partial.keywords)
+            for arg in partial.keywords.itervalues():
+                total += sys.getsizeof(arg)
+        return total
+
     def __str__(self):
         data = ("%s (%s)" % (self.uuid, self.name))
         return data
@@ -454,16 +1216,26 @@ def _exit(rc):
 class TrackedAsyncResult(AsyncResult):
     """
     An AsyncResult that tracks if any exceptions are leaked.
+
+    Tracking only starts once an exception is set, so results that succeed
+    cost no more than a plain AsyncResult.
     """
     def __init__(self, tag):
         super(TrackedAsyncResult, self).__init__()
-        self.__ref = ExceptionTrackingRef(self, _reap_ref)
-        self.__ref.tag = tag
+        self._tag = tag
+        self._msg_id = None
+        self.__ref = None
 
     def set_msg(self, msg):
-        self.__ref.msg = msg
+        # Only store the ID; the message refers to this result so storing
+        # the message itself would create a reference cycle.
+        self._msg_id = msg.uuid
 
     def set_exception(self, exception):
+        if self.__ref is None:
+            self.__ref = ExceptionTrackingRef(self, _reap_ref)
+            self.__ref.tag = self._tag
+            self.__ref.msg = "%s (%s)" % (self._msg_id, self._tag)
         self.__ref.exception = exception
         return super(TrackedAsyncResult, self).set_exception(exception)
 
@@ -473,57 +1245,116 @@ class TrackedAsyncResult(AsyncResult):
                                                          timeout=timeout)
         finally:
             # Someone called get so any exception can't be leaked.  Discard it.
-            self.__ref.exception = None
+            if self.__ref is not None:
+                self.__ref.exception = None
         return result
 
 
-def actor_message(needs_own_batch=False):
+def actor_message(needs_own_batch=False, merge_key=None,
+                  priority=PRIORITY_NORMAL):
+    """
+    Decorator for Actor methods that turns them into messages.
+
+    :param needs_own_batch: True if the message must always be processed
+        in a batch on its own.
+    :param merge_key: Optional function, called with the arguments of the
+        message, returning a key for the state that the message sets.  See
+        the "Merging superseded messages" section of the module docstring.
+    :param priority: PRIORITY_NORMAL or PRIORITY_HIGH.  See the "Priorities"
+        section of the module docstring.
+    """
     def decorator(fn):
         method_name = fn.__name__
         @functools.wraps(fn)
         def queue_fn(self, *args, **kwargs):
-            # Get call information for logging purposes.
-            calling_file, line_no, func, _ = traceback.extract_stack()[-2]
-            calling_file = os.path.basename(calling_file)
-            calling_path = "%s:%s:%s" % (calling_file, line_no, func)
-            try:
-                caller = "%s (processing %s)" % (actor_storage.name,
-                                                 actor_storage.msg_uuid)
-            except AttributeError:
-                caller = calling_path
-
             # Figure out our arguments.
             async_set = "async" in kwargs
             async = kwargs.pop("async", False)
+            oneway = kwargs.pop("oneway", False)
             on_same_greenlet = (self.greenlet == gevent.getcurrent())
 
-            if on_same_greenlet and not async:
+            if on_same_greenlet and not (async or oneway):
                 # Bypass the queue if we're already on the same greenlet, or we
                 # would deadlock by waiting for ourselves.
                 return fn(self, *args, **kwargs)
 
             # async must be specified, unless on the same actor.
-            assert async_set, "All cross-actor event calls must specify async arg."
+            assert async_set or oneway, \
+                "All cross-actor event calls must specify async or oneway arg."
+            assert not (async_set and oneway), \
+                "oneway=True cannot be combined with the async arg."
+
+            # Get call information for logging purposes.  This is on the hot
+            # path so we only grab the raw data here, it gets formatted
+            # lazily if the message is logged.  In particular, we avoid
+            # traceback.extract_stack(), which reads source files.
+            context = getattr(actor_storage, "context", None)
+            if context is not None and context.name is not None:
+                caller_info = (context.name, context.msg_uuid, None)
+            else:
+                frame = sys._getframe(1)
+                caller_info = (None, None, (frame.f_code.co_filename,
+                                            frame.f_lineno,
+                                            frame.f_code.co_name))
+                del frame
 
             if (not on_same_greenlet and
                     not async and
+                    not oneway and
                     _log.isEnabledFor(logging.DEBUG)):
-                _log.debug("BLOCKING CALL: %s", calling_path)
+                _log.debug("BLOCKING CALL: %s", _calling_path(1))
+
+            # Pass on any traces that the sender is carrying.
+            if context is not None:
+                traces = context.traces
+                for t in traces:
+                    t.acquire()
+            else:
+                traces = _NO_TRACES
 
             # OK, so build the message and put it on the queue.
             partial = functools.partial(fn, self, *args, **kwargs)
-            result = TrackedAsyncResult(method_name)
-            msg = Message(partial, [result], caller, self.name,
-                          needs_own_batch=needs_own_batch)
-            result.set_msg(msg)
-
-            _log.debug("Message %s sent by %s to %s, queue length %d",
-                       msg, caller, self.name, self._event_queue.qsize())
+            if oneway:
+                result = None
+                results = []
+            else:
+                result = TrackedAsyncResult(method_name)
+                results = [result]
+            msg = Message(partial, results, caller_info, self.name,
+                          needs_own_batch=needs_own_batch,
+                          merge_key=(merge_key(*args, **kwargs)
+                                     if merge_key else None),
+                          oneway=oneway,
+                          priority=priority,
+                          traces=traces)
+            if result is not None:
+                result.set_msg(msg)
+
+            if _log.isEnabledFor(logging.DEBUG):
+                _log.debug("Message %s sent by %s to %s, queue length %d",
+                           msg, msg.caller, self.name,
+                           self._event_queue.qsize())
             self._event_queue.put(msg, block=False)
-            if async:
+            hwm = self.queue_high_water_mark
+            if (hwm is not None and not on_same_greenlet and
+                    self._event_queue.qsize() > hwm):
+                _mark_congested(self)
+            if oneway:
+                return None
+            elif async:
                 return result
             else:
                 return result.get()
         queue_fn.func = fn
         return queue_fn
     return decorator
+
+
+def _calling_path(depth):
+    """
+    :returns str: file:line:function description of our caller's caller
+        (depth=0), or a caller further up the stack.
+    """
+    frame = sys._getframe(depth + 2)
+    return "%s:%s:%s" % (os.path.basename(frame.f_code.co_filename),
+                         frame.f_lineno, frame.f_code.co_name)
@@ -46,6 +46,33 @@ LOGLEVELS = {"none":      None,
              "crit":      logging.CRITICAL,
              "critical":  logging.CRITICAL}
 
+# Config attributes that are set from etcd by Config.update_config(), and so
+# may change while Felix is running.
+ETCD_ATTRS = ("STARTUP_CLEANUP_DELAY",
+              "METADATA_IP",
+              "METADATA_PORT",
+              "RESYNC_INT_SEC",
+              "MIN_BATCH_DELAY",
+              "MAX_BATCH_DELAY",
+              "IFACE_PREFIX",
+              "SHARD_IP_VERSIONS",
+              "LOGFILE",
+              "LOGLEVFILE",
+              "LOGLEVSYS",
+              "LOGLEVSCR")
+
+# Those that are only read when Felix starts its actors, so changes to them
+# need a restart.
+RESTART_ATTRS = frozenset(["MIN_BATCH_DELAY",
+                           "MAX_BATCH_DELAY",
+                           "SHARD_IP_VERSIONS"])
+
+# Those that are used to configure logging.
+LOGGING_ATTRS = frozenset(["LOGFILE", "LOGLEVFILE", "LOGLEVSYS", "LOGLEVSCR"])
+
+# Those that are used to generate the global nat rules.
+METADATA_ATTRS = frozenset(["METADATA_IP", "METADATA_PORT"])
+
 
 class ConfigException(Exception):
     def __init__(self, message, source):
@@ -90,11 +117,20 @@ class Config(object):
                                            "FelixHostname",
                                            socket.gethostname())
 
+        self.SNAPSHOT_CACHE_PATH = self.get_cfg_entry(
+            "global", "SnapshotCachePath", "/var/lib/calico/felix_snapshot")
+        # As for the log file, "none" disables the snapshot cache.
+        if self.SNAPSHOT_CACHE_PATH.lower() == "none":
+            self.SNAPSHOT_CACHE_PATH = None
+
         self.STARTUP_CLEANUP_DELAY = 30
         self.METADATA_IP = "127.0.0.1"
         self.METADATA_PORT = "8775"
         self.RESYNC_INT_SEC = 1800
+        self.MIN_BATCH_DELAY = 0.0
+        self.MAX_BATCH_DELAY = 0.1
         self.IFACE_PREFIX = None
+        self.SHARD_IP_VERSIONS = False
         self.LOGFILE = "/var/log/calico/felix.log"
         self.LOGLEVFILE = "INFO"
         self.LOGLEVSYS = "ERROR"
@@ -105,12 +141,18 @@ class Config(object):
         self.LOGLEVSCR = LOGLEVELS.get(self.LOGLEVSCR.lower(), logging.DEBUG)
 
     def update_config(self, cfg_dict):
-        self.STARTUP_CLEANUP_DELAY = int(cfg_dict.pop("StartupCleanupDelay",
-                                                      "30"))
+        self.STARTUP_CLEANUP_DELAY = self._pop_int(cfg_dict,
+                                                   "StartupCleanupDelay", "30")
         self.METADATA_IP = cfg_dict.pop("MetadataAddr", "127.0.0.1")
         self.METADATA_PORT = cfg_dict.pop("MetadataPort", "8775")
-        self.RESYNC_INT_SEC = int(cfg_dict.pop("ResyncIntervalSecs", "1800"))
+        self.RESYNC_INT_SEC = self._pop_int(cfg_dict, "ResyncIntervalSecs",
+                                            "1800")
+        self.MIN_BATCH_DELAY = self._pop_int(cfg_dict, "MinBatchDelayMillis",
+                                             "0") / 1000.0
+        self.MAX_BATCH_DELAY = self._pop_int(cfg_dict, "MaxBatchDelayMillis",
+                                             "100") / 1000.0
         self.IFACE_PREFIX = cfg_dict.pop("InterfacePrefix", None)
+        self.SHARD_IP_VERSIONS = cfg_dict.pop("ShardIpVersions", "false")
         self.LOGFILE = cfg_dict.pop("LogFilePath", "/var/log/calico/felix.log")
         self.LOGLEVFILE = cfg_dict.pop("LogSeverityFile", "INFO")
         self.LOGLEVSYS = cfg_dict.pop("LogSeveritySys", "ERROR")
@@ -124,6 +166,33 @@ class Config(object):
 
         self.warn_unused_cfg(cfg_dict)
 
+    def _pop_int(self, cfg_dict, name, default):
+        """
+        Removes an integer item from the config dict.
+
+        :raises ConfigException: if the value isn't an integer.
+        """
+        value = cfg_dict.pop(name, default)
+        try:
+            return int(value)
+        except ValueError:
+            raise ConfigException("Invalid %s value : %s" % (name, value),
+                                  "etcd:/calico/config/%s" % name)
+
+    def changed_etcd_attrs(self, other):
+        """
+        Compares the config that came from etcd with that of another Config.
+
+        :returns dict: map from name to other's value for each attribute in
+            ETCD_ATTRS that differs.
+        """
+        changes = {}
+        for attr in ETCD_ATTRS:
+            value = getattr(other, attr)
+            if getattr(self, attr) != value:
+                changes[attr] = value
+        return changes
+
     def read_cfg_file(self, config_file):
         self._parser = ConfigParser.ConfigParser()
         self._parser.read(config_file)
@@ -183,6 +252,25 @@ class Config(object):
                                       "etcd:/calico/config/MetadataPort")
 
 
+        # Zero disables periodic resyncs.
+        if self.RESYNC_INT_SEC < 0:
+            raise ConfigException("Invalid ResyncIntervalSecs value : %s" %
+                                  self.RESYNC_INT_SEC,
+                                  "etcd:/calico/config/ResyncIntervalSecs")
+
+        if not 0 <= self.MIN_BATCH_DELAY <= self.MAX_BATCH_DELAY:
+            raise ConfigException("Invalid MinBatchDelayMillis/"
+                                  "MaxBatchDelayMillis values : %s/%s" %
+                                  (int(self.MIN_BATCH_DELAY * 1000),
+                                   int(self.MAX_BATCH_DELAY * 1000)),
+                                  "etcd:/calico/config/MinBatchDelayMillis")
+
+        if self.SHARD_IP_VERSIONS.lower() not in ("true", "false"):
+            raise ConfigException("Invalid ShardIpVersions value : %s" %
+                                  self.SHARD_IP_VERSIONS,
+                                  "etcd:/calico/config/ShardIpVersions")
+        self.SHARD_IP_VERSIONS = (self.SHARD_IP_VERSIONS.lower() == "true")
+
         if self.IFACE_PREFIX is None:
             raise ConfigException("Missing InterfacePrefix value",
                                   "etcd:/calico/config/InterfacePrefix")
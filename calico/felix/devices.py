@@ -303,6 +303,6 @@ class InterfaceWatcher(Actor):
                     if msg_type == RTM_NEWLINK:
                         _log.debug("Detected new network interface : %s", rta_data)
                         self.update_splitter.on_interface_update(rta_data,
-                                                                 async=True)
+                                                                 oneway=True)
                     else:
                         _log.debug("Network interface has gone away : %s", rta_data)
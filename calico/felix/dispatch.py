@@ -20,7 +20,7 @@ Actor that controls the top-level dispatch chains that dispatch to
 per-endpoint chains.
 """
 import logging
-from calico.felix.actor import Actor, actor_message
+from calico.felix.actor import Actor, actor_message, AdaptiveBatchDelay
 from calico.felix.frules import CHAIN_TO_ENDPOINT, CHAIN_FROM_ENDPOINT
 
 _log = logging.getLogger(__name__)
@@ -35,35 +35,39 @@ class DispatchChains(Actor):
     add/remove them from the chains.
     """
 
-    batch_delay = 0.1
-
     def __init__(self, config, ip_version, iptables_updater):
         super(DispatchChains, self).__init__(qualifier="v%d" % ip_version)
         self.config = config
+        self.batch_delay_policy = AdaptiveBatchDelay(config.MIN_BATCH_DELAY,
+                                                     config.MAX_BATCH_DELAY)
         self.ip_version = ip_version
         self.iptables_updater = iptables_updater
-        self.iface_to_ep_id = {}
+        # Maps from interface name to the suffix of its endpoint's chains.
+        # The suffix comes from the LocalEndpoint, rather than being
+        # recalculated from the config, so that it still matches the
+        # endpoint's chains if the interface prefix changes.
+        self.iface_to_suffix = {}
         self._dirty = False
 
     @actor_message()
-    def apply_snapshot(self, iface_to_ep_id):
+    def apply_snapshot(self, iface_to_suffix):
         """
         Replaces all known interface/endpoint mappings with the given
         snapshot and rewrites the chain.
 
-        :param dict[str,str] iface_to_ep_id: Mapping from interface name
-            to endpoint ID.  this class converts the endpoint ID to the
-            names of the relevant chains.
+        :param dict[str,str] iface_to_suffix: Mapping from interface name
+            to the suffix of the endpoint's chain names, as returned by
+            interface_to_suffix().
         """
         _log.info("Applying dispatch chains snapshot.")
-        self.iface_to_ep_id = dict(iface_to_ep_id)  # Take a copy.
+        self.iface_to_suffix = dict(iface_to_suffix)  # Take a copy.
         # Always reprogram the chain, even if it's empty.  This makes sure that
         # we resync and it stops the iptables layer from marking our chain as
         # missing.
         self._dirty = True
 
-    @actor_message()
-    def on_endpoint_added(self, iface_name, endpoint_id):
+    @actor_message(merge_key=lambda iface_name, *_: iface_name)
+    def on_endpoint_added(self, iface_name, suffix):
         """
         Message sent to us by the LocalEndpoint to tell us we should
         add it to the dispatch chain.
@@ -72,15 +76,15 @@ class DispatchChains(Actor):
         chain.
 
         :param iface_name: name of the linux interface.
-        :param endpoint_id: ID of the endpoint, used to form the
-            chain names.
+        :param suffix: suffix of the endpoint's chain names, used to form
+            the chain names.
         """
-        _log.debug("%s ready: %s/%s", self, iface_name, endpoint_id)
-        if self.iface_to_ep_id.get(iface_name) != endpoint_id:
-            self.iface_to_ep_id[iface_name] = endpoint_id
+        _log.debug("%s ready: %s/%s", self, iface_name, suffix)
+        if self.iface_to_suffix.get(iface_name) != suffix:
+            self.iface_to_suffix[iface_name] = suffix
             self._dirty = True
 
-    @actor_message()
+    @actor_message(merge_key=lambda iface_name: iface_name)
     def on_endpoint_removed(self, iface_name):
         """
         Removes the mapping for the given interface name.
@@ -90,7 +94,7 @@ class DispatchChains(Actor):
         _log.debug("%s asked to remove dispatch rule %s", self, iface_name)
         # It should be present but be defensive and reprogram the chain
         # just in case if not.
-        self.iface_to_ep_id.pop(iface_name, None)
+        self.iface_to_suffix.pop(iface_name, None)
         self._dirty = True
 
     def _finish_msg_batch(self, batch, results):
@@ -106,7 +110,7 @@ class DispatchChains(Actor):
         Synchronous, doesn't return until the chain is in place.
         """
         _log.info("%s Updating dispatch chain, num entries: %s", self,
-                  len(self.iface_to_ep_id))
+                  len(self.iface_to_suffix))
         to_upds = []
         from_upds = []
         updates = {CHAIN_TO_ENDPOINT: to_upds,
@@ -115,13 +119,12 @@ class DispatchChains(Actor):
         from_deps = set()
         dependencies = {CHAIN_TO_ENDPOINT: to_deps,
                         CHAIN_FROM_ENDPOINT: from_deps}
-        from calico.felix.endpoint import chain_names, interface_to_suffix
-        for iface in self.iface_to_ep_id:
+        from calico.felix.endpoint import chain_names
+        for iface, ep_suffix in self.iface_to_suffix.iteritems():
             # Add rule to global chain to direct traffic to the
             # endpoint-specific one.  Note that we use --goto, which means
             # that the endpoint-specific chain will return to our parent
             # rather than to this chain.
-            ep_suffix = interface_to_suffix(self.config, iface)
             to_chain_name, from_chain_name = chain_names(ep_suffix)
             from_upds.append("--append %s --in-interface %s --goto %s" %
                              (CHAIN_FROM_ENDPOINT, iface, from_chain_name))
@@ -140,4 +143,4 @@ class DispatchChains(Actor):
 
     def __str__(self):
         return self.__class__.__name__ + "<ipv%s,entries=%s>" % \
-            (self.ip_version, len(self.iface_to_ep_id))
\ No newline at end of file
+            (self.ip_version, len(self.iface_to_suffix))
\ No newline at end of file
@@ -22,7 +22,7 @@ Endpoint management.
 import logging
 from subprocess import CalledProcessError
 from calico.felix import devices, futils
-from calico.felix.actor import actor_message
+from calico.felix.actor import actor_message, PRIORITY_HIGH
 from calico.felix.futils import FailedSystemCall
 from calico.felix.futils import IPV4
 from calico.felix.refcount import ReferenceManager, RefCountedActor
@@ -51,7 +51,7 @@ class EndpointManager(ReferenceManager):
         self.dispatch_chains = dispatch_chains
         self.rules_mgr = rules_manager
 
-        # All endpoint dicts that we know about.
+        # All Endpoints that we know about.
         self.endpoints_by_id = {}
         self.endpoint_id_by_iface_name = {}
 
@@ -76,7 +76,7 @@ class EndpointManager(ReferenceManager):
         Overrides ReferenceManager._on_object_started
         """
         ep = self.endpoints_by_id.get(endpoint_id)
-        obj.on_endpoint_update(ep, async=True)
+        obj.on_endpoint_update(ep, oneway=True)
 
     @actor_message()
     def apply_snapshot(self, endpoints_by_id):
@@ -84,11 +84,12 @@ class EndpointManager(ReferenceManager):
 
         # Tell the dispatch chains about the local endpoints in advance so
         # that we don't flap the dispatch chain at start-of-day.
-        local_iface_name_to_ep_id = {}
+        local_iface_name_to_suffix = {}
         for ep_id, ep in endpoints_by_id.iteritems():
-            if ep and ep["host"] == self.config.HOSTNAME and ep.get("name"):
-                local_iface_name_to_ep_id[ep.get("name")] = ep_id
-        self.dispatch_chains.apply_snapshot(local_iface_name_to_ep_id,
+            if ep and ep.host == self.config.HOSTNAME and ep.name:
+                local_iface_name_to_suffix[ep.name] = \
+                    interface_to_suffix(self.config, ep.name)
+        self.dispatch_chains.apply_snapshot(local_iface_name_to_suffix,
                                             async=True)
 
         for endpoint_id, endpoint in endpoints_by_id.iteritems():
@@ -106,20 +107,21 @@ class EndpointManager(ReferenceManager):
         or deletion).
 
         :param str endpoint_id: The endpoint ID in question.
-        :endpoint dict[str]: Dictionary of all endpoint data. If None, the
-                             endpoint is to be deleted.
+        :param Endpoint endpoint: The endpoint data. If None, the
+                                  endpoint is to be deleted.
         """
         if self._is_starting_or_live(endpoint_id):
             # Local endpoint thread is running; tell it of the change.
             _log.info("Update for live endpoint %s", endpoint_id)
             self.objects_by_id[endpoint_id].on_endpoint_update(endpoint,
-                                                               async=True)
+                                                               oneway=True)
         if endpoint is None:
             # Deletion. Remove from the list.
             _log.info("Endpoint %s deleted", endpoint_id)
-            old_ep = self.endpoints_by_id.pop(endpoint_id, {})
-            if old_ep.get("name") in self.endpoint_id_by_iface_name:
-                self.endpoint_id_by_iface_name.pop(old_ep.get("name"))
+            old_ep = self.endpoints_by_id.pop(endpoint_id, None)
+            if (old_ep is not None and
+                    old_ep.name in self.endpoint_id_by_iface_name):
+                self.endpoint_id_by_iface_name.pop(old_ep.name)
             if endpoint_id in self.local_endpoint_ids:
                 self.decref(endpoint_id)
                 self.local_endpoint_ids.remove(endpoint_id)
@@ -127,9 +129,9 @@ class EndpointManager(ReferenceManager):
             # Creation or modification
             _log.info("Endpoint %s modified or created", endpoint_id)
             self.endpoints_by_id[endpoint_id] = endpoint
-            self.endpoint_id_by_iface_name[endpoint["name"]] = endpoint_id
+            self.endpoint_id_by_iface_name[endpoint.name] = endpoint_id
 
-        if endpoint and endpoint["host"] == self.config.HOSTNAME:
+        if endpoint and endpoint.host == self.config.HOSTNAME:
             _log.debug("Endpoint is local, ensuring it is active.")
             if endpoint_id not in self.local_endpoint_ids:
                 # This will trigger _on_object_activated to pass the endpoint
@@ -137,7 +139,7 @@ class EndpointManager(ReferenceManager):
                 self.local_endpoint_ids.add(endpoint_id)
                 self.get_and_incref(endpoint_id)
 
-    @actor_message()
+    @actor_message(priority=PRIORITY_HIGH)
     def on_interface_update(self, name):
         """
         Called when an interface is created or changes state.
@@ -152,7 +154,7 @@ class EndpointManager(ReferenceManager):
             if self._is_starting_or_live(endpoint_id):
                 # LocalEndpoint is running, so tell it about the change.
                 ep = self.objects_by_id[endpoint_id]
-                ep.on_interface_update(async=True)
+                ep.on_interface_update(oneway=True)
 
         except KeyError:
             _log.debug("Update on interface %s that we do not care about",
@@ -193,19 +195,20 @@ class LocalEndpoint(RefCountedActor):
     def on_endpoint_update(self, endpoint):
         """
         Called when this endpoint has received an update.
-        :param dict[str] endpoint: endpoint parameter dictionary.
+        :param Endpoint endpoint: the endpoint's data, or None if it has
+            been deleted.
         """
         _log.info("%s updated: %s", self, endpoint)
         if endpoint and not self.endpoint:
             # This is the first time we have seen the endpoint, so extract the
             # interface name and endpoint ID.
-            self._iface_name = endpoint["name"]
+            self._iface_name = endpoint.name
             self._suffix = interface_to_suffix(self.config,
                                                self._iface_name)
         was_ready = self._ready
 
-        old_profile_id = self.endpoint and self.endpoint["profile_id"]
-        new_profile_id = endpoint and endpoint["profile_id"]
+        old_profile_id = self.endpoint and self.endpoint.profile_id
+        new_profile_id = endpoint and endpoint.profile_id
         if old_profile_id != new_profile_id:
             if old_profile_id:
                 # Clean up the old profile.
@@ -242,12 +245,18 @@ class LocalEndpoint(RefCountedActor):
         assert not self._ready, "Should be deleted before being unreffed."
         self._notify_cleanup_complete()
 
-    @actor_message()
+    @actor_message(priority=PRIORITY_HIGH)
     def on_interface_update(self):
         """
         Actor event to report that the interface is either up or changed.
         """
         _log.info("Endpoint %s received interface kick", self.endpoint_id)
+        if not self.endpoint:
+            # Being high priority, the kick can overtake our first endpoint
+            # update, which will configure the interface anyway.
+            _log.info("No endpoint data yet for %s, ignoring kick",
+                      self.endpoint_id)
+            return
         self._configure_interface()
 
     @property
@@ -258,9 +267,9 @@ class LocalEndpoint(RefCountedActor):
         missing_deps = []
         if not self.endpoint:
             missing_deps.append("endpoint")
-        elif self.endpoint.get("state", "active") != "active":
+        elif self.endpoint.state != "active":
             missing_deps.append("endpoint active")
-        elif not self.endpoint.get("profile_id"):
+        elif not self.endpoint.profile_id:
             missing_deps.append("profile")
         return missing_deps
 
@@ -292,7 +301,7 @@ class LocalEndpoint(RefCountedActor):
                 _log.info("%s became ready to program.", self)
                 self._update_chains()
                 self.dispatch_chains.on_endpoint_added(
-                    self._iface_name, self.endpoint_id, async=True)
+                    self._iface_name, self._suffix, oneway=True)
             else:
                 # We were active but now we're not, withdraw the dispatch rule
                 # and our chain.  We must do this to allow iptables to remove
@@ -301,7 +310,7 @@ class LocalEndpoint(RefCountedActor):
                 self._failed = False  # Don't care any more.
 
                 self.dispatch_chains.on_endpoint_removed(ifce_name,
-                                                         async=True)
+                                                         oneway=True)
                 self._remove_chains()
             self._dirty = False
 
@@ -310,9 +319,9 @@ class LocalEndpoint(RefCountedActor):
             self._suffix,
             self._iface_name,
             self.ip_version,
-            self.endpoint.get("ipv%s_nets" % self.ip_version, []),
-            self.endpoint["mac"],
-            self.endpoint["profile_id"])
+            self.endpoint.nets(self.ip_version),
+            self.endpoint.mac,
+            self.endpoint.profile_id)
         try:
             self.iptables_updater.rewrite_chains(updates, deps, async=False)
         except CalledProcessError:
@@ -335,18 +344,14 @@ class LocalEndpoint(RefCountedActor):
         try:
             if self.ip_type == IPV4:
                 devices.configure_interface_ipv4(self._iface_name)
-                nets_key = "ipv4_nets"
             else:
-                ipv6_gw = self.endpoint.get("ipv6_gateway", None)
+                ipv6_gw = self.endpoint.ipv6_gateway
                 devices.configure_interface_ipv6(self._iface_name, ipv6_gw)
-                nets_key = "ipv6_nets"
 
-            ips = set()
-            for ip in self.endpoint.get(nets_key, []):
-                ips.add(futils.net_to_ip(ip))
+            ips = set(self.endpoint.ips(self.ip_version))
             devices.set_routes(self.ip_type, ips,
                                self._iface_name,
-                               self.endpoint["mac"])
+                               self.endpoint.mac)
 
         except (IOError, FailedSystemCall, CalledProcessError):
             if not devices.interface_exists(self._iface_name):
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Metaswitch Networks
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+felix.endpointdata
+~~~~~~~~~~~~~~~~~~
+
+Compact, immutable representation of an endpoint.
+
+A cluster may have hundreds of thousands of endpoints and each one is held
+by the IpsetManager and EndpointManager of both IP versions, so we hold
+them in a __slots__ class, rather than as the dicts decoded from etcd, and
+share the same (immutable) object between all the actors.
+"""
+import logging
+
+from calico.felix import futils
+
+_log = logging.getLogger(__name__)
+
+
+class Endpoint(object):
+    """
+    An endpoint, as read from etcd.
+
+    Endpoints on other hosts are only used for ipset membership, so they
+    only have their host, profile ID and IPs; the other fields are None or
+    empty.
+    """
+    __slots__ = ("id", "host", "profile_id", "ipv4_ips", "ipv6_ips",
+                 "ipv4_nets", "ipv6_nets", "name", "mac", "state",
+                 "ipv6_gateway")
+
+    def __init__(self, endpoint_id, host, profile_id, ipv4_ips=(),
+                 ipv6_ips=(), ipv4_nets=(), ipv6_nets=(), name=None,
+                 mac=None, state=None, ipv6_gateway=None):
+        """
+        Arguments are as the attributes; see from_dict() for the meaning
+        of each.
+        """
+        setattr_ = super(Endpoint, self).__setattr__
+        setattr_("id", endpoint_id)
+        setattr_("host", host)
+        setattr_("profile_id", profile_id)
+        setattr_("ipv4_ips", ipv4_ips)
+        setattr_("ipv6_ips", ipv6_ips)
+        setattr_("ipv4_nets", ipv4_nets)
+        setattr_("ipv6_nets", ipv6_nets)
+        setattr_("name", name)
+        setattr_("mac", mac)
+        setattr_("state", state)
+        setattr_("ipv6_gateway", ipv6_gateway)
+
+    @classmethod
+    def from_dict(cls, endpoint_id, host, data, local=True):
+        """
+        Creates an Endpoint from a validated endpoint dict, as stored in
+        etcd.
+
+        :param str endpoint_id: The endpoint's ID.
+        :param str host: The hostname of the host that owns the endpoint.
+        :param dict data: The decoded JSON from etcd.
+        :param bool local: True if the endpoint is on this host.  If False,
+            only the fields needed for ipset membership are kept.
+        """
+        ipv4_nets = tuple(data.get("ipv4_nets", ()))
+        ipv6_nets = tuple(data.get("ipv6_nets", ()))
+        ipv4_ips = tuple(map(futils.net_to_ip, ipv4_nets))
+        ipv6_ips = tuple(map(futils.net_to_ip, ipv6_nets))
+        host = futils.intern_if_ascii(host)
+        profile_id = futils.intern_if_ascii(data["profile_id"])
+        if not local:
+            return cls(endpoint_id, host, profile_id, ipv4_ips=ipv4_ips,
+                       ipv6_ips=ipv6_ips)
+        return cls(endpoint_id, host, profile_id,
+                   ipv4_ips=ipv4_ips,
+                   ipv6_ips=ipv6_ips,
+                   ipv4_nets=ipv4_nets,
+                   ipv6_nets=ipv6_nets,
+                   name=data.get("name"),
+                   mac=data.get("mac"),
+                   state=futils.intern_if_ascii(data.get("state", "active")),
+                   ipv6_gateway=data.get("ipv6_gateway"))
+
+    def ips(self, ip_version):
+        """
+        :returns tuple[str]: The IP addresses of the endpoint (without
+            prefix lengths) for the given IP version.
+        """
+        return self.ipv4_ips if ip_version == 4 else self.ipv6_ips
+
+    def nets(self, ip_version):
+        """
+        :returns tuple[str]: The IP networks of the endpoint for the given
+            IP version.  Empty for endpoints on other hosts.
+        """
+        return self.ipv4_nets if ip_version == 4 else self.ipv6_nets
+
+    def _key(self):
+        return tuple(getattr(self, attr) for attr in self.__slots__)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Endpoint is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Endpoint is immutable")
+
+    def __reduce__(self):
+        # Default pickling of a __slots__ class uses setattr.
+        return self.__class__, self._key()
+
+    def __eq__(self, other):
+        if not isinstance(other, Endpoint):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return "Endpoint(%s)" % ", ".join("%s=%r" % (attr, getattr(self, attr))
+                                          for attr in self.__slots__)
@@ -24,16 +24,20 @@ The main logic for Felix.
 from gevent import monkey
 monkey.patch_all()
 
+import functools
 import logging
 import os
+import signal
 
 import gevent
 
 from calico import common
+from calico.felix.actor import dump_actor_stats
 from calico.felix.fiptables import IptablesUpdater
 from calico.felix.dispatch import DispatchChains
 from calico.felix.profilerules import RulesManager
-from calico.felix.frules import install_global_rules
+from calico.felix.frules import (install_global_rules,
+                                  install_global_filter_rules)
 from calico.felix.splitter import UpdateSplitter
 from calico.felix.config import Config
 from calico.felix.futils import IPV4, IPV6
@@ -41,10 +45,50 @@ from calico.felix.devices import InterfaceWatcher
 from calico.felix.endpoint import EndpointManager
 from calico.felix.fetcd import EtcdWatcher
 from calico.felix.ipsets import IpsetManager
+from calico.felix.ipc import (RemoteSplitter, serve_splitter, start_worker,
+                              wait_for_exit)
 
 _log = logging.getLogger(__name__)
 
 
+def _create_pipeline(config, ip_version, filter_updater):
+    """
+    Creates the actors that program the dataplane for one IP version.
+
+    :returns tuple: (ipset manager, rules manager, dispatch chains,
+        endpoint manager).
+    """
+    ip_type = IPV4 if ip_version == 4 else IPV6
+    ipset_mgr = IpsetManager(ip_type)
+    rules_manager = RulesManager(ip_version, filter_updater, ipset_mgr)
+    dispatch_chains = DispatchChains(config, ip_version, filter_updater)
+    ep_manager = EndpointManager(config,
+                                 ip_type,
+                                 filter_updater,
+                                 dispatch_chains,
+                                 rules_manager)
+    return ipset_mgr, rules_manager, dispatch_chains, ep_manager
+
+
+def _wait_for_failure(monitored_items):
+    """
+    Waits for one of the monitored greenlets/AsyncResults to finish.
+    Doesn't return normally, since they should never finish.
+    """
+    _log.info("All top-level actors started, waiting on failures...")
+    stopped_greenlets_iter = gevent.iwait(monitored_items)
+
+    stopped_greenlet = next(stopped_greenlets_iter)
+    try:
+        stopped_greenlet.get()
+    except Exception:
+        _log.exception("Greenlet failed: %s", stopped_greenlet)
+        raise
+    else:
+        _log.error("Greenlet %s unexpectedly returned.", stopped_greenlet)
+        raise AssertionError("Greenlet unexpectedly returned")
+
+
 def _main_greenlet(config):
     """
     The root of our tree of greenlets.  Responsible for restarting
@@ -55,77 +99,90 @@ def _main_greenlet(config):
         etcd_watcher = EtcdWatcher(config)
         etcd_watcher.start()
         # Ask the EtcdWatcher to fill in the global config object before we
-        # proceed.  We don't yet support config updates.
+        # proceed.  Later changes are applied by the EtcdWatcher and the
+        # UpdateSplitter.
         etcd_watcher.load_config(async=False)
 
+        remote_splitters = []
+        if config.SHARD_IP_VERSIONS:
+            # Run the IPv6 pipeline in its own process so that it gets its
+            # own core.  We fork before starting any more actors so that the
+            # worker doesn't inherit them.
+            _log.info("Main greenlet: Starting IPv6 worker process.")
+            _, worker_sock = start_worker(
+                functools.partial(_v6_worker_main, config)
+            )
+            remote_splitters.append(RemoteSplitter(worker_sock,
+                                                   qualifier="v6"))
+
         _log.info("Main greenlet: Configuration loaded, starting remaining "
                   "actors...")
-        v4_filter_updater = IptablesUpdater("filter", ip_version=4)
-        v4_nat_updater = IptablesUpdater("nat", ip_version=4)
-        v4_ipset_mgr = IpsetManager(IPV4)
-        v4_rules_manager = RulesManager(4, v4_filter_updater, v4_ipset_mgr)
-        v4_dispatch_chains = DispatchChains(config, 4, v4_filter_updater)
-        v4_ep_manager = EndpointManager(config,
-                                        IPV4,
-                                        v4_filter_updater,
-                                        v4_dispatch_chains,
-                                        v4_rules_manager)
-
-        v6_filter_updater = IptablesUpdater("filter", ip_version=6)
-        v6_ipset_mgr = IpsetManager(IPV6)
-        v6_rules_manager = RulesManager(6, v6_filter_updater, v6_ipset_mgr)
-        v6_dispatch_chains = DispatchChains(config, 6, v6_filter_updater)
-        v6_ep_manager = EndpointManager(config,
-                                        IPV6,
-                                        v6_filter_updater,
-                                        v6_dispatch_chains,
-                                        v6_rules_manager)
+        v4_filter_updater = IptablesUpdater("filter", config, ip_version=4)
+        v4_nat_updater = IptablesUpdater("nat", config, ip_version=4)
+        v4_ipset_mgr, v4_rules_manager, v4_dispatch_chains, v4_ep_manager = \
+            _create_pipeline(config, 4, v4_filter_updater)
+        ipset_mgrs = [v4_ipset_mgr]
+        rules_managers = [v4_rules_manager]
+        ep_managers = [v4_ep_manager]
+        filter_updaters = [v4_filter_updater]
+        actors = [
+            v4_filter_updater,
+            v4_nat_updater,
+            v4_ipset_mgr,
+            v4_rules_manager,
+            v4_dispatch_chains,
+            v4_ep_manager,
+        ]
+
+        if config.SHARD_IP_VERSIONS:
+            v6_filter_updater = None
+        else:
+            v6_filter_updater = IptablesUpdater("filter", config,
+                                                ip_version=6)
+            (v6_ipset_mgr, v6_rules_manager, v6_dispatch_chains,
+             v6_ep_manager) = _create_pipeline(config, 6, v6_filter_updater)
+            ipset_mgrs.append(v6_ipset_mgr)
+            rules_managers.append(v6_rules_manager)
+            ep_managers.append(v6_ep_manager)
+            filter_updaters.append(v6_filter_updater)
+            actors.extend([
+                v6_filter_updater,
+                v6_ipset_mgr,
+                v6_rules_manager,
+                v6_dispatch_chains,
+                v6_ep_manager,
+            ])
+        actors.extend(remote_splitters)
 
         update_splitter = UpdateSplitter(config,
-                                         [v4_ipset_mgr, v6_ipset_mgr],
-                                         [v4_rules_manager, v6_rules_manager],
-                                         [v4_ep_manager, v6_ep_manager],
-                                         [v4_filter_updater, v6_filter_updater])
+                                         ipset_mgrs,
+                                         rules_managers,
+                                         ep_managers,
+                                         filter_updaters,
+                                         remote_splitters=remote_splitters,
+                                         nat_updaters=[v4_nat_updater])
         iface_watcher = InterfaceWatcher(update_splitter)
 
         _log.info("Starting actors.")
         update_splitter.start()
-
-        v4_filter_updater.start()
-        v4_nat_updater.start()
-        v4_ipset_mgr.start()
-        v4_rules_manager.start()
-        v4_dispatch_chains.start()
-        v4_ep_manager.start()
-
-        v6_filter_updater.start()
-        v6_ipset_mgr.start()
-        v6_rules_manager.start()
-        v6_dispatch_chains.start()
-        v6_ep_manager.start()
-
+        for actor in actors:
+            actor.start()
         iface_watcher.start()
 
-        monitored_items = [
-            update_splitter.greenlet,
-
-            v4_nat_updater.greenlet,
-            v4_filter_updater.greenlet,
-            v4_nat_updater.greenlet,
-            v4_ipset_mgr.greenlet,
-            v4_rules_manager.greenlet,
-            v4_dispatch_chains.greenlet,
-            v4_ep_manager.greenlet,
-
-            v6_filter_updater.greenlet,
-            v6_ipset_mgr.greenlet,
-            v6_rules_manager.greenlet,
-            v6_dispatch_chains.greenlet,
-            v6_ep_manager.greenlet,
+        # Allow the operator to dump the per-actor stats to the log with
+        # "kill -USR1".
+        gevent.signal(signal.SIGUSR1, dump_actor_stats)
 
+        monitored_items = [update_splitter.greenlet]
+        monitored_items.extend(a.greenlet for a in actors)
+        monitored_items.extend([
             iface_watcher.greenlet,
             etcd_watcher.greenlet
-        ]
+        ])
+        if remote_splitters:
+            # Felix can't work without its worker so, if the worker exits,
+            # fail.
+            monitored_items.append(gevent.spawn(wait_for_exit, worker_sock))
 
         # Install the global rules before we start polling for updates.
         _log.info("Installing global rules.")
@@ -141,23 +198,48 @@ def _main_greenlet(config):
         monitored_items.append(f)
 
         # Wait for something to fail.
-        _log.info("All top-level actors started, waiting on failures...")
-        stopped_greenlets_iter = gevent.iwait(monitored_items)
-
-        stopped_greenlet = next(stopped_greenlets_iter)
-        try:
-            stopped_greenlet.get()
-        except Exception:
-            _log.exception("Greenlet failed: %s", stopped_greenlet)
-            raise
-        else:
-            _log.error("Greenlet %s unexpectedly returned.", stopped_greenlet)
-            raise AssertionError("Greenlet unexpectedly returned")
+        _wait_for_failure(monitored_items)
     except:
         _log.exception("Exception killing main greenlet")
         raise
 
 
+def _v6_worker_main(config, sock):
+    """
+    Main function of the IPv6 worker process, used if ShardIpVersions is
+    set.  Runs the IPv6 pipeline, fed with updates from the main process
+    over the IPC channel.  Doesn't return normally.
+    """
+    _log.info("IPv6 worker process starting actors.")
+    v6_filter_updater = IptablesUpdater("filter", config, ip_version=6)
+    v6_ipset_mgr, v6_rules_manager, v6_dispatch_chains, v6_ep_manager = \
+        _create_pipeline(config, 6, v6_filter_updater)
+    update_splitter = UpdateSplitter(config,
+                                     [v6_ipset_mgr],
+                                     [v6_rules_manager],
+                                     [v6_ep_manager],
+                                     [v6_filter_updater])
+    actors = [
+        update_splitter,
+        v6_filter_updater,
+        v6_ipset_mgr,
+        v6_rules_manager,
+        v6_dispatch_chains,
+        v6_ep_manager,
+    ]
+    for actor in actors:
+        actor.start()
+    gevent.signal(signal.SIGUSR1, dump_actor_stats)
+
+    _log.info("IPv6 worker process installing global rules.")
+    install_global_filter_rules(config, v6_filter_updater)
+
+    monitored_items = [a.greenlet for a in actors]
+    monitored_items.append(gevent.spawn(serve_splitter, sock,
+                                        update_splitter))
+    _wait_for_failure(monitored_items)
+
+
 def main():
     try:
         # Initialise the logging with default parameters.
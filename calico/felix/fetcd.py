@@ -18,6 +18,7 @@ felix.fetcd
 
 Etcd polling functions.
 """
+import copy
 from socket import timeout as SocketTimeout
 from etcd import (EtcdException, EtcdClusterIdChanged, EtcdKeyNotFound,
                   EtcdEventIndexCleared)
@@ -25,7 +26,10 @@ import etcd
 import httplib
 import json
 import logging
+import random
+import time
 import gevent
+from gevent.queue import Empty, Queue
 from types import StringTypes
 from urllib3 import Timeout
 import urllib3.exceptions
@@ -35,14 +39,67 @@ from calico import common
 from calico.datamodel_v1 import (VERSION_DIR, READY_KEY, CONFIG_DIR,
                                  RULES_KEY_RE, TAGS_KEY_RE, ENDPOINT_KEY_RE,
                                  dir_for_per_host_config,
+                                 key_for_profile_rules, key_for_profile_tags,
                                  get_profile_id_for_profile_dir, dir_for_host,
-                                 PROFILE_DIR, HOST_DIR)
-from calico.felix.actor import Actor, actor_message
+                                 PROFILE_DIR, HOST_DIR, POLICY_DIR)
+from calico.felix import futils, snapshotcache
+from calico.felix.actor import (Actor, actor_message, start_trace,
+                                wait_for_backpressure)
+from calico.felix.config import ConfigException, RESTART_ATTRS
+from calico.felix.endpointdata import Endpoint
 
 _log = logging.getLogger(__name__)
 
 
-RETRY_DELAY = 5
+SNAPSHOT_SAVE_INTERVAL = 60
+"""
+Minimum interval, in seconds, between saves of the snapshot cache.  Saving
+takes a few seconds for a large cluster.
+"""
+
+MIN_RETRY_DELAY = 1
+"""Initial delay, in seconds, before retrying a failed request to etcd."""
+MAX_RETRY_DELAY = 30
+"""Maximum delay, in seconds, before retrying a failed request to etcd."""
+
+
+def _urllib3_reuses_timed_out_connections():
+    """
+    :returns bool: True if this version of urllib3 puts connections that hit
+        a read timeout back in the pool.  We saw that with urllib3 1.7.1;
+        later versions close the connection instead.
+    """
+    try:
+        version = tuple(int(part) for part in
+                        urllib3.__version__.split(".")[:2])
+    except (AttributeError, ValueError):
+        return True
+    return version < (1, 8)
+
+RECONNECT_AFTER_TIMEOUT = _urllib3_reuses_timed_out_connections()
+"""
+Whether to replace the etcd client after a long-poll times out.  Otherwise,
+we keep the client, and the other connections in its pool, across timeouts.
+"""
+
+PERIODIC_RESYNC_JITTER = 0.25
+"""
+Fraction by which each interval between periodic resyncs is randomly
+lengthened or shortened, so that the hosts in a cluster don't all read the
+whole of etcd at the same time.
+"""
+
+MAX_EVENT_BATCH_SIZE = 1000
+"""
+Maximum number of etcd events that are passed to the UpdateSplitter in one
+batch.  Also the number of responses that the polling greenlet may read
+ahead.
+"""
+
+_RESYNC = object()
+"""Put on the events queue by the polling greenlet when we need to resync."""
+_CLUSTER_CHANGED = object()
+"""Put on the events queue by the polling greenlet if the cluster ID changes."""
 
 # If we see an unhandled event (e.g. a directory deletion) for keys in any of
 # these prefixes, we'll abort our polling and resync.
@@ -62,6 +119,28 @@ class EtcdWatcher(Actor):
         self.config = config
         self.client = None
         self.my_config_dir = dir_for_per_host_config(self.config.HOSTNAME)
+        # Cache of parsed values, so that we don't need to decode and
+        # validate keys that haven't changed when we resync.  Maps from
+        # etcd key to (modifiedIndex, (kind, id, value) as returned by
+        # parse_node()).  Safe to share the values since they're never
+        # modified once parsed.
+        self._parse_cache = {}
+        # ID of the etcd cluster that the modifiedIndexes in the parse cache
+        # came from.
+        self._cache_cluster_id = None
+        # Whether we've sent a snapshot to the splitter.  After that,
+        # resyncs only send the keys that differ from the parse cache, which
+        # mirrors what the splitter has been told.
+        self._snapshot_applied = False
+        # Shared by all our retries, so that repeated failures of any kind
+        # back off.  Reset whenever a request succeeds.
+        self._retry_backoff = futils.ExponentialBackoff(MIN_RETRY_DELAY,
+                                                        MAX_RETRY_DELAY)
+        # etcd index up to which the parse cache is up to date, and the
+        # index at which we last saved it to the snapshot cache.
+        self._applied_index = None
+        self._saved_index = None
+        self._next_snapshot_save = 0
 
     @actor_message()
     def load_config(self):
@@ -74,7 +153,7 @@ class EtcdWatcher(Actor):
                 config_dict = self._load_config_dict()
             except (EtcdKeyNotFound, EtcdException):
                 _log.exception("Failed to read config.  Will retry.")
-                gevent.sleep(RETRY_DELAY)
+                self._sleep_before_retry("etcd config read failures")
                 continue
 
             self.config.update_config(config_dict)
@@ -102,13 +181,33 @@ class EtcdWatcher(Actor):
 
             if db_ready == "true":
                 _log.info("etcd is ready.")
+                self._retry_backoff.reset()
                 ready = True
             else:
                 _log.info("etcd not ready.  Will retry.")
-                gevent.sleep(RETRY_DELAY)
+                self._sleep_before_retry("etcd not ready")
                 continue
 
-    def _reconnect(self, copy_cluster_id=True):
+    def _sleep_before_retry(self, reason):
+        """
+        Sleeps for the next (jittered, exponential) backoff delay.
+
+        :param str reason: name of the stats counter to increment.
+        """
+        self._stats.counters[reason] += 1
+        delay = self._retry_backoff.next_delay()
+        _log.info("Retrying etcd request in %.1fs", delay)
+        gevent.sleep(delay)
+
+    def _reconnect(self, copy_cluster_id=True, cluster_id=None):
+        """
+        Replaces the etcd client.
+
+        :param copy_cluster_id: True to make the new client expect the same
+            cluster ID as the old one.
+        :param cluster_id: Cluster ID for the new client to expect, if
+            not copying it from the old client.
+        """
         _log.info("(Re)connecting to etcd...")
         etcd_addr = self.config.ETCD_ADDR
         if ":" in etcd_addr:
@@ -118,12 +217,11 @@ class EtcdWatcher(Actor):
             host = etcd_addr
             port = 4001
         if self.client and copy_cluster_id:
-            old_cluster_id = self.client.expected_cluster_id
-            _log.info("Old etcd cluster ID was %s.", old_cluster_id)
-        else:
-            old_cluster_id = None
+            cluster_id = self.client.expected_cluster_id
+            _log.info("Old etcd cluster ID was %s.", cluster_id)
         self.client = etcd.Client(host=host, port=port,
-                                  expected_cluster_id=old_cluster_id)
+                                  expected_cluster_id=cluster_id)
+        self._stats.counters["etcd connects"] += 1
 
     @actor_message()
     def watch_etcd(self, update_splitter):
@@ -131,197 +229,615 @@ class EtcdWatcher(Actor):
         Loads the snapshot from etcd and then monitors etcd for changes.
         Posts events to the UpdateSplitter.
 
+        If there is a snapshot cache from before a restart, applies that
+        straight away and then picks up the etcd events that happened
+        since it was saved.
+
         :returns: Does not return.
         """
+        cache_header = self._apply_cached_snapshot(update_splitter)
+        if cache_header is not None:
+            _log.info("Resuming from snapshot cache at etcd index %s",
+                      cache_header["etcd_index"])
+            self._reconnect(copy_cluster_id=False,
+                            cluster_id=cache_header["cluster_id"])
+            self.wait_for_ready()
+            self._poll_for_updates(cache_header["etcd_index"],
+                                   update_splitter)
         while True:
             _log.info("Reconnecting and loading snapshot from etcd...")
             self._reconnect(copy_cluster_id=False)
             self.wait_for_ready()
-
-            # Load initial dump from etcd.  First just get all the endpoints
-            # and profiles by id.  The response contains a generation ID
-            # allowing us to then start polling for updates without missing
-            # any.
-            initial_dump = self.client.read(VERSION_DIR, recursive=True)
-            _log.info("Loaded snapshot from etcd cluster %s, parsing it...",
-                      self.client.expected_cluster_id)
-            rules_by_id = {}
-            tags_by_id = {}
-            endpoints_by_id = {}
-            still_ready = False
-            for child in initial_dump.children:
-                profile_id, rules = parse_if_rules(child)
-                if profile_id:
-                    rules_by_id[profile_id] = rules
-                    continue
-                profile_id, tags = parse_if_tags(child)
-                if profile_id:
-                    tags_by_id[profile_id] = tags
-                    continue
-                endpoint_id, endpoint = parse_if_endpoint(self.config, child)
-                if endpoint_id and endpoint:
-                    endpoints_by_id[endpoint_id] = endpoint
-                    continue
-
-                # Double-check the flag hasn't changed since we read it before.
-                if child.key == READY_KEY:
-                    if child.value == "true":
-                        still_ready = True
-                    else:
-                        _log.warning("Aborting resync because ready flag was"
-                                     "unset since we read it.")
-                        continue
-
-            if not still_ready:
+            snapshot_index = self._resync(update_splitter)
+            if snapshot_index is None:
                 _log.warn("Aborting resync; ready flag no longer present.")
                 continue
+            self._poll_for_updates(snapshot_index, update_splitter)
+
+    def _resync(self, update_splitter):
+        """
+        Loads a snapshot from etcd and passes it, or the changes since the
+        last snapshot, to the update splitter.
 
-            # Actually apply the snapshot. This does not return anything, but
-            # just sends the relevant messages to the relevant threads to make
-            # all the processing occur.
+        :returns: the etcd index of the snapshot or None if the ready flag
+            is no longer set.
+        """
+        # Load initial dump from etcd.  First just get all the endpoints
+        # and profiles by id.  The returned etcd index allows us to then
+        # start polling for updates without missing any.
+        if self._snapshot_applied:
+            # Pick up any config changes that we missed.
+            self._reload_config(update_splitter)
+        old_cache = self._parse_cache
+        snapshot = self._load_snapshot()
+        if snapshot is None:
+            return None
+        rules_by_id, tags_by_id, endpoints_by_id, snapshot_index = \
+            snapshot
+        del snapshot
+
+        if self._snapshot_applied:
+            # The splitter already has the state from before the resync,
+            # only send it the keys that have changed.
+            _log.info("Snapshot parsed, passing changes to update "
+                      "splitter")
+            self._apply_snapshot_delta(old_cache, update_splitter)
+            wait_for_backpressure()
+        else:
+            # Actually apply the snapshot. This does not return anything,
+            # but just sends the relevant messages to the relevant threads
+            # to make all the processing occur.
             _log.info("Snapshot parsed, passing to update splitter")
             update_splitter.apply_snapshot(rules_by_id,
                                            tags_by_id,
                                            endpoints_by_id,
                                            async=False)
+            self._snapshot_applied = True
+        self._applied_index = snapshot_index
+        self._maybe_save_snapshot_cache()
+        return snapshot_index
+
+    def _apply_cached_snapshot(self, update_splitter):
+        """
+        Loads the snapshot cache, if there is one, and applies it.
+
+        :returns dict: the header of the snapshot cache, or None if there is
+            no usable cache.
+        """
+        path = self.config.SNAPSHOT_CACHE_PATH
+        if not path:
+            return None
+        loaded = snapshotcache.load(path)
+        if loaded is None:
+            return None
+        header, parse_cache = loaded
+        # The parsed values depend on this config.
+        if (header.get("hostname") != self.config.HOSTNAME or
+                header.get("iface_prefix") != self.config.IFACE_PREFIX):
+            _log.warning("Ignoring snapshot cache saved with different "
+                         "config: %s", header)
+            return None
+        rules_by_id = {}
+        tags_by_id = {}
+        endpoints_by_id = {}
+        for _, (kind, obj_id, value) in parse_cache.itervalues():
+            if kind == RULES:
+                rules_by_id[obj_id] = value
+            elif kind == TAGS:
+                tags_by_id[obj_id] = value
+            elif kind == ENDPOINT and value:
+                endpoints_by_id[obj_id] = value
+        _log.info("Applying snapshot cache: %s profiles and %s endpoints",
+                  len(rules_by_id), len(endpoints_by_id))
+        update_splitter.apply_snapshot(rules_by_id, tags_by_id,
+                                       endpoints_by_id, async=False)
+        self._parse_cache = parse_cache
+        self._cache_cluster_id = header["cluster_id"]
+        self._snapshot_applied = True
+        self._applied_index = self._saved_index = header["etcd_index"]
+        return header
+
+    def _maybe_save_snapshot_cache(self):
+        """
+        Saves the parse cache to disk if it has changed, at most once every
+        SNAPSHOT_SAVE_INTERVAL seconds.
+        """
+        path = self.config.SNAPSHOT_CACHE_PATH
+        if (not path or self._applied_index == self._saved_index or
+                time.time() < self._next_snapshot_save):
+            return
+        header = {
+            "etcd_index": self._applied_index,
+            "cluster_id": self._cache_cluster_id,
+            "hostname": self.config.HOSTNAME,
+            "iface_prefix": self.config.IFACE_PREFIX,
+        }
+        try:
+            snapshotcache.save(path, header, self._parse_cache)
+        except Exception:
+            # Not fatal, we'll just have a slower restart.
+            _log.exception("Failed to save snapshot cache to %s", path)
+        else:
+            self._saved_index = self._applied_index
+        self._next_snapshot_save = time.time() + SNAPSHOT_SAVE_INTERVAL
 
-            # These read only objects are no longer required, so tidy them up.
-            del rules_by_id
-            del tags_by_id
-            del endpoints_by_id
-
-            # On first call, the etcd_index seems to be the high-water mark
-            # for the data returned whereas the modified index just tells us
-            # when the key was modified.
-            _log.info("Starting polling for updates from etcd.  Initial etcd "
-                      "index: %s.", initial_dump.etcd_index)
-            next_etcd_index = initial_dump.etcd_index + 1
-            del initial_dump
+    def _poll_for_updates(self, snapshot_index, update_splitter):
+        """
+        Long-polls etcd for events after snapshot_index and passes them on
+        to the update splitter until a resync is needed, or until it is time
+        for a periodic resync.
+
+        The polling is done by a separate greenlet, so that the next poll is
+        issued as soon as a response arrives, rather than after the previous
+        event has been processed.  Responses are passed back over a bounded
+        queue; each time round, this greenlet takes everything that has
+        accumulated on the queue and processes it as one batch.
+        """
+        _log.info("Starting polling for updates from etcd.  Initial etcd "
+                  "index: %s.", snapshot_index)
+        events = Queue(maxsize=MAX_EVENT_BATCH_SIZE)
+        poller = gevent.spawn(self._poll_etcd, snapshot_index + 1, events)
+        resync_time = self._next_periodic_resync_time()
+        try:
             continue_polling = True
             while continue_polling:
-                response = None
                 try:
-                    _log.debug("About to wait for etcd update %s",
-                               next_etcd_index)
-                    response = self.client.read(VERSION_DIR,
-                                                wait=True,
-                                                waitIndex=next_etcd_index,
-                                                recursive=True,
-                                                timeout=Timeout(connect=10,
-                                                                read=90),
-                                                check_cluster_uuid=True)
-                    _log.debug("etcd response: %r", response)
-                except (ReadTimeoutError, SocketTimeout) as e:
-                    # This is expected when we're doing a poll and nothing
-                    # happened. socket timeout doesn't seem to be caught by
-                    # urllib3 1.7.1.  Simply reconnect.
-                    _log.debug("Read from etcd timed out (%r), retrying.", e)
-                    # Force a reconnect to ensure urllib3 doesn't recycle the
-                    # connection.  (We were seeing this with urllib3 1.7.1.)
-                    self._reconnect()
-                except (ConnectTimeoutError,
-                        urllib3.exceptions.HTTPError,
-                        httplib.HTTPException):
-                    _log.warning("Low-level HTTP error, reconnecting to "
-                                 "etcd.", exc_info=True)
+                    batch = [events.get(timeout=_time_until(resync_time))]
+                except Empty:
+                    batch = []
+                if batch:
+                    while (len(batch) < MAX_EVENT_BATCH_SIZE and
+                           not events.empty()):
+                        batch.append(events.get_nowait())
+                    # Always handled, even if a periodic resync is due, so
+                    # that we act on a trailing _CLUSTER_CHANGED or exception.
+                    continue_polling = self._on_etcd_events(batch,
+                                                            update_splitter)
+                    if continue_polling:
+                        self._maybe_save_snapshot_cache()
+                    # Let the splitter catch up rather than letting events
+                    # build up on its queue.
+                    wait_for_backpressure()
+                if continue_polling and _time_until(resync_time) == 0:
+                    # Check that we haven't missed anything (for example,
+                    # due to a bug).  The resync only sends the differences.
+                    # Checked after every batch, so that a busy cluster
+                    # still resyncs.
+                    _log.info("Starting periodic resync.")
+                    self._stats.counters["periodic resyncs"] += 1
+                    return
+        finally:
+            poller.kill()
+
+    def _next_periodic_resync_time(self):
+        """
+        :returns: the time at which to do the next periodic resync, or None
+            if periodic resyncs are disabled.
+        """
+        interval = self.config.RESYNC_INT_SEC
+        if not interval:
+            return None
+        interval *= random.uniform(1 - PERIODIC_RESYNC_JITTER,
+                                   1 + PERIODIC_RESYNC_JITTER)
+        _log.info("Next periodic resync in %.0fs", interval)
+        return time.time() + interval
+
+    def _poll_etcd(self, next_etcd_index, events):
+        """
+        Greenlet that long-polls etcd, putting each response on the events
+        queue.  If a resync is needed, puts _RESYNC (or _CLUSTER_CHANGED) on
+        the queue and returns.  If the poll fails unexpectedly, puts the
+        exception on the queue and returns.
+        """
+        while True:
+            response = None
+            try:
+                _log.debug("About to wait for etcd update %s",
+                           next_etcd_index)
+                response = self.client.read(VERSION_DIR,
+                                            wait=True,
+                                            waitIndex=next_etcd_index,
+                                            recursive=True,
+                                            timeout=Timeout(connect=10,
+                                                            read=90),
+                                            check_cluster_uuid=True)
+                _log.debug("etcd response: %r", response)
+            except (ReadTimeoutError, SocketTimeout) as e:
+                # This is expected when we're doing a poll and nothing
+                # happened. socket timeout doesn't seem to be caught by
+                # urllib3 1.7.1.  Simply poll again, reusing the client's
+                # connection pool.
+                _log.debug("Read from etcd timed out (%r), retrying.", e)
+                self._stats.counters["etcd poll timeouts"] += 1
+                if RECONNECT_AFTER_TIMEOUT:
+                    # Force a reconnect to ensure urllib3 doesn't recycle
+                    # the connection.
                     self._reconnect()
-                except (EtcdClusterIdChanged, EtcdEventIndexCleared) as e:
-                    _log.warning("Out of sync with etcd (%r).  Reconnecting "
-                                 "for full sync.", e)
-                    continue_polling = False
-                except EtcdException as e:
-                    # Sadly, python-etcd doesn't have a dedicated exception
-                    # for the "no more machines in cluster" error. Parse the
-                    # message:
-                    msg = (e.message or "unknown").lower()
-                    if "no more machines" in msg:
-                        # This error comes from python-etcd when it can't
-                        # connect to any servers.  When we retry, it should
-                        # reconnect.
-                        # TODO: We should probably limit retries here and die
-                        # That'd recover from errors caused by resource
-                        # exhaustion/leaks.
-                        _log.error("Connection to etcd failed, will retry.")
-                    else:
-                        # Assume any other errors are fatal to our poll and
-                        # do a full resync.
-                        _log.exception("Unknown etcd error %r; doing resync.",
-                                       e.message)
-                        continue_polling = False
-                    # TODO: should we do a backoff here?
-                    gevent.sleep(1)
+            except (ConnectTimeoutError,
+                    urllib3.exceptions.HTTPError,
+                    httplib.HTTPException):
+                _log.warning("Low-level HTTP error, reconnecting to "
+                             "etcd.", exc_info=True)
+                self._sleep_before_retry("etcd HTTP errors")
+                self._reconnect()
+            except EtcdClusterIdChanged as e:
+                _log.warning("etcd cluster ID changed (%r).  Reconnecting "
+                             "for resync.", e)
+                events.put(_CLUSTER_CHANGED)
+                return
+            except EtcdEventIndexCleared as e:
+                _log.warning("Out of sync with etcd (%r).  Reconnecting "
+                             "for resync.", e)
+                events.put(_RESYNC)
+                return
+            except EtcdException as e:
+                # Sadly, python-etcd doesn't have a dedicated exception
+                # for the "no more machines in cluster" error. Parse the
+                # message:
+                msg = (e.message or "unknown").lower()
+                if "no more machines" in msg:
+                    # This error comes from python-etcd when it can't
+                    # connect to any servers.  When we retry, it should
+                    # reconnect.
+                    # TODO: We should probably limit retries here and die
+                    # That'd recover from errors caused by resource
+                    # exhaustion/leaks.
+                    _log.error("Connection to etcd failed, will retry.")
+                    self._sleep_before_retry("etcd connection failures")
                     self._reconnect()
-                except:
-                    _log.exception("Unexpected exception during etcd poll")
-                    raise
+                else:
+                    # Assume any other errors are fatal to our poll and
+                    # do a full resync.
+                    _log.exception("Unknown etcd error %r; doing resync.",
+                                   e.message)
+                    self._sleep_before_retry("etcd errors")
+                    events.put(_RESYNC)
+                    return
+            except Exception as e:
+                _log.exception("Unexpected exception during etcd poll")
+                events.put(e)
+                return
+
+            if not response:
+                _log.debug("Failed to get a response from etcd.")
+                continue
+            self._retry_backoff.reset()
 
-                if not response:
-                    _log.debug("Failed to get a response from etcd.")
-                    continue
+            # Since we're polling on a subtree, we can't just increment
+            # the index, we have to look at the modifiedIndex to spot if
+            # we've skipped a lot of updates.
+            next_etcd_index = max(next_etcd_index,
+                                  response.modifiedIndex) + 1
+            events.put(response)
 
-                # Since we're polling on a subtree, we can't just increment
-                # the index, we have to look at the modifiedIndex to spot if
-                # we've skipped a lot of updates.
-                next_etcd_index = max(next_etcd_index,
-                                      response.modifiedIndex) + 1
-
-                if response.action == "delete":
-                    # Handle expected directory deletions by faking events for
-                    # child nodes.
-                    profile_id = get_profile_id_for_profile_dir(response.key)
-                    if profile_id:
-                        _log.info("Delete for whole profile %s", profile_id)
-                        update_splitter.on_rules_update(profile_id, None,
-                                                        async=False)
-                        update_splitter.on_tags_update(profile_id, None,
-                                                       async=False)
-                        continue
-                    # TODO: Do we need to handle workload deletions?
-
-                profile_id, rules = parse_if_rules(response)
-                if profile_id:
-                    _log.info("Scheduling profile update %s", profile_id)
-                    update_splitter.on_rules_update(profile_id, rules,
-                                                    async=False)
-                    continue
-                profile_id, tags = parse_if_tags(response)
-                if profile_id:
-                    _log.info("Scheduling tags update %s", profile_id)
-                    update_splitter.on_tags_update(profile_id, tags,
-                                                   async=False)
-                    continue
-                endpoint_id, endpoint = parse_if_endpoint(self.config,
-                                                          response)
-                if endpoint_id:
-                    _log.info("Scheduling endpoint update %s", endpoint_id)
-                    update_splitter.on_endpoint_update(endpoint_id, endpoint,
-                                                       async=False)
-                    continue
+    def _on_etcd_events(self, batch, update_splitter):
+        """
+        Handles a batch of items from the poller greenlet's queue.
 
-                if response.key == READY_KEY:
-                    if response.value != "true":
-                        _log.warning("DB became unready, triggering a resync")
+        :returns bool: False if a resync is required, True otherwise.
+        :raises Exception: if the poller failed with an unexpected exception.
+        """
+        # The poller stops after queueing anything other than a response, so
+        # only the last item can be a sentinel or an exception.
+        last_item = batch[-1]
+        if last_item is _RESYNC or last_item is _CLUSTER_CHANGED or \
+                isinstance(last_item, Exception):
+            responses = batch[:-1]
+        else:
+            responses = batch
+            last_item = None
+
+        continue_polling = True
+        if responses:
+            # Trace the processing of the events through the actors so that
+            # we log how long it takes to program.
+            first_index = responses[0].modifiedIndex
+            last_index = responses[-1].modifiedIndex
+            if first_index == last_index:
+                description = "etcd index %s" % first_index
+            else:
+                description = "etcd indexes %s-%s" % (first_index, last_index)
+            with start_trace(description, "etcd update"):
+                for response in responses:
+                    if not self._on_etcd_event(response, update_splitter):
+                        # Any later events will be picked up by the resync.
                         continue_polling = False
+                        break
+                    self._applied_index = response.modifiedIndex
+
+        if last_item is _CLUSTER_CHANGED:
+            # The modifiedIndexes of the new cluster have nothing to do with
+            # the ones we cached.
+            self._forget_cached_indexes()
+            return False
+        elif last_item is _RESYNC:
+            return False
+        elif last_item is not None:
+            raise last_item
+        return continue_polling
+
+    def _load_snapshot(self):
+        """
+        Loads a snapshot of the profiles and endpoints from etcd.
+
+        Reading the whole of VERSION_DIR in one request materialises the
+        entire tree (as the raw response, the decoded JSON and the
+        EtcdResults) on top of the parsed dicts, which is gigabytes for a
+        large cluster.  Instead, we read the policy, our own host and then
+        each other host as separate chunks so that only one chunk is held in
+        its raw form at a time.  Endpoints on other hosts are compacted as
+        they are parsed (see parse_if_endpoint()).
+
+        The chunks are read at different etcd indexes so the snapshot may
+        be inconsistent.  The returned index is from before the first read;
+        replaying the events after it brings the snapshot up to date.
+
+        :returns: tuple of (rules_by_id, tags_by_id, endpoints_by_id,
+            etcd index of the snapshot) or None if the ready flag is no
+            longer set.
+        """
+        ready_node = self.client.read(READY_KEY)
+        if ready_node.value != "true":
+            return None
+        # On a read, the etcd_index is the high-water mark for the whole
+        # database whereas the modifiedIndex only tells us when the key was
+        # modified.
+        snapshot_index = ready_node.etcd_index
+        cluster_id = self.client.expected_cluster_id
+        _log.info("Loading snapshot from etcd cluster %s at index %s",
+                  cluster_id, snapshot_index)
+        if cluster_id != self._cache_cluster_id:
+            # We reconnect without checking the cluster ID before each
+            # resync, so this may be the first we know of a new cluster.
+            # Its modifiedIndexes have nothing to do with the ones we
+            # cached.
+            _log.info("Parse cache is from etcd cluster %s, comparing "
+                      "values rather than indexes.", self._cache_cluster_id)
+            self._forget_cached_indexes()
+            self._cache_cluster_id = cluster_id
+
+        rules_by_id = {}
+        tags_by_id = {}
+        # Only keep cache entries for keys that are still present.
+        new_cache = {}
+        for child in self._read_chunk(POLICY_DIR):
+            kind, profile_id, value = self._parse_cached(child, new_cache)
+            if kind == RULES:
+                rules_by_id[profile_id] = value
+            elif kind == TAGS:
+                tags_by_id[profile_id] = value
+
+        # Non-recursive read, just to get the list of hosts.  Our own host
+        # goes first so that our local endpoints are loaded before the
+        # (compacted) endpoints of all the other hosts.
+        my_host_dir = dir_for_host(self.config.HOSTNAME)
+        host_dirs = [my_host_dir]
+        host_dirs.extend(child.key for child in
+                         self._read_chunk(HOST_DIR, recursive=False)
+                         if (child.dir and
+                             child.key not in (HOST_DIR, my_host_dir)))
+        endpoints_by_id = {}
+        for host_dir in host_dirs:
+            for child in self._read_chunk(host_dir):
+                kind, endpoint_id, endpoint = self._parse_cached(child,
+                                                                 new_cache)
+                if kind == ENDPOINT and endpoint:
+                    endpoints_by_id[endpoint_id] = endpoint
+        self._parse_cache = new_cache
+        _log.info("Loaded %s profiles and %s endpoints from %s hosts",
+                  len(rules_by_id), len(endpoints_by_id), len(host_dirs))
+        return rules_by_id, tags_by_id, endpoints_by_id, snapshot_index
+
+    def _apply_snapshot_delta(self, old_cache, update_splitter):
+        """
+        Sends the update splitter events for the keys that differ between
+        old_cache and the (new) parse cache, as loaded by _load_snapshot().
+
+        Keys whose modifiedIndex hasn't changed are skipped without looking
+        at their values.  Keys with a new modifiedIndex are only sent if
+        their parsed value has changed, since a resync after an etcd
+        compaction or restore often sees values rewritten unchanged.
+        """
+        new_cache = self._parse_cache
+        new_ids = set((kind, obj_id) for _, (kind, obj_id, _) in
+                      new_cache.itervalues())
+        num_deletions = 0
+        for key, (_, (kind, obj_id, _)) in old_cache.iteritems():
+            if key not in new_cache and (kind, obj_id) not in new_ids:
+                self._send_update(update_splitter, kind, obj_id, None)
+                num_deletions += 1
+        num_updates = 0
+        for key, (mod_index, parsed) in new_cache.iteritems():
+            old_entry = old_cache.get(key)
+            if old_entry is not None:
+                old_index, old_parsed = old_entry
+                if old_index == mod_index or old_parsed == parsed:
                     continue
+            kind, obj_id, value = parsed
+            self._send_update(update_splitter, kind, obj_id, value)
+            num_updates += 1
+        _log.info("Resync found %s updated and %s deleted keys out of %s.",
+                  num_updates, num_deletions, len(new_cache))
 
-                _log.debug("Response action: %s, key: %s",
-                           response.action, response.key)
-                if (response.action not in ("set", "create") and
-                        any((response.key.startswith(pfx) for pfx in
-                             PREFIXES_TO_RESYNC_ON_CHANGE))):
-                    # Catch deletions of whole directories or other operations
-                    # that we're not expecting.
-                    _log.warning("Unexpected event: %s; triggering resync.",
-                                 response)
+    def _send_update(self, update_splitter, kind, obj_id, value):
+        """
+        Passes a parsed value to the corresponding update method of the
+        update splitter.  Updates are sent one-way, so we don't wait for the
+        splitter to process each one.  Since they all go on the same queue,
+        the splitter sees them in the order we sent them.
+        """
+        if kind == RULES:
+            _log.info("Scheduling profile update %s", obj_id)
+            update_splitter.on_rules_update(obj_id, value, oneway=True)
+        elif kind == TAGS:
+            _log.info("Scheduling tags update %s", obj_id)
+            update_splitter.on_tags_update(obj_id, value, oneway=True)
+        elif kind == ENDPOINT:
+            _log.info("Scheduling endpoint update %s", obj_id)
+            update_splitter.on_endpoint_update(obj_id, value, oneway=True)
+
+    def _forget_cached_indexes(self):
+        """
+        Marks every entry in the parse cache as stale, so that the next
+        snapshot reparses every key and the resync compares values rather
+        than modifiedIndexes.  The cached values are kept since they still
+        record what the splitter has been told.
+
+        Updates the cache in place, since _resync() may already hold it as
+        the old cache to compare against.
+        """
+        for key, (_, parsed) in self._parse_cache.items():
+            self._parse_cache[key] = (None, parsed)
+
+    def _parse_cached(self, etcd_node, new_cache):
+        """
+        Parses a node read as part of a snapshot, reusing the result from
+        the previous snapshot (or event) if the key hasn't been modified
+        since.  Records the result in new_cache.
+
+        :returns tuple: (kind, id, value) as for parse_node().
+        """
+        key = etcd_node.key
+        mod_index = etcd_node.modifiedIndex
+        cached = self._parse_cache.get(key)
+        if cached is not None and cached[0] == mod_index:
+            parsed = cached[1]
+        else:
+            parsed = parse_node(self.config, etcd_node)
+        if parsed[0] is not None:
+            new_cache[key] = (mod_index, parsed)
+        return parsed
+
+    def _read_chunk(self, key, recursive=True):
+        """
+        Reads a subtree of etcd.
+
+        :returns: iterator over the leaf nodes of the subtree, which is
+            empty if the key doesn't exist (for example, if the host was
+            removed since we listed the hosts).
+        """
+        try:
+            result = self.client.read(key, recursive=recursive)
+        except EtcdKeyNotFound:
+            _log.info("%s not present in etcd", key)
+            return iter([])
+        return result.children
+
+    def _on_etcd_event(self, response, update_splitter):
+        """
+        Handles a single event from etcd, passing it on to the update
+        splitter.
+
+        :returns bool: False if the event requires a resync, True otherwise.
+        """
+        if response.action == "delete":
+            # Handle expected directory deletions by faking events for
+            # child nodes.
+            profile_id = get_profile_id_for_profile_dir(response.key)
+            if profile_id:
+                _log.info("Delete for whole profile %s", profile_id)
+                self._parse_cache.pop(key_for_profile_rules(profile_id), None)
+                self._parse_cache.pop(key_for_profile_tags(profile_id), None)
+                self._send_update(update_splitter, RULES, profile_id, None)
+                self._send_update(update_splitter, TAGS, profile_id, None)
+                return True
+            # TODO: Do we need to handle workload deletions?
+
+        parsed = parse_node(self.config, response)
+        kind, obj_id, value = parsed
+        if kind is not None:
+            # Keep the cache up to date so that the next resync only needs
+            # to parse keys that change after this event.
+            if response.action == "delete":
+                self._parse_cache.pop(response.key, None)
+            else:
+                self._parse_cache[response.key] = (response.modifiedIndex,
+                                                   parsed)
+        if kind is not None:
+            self._send_update(update_splitter, kind, obj_id, value)
+            return True
+
+        if response.key == READY_KEY:
+            if response.value != "true":
+                _log.warning("DB became unready, triggering a resync")
+                return False
+            return True
+
+        continue_polling = True
+        _log.debug("Response action: %s, key: %s",
+                   response.action, response.key)
+        if (response.action not in ("set", "create") and
+                any((response.key.startswith(pfx) for pfx in
+                     PREFIXES_TO_RESYNC_ON_CHANGE))):
+            # Catch deletions of whole directories or other operations
+            # that we're not expecting.
+            _log.warning("Unexpected event: %s; triggering resync.",
+                         response)
+            continue_polling = False
+        if (response.key.startswith(CONFIG_DIR) or
+                response.key.startswith(self.my_config_dir)):
+            _log.info("Config changed: %s", response)
+            try:
+                if not self._reload_config(update_splitter):
                     continue_polling = False
-                if response.key.startswith(CONFIG_DIR):
-                    _log.warning("Global config changed but we don't "
-                                 "yet support dynamic config: %s",
-                                 response)
-                if response.key.startswith(self.my_config_dir):
-                    _log.warning("Config for this felix changed but we don't "
-                                 "yet support dynamic config: %s",
-                                 response)
+            except EtcdException:
+                # The resync reloads the config too.
+                _log.exception("Failed to reload config; triggering resync.")
+                continue_polling = False
+        return continue_polling
+
+    def _reload_config(self, update_splitter):
+        """
+        Re-reads our config from etcd and applies the changes that can be
+        made without a restart.
+
+        Changes to the interface prefix require a resync, since the parsed
+        endpoints depend on it.
+
+        :returns bool: False if a resync is required, True otherwise.
+        :raises EtcdException: if the config can't be read.
+        """
+        config_dict = self._load_config_dict()
+        new_config = copy.copy(self.config)
+        try:
+            new_config.update_config(config_dict)
+        except ConfigException:
+            _log.exception("Ignoring invalid config from etcd")
+            return True
+        changes = self.config.changed_etcd_attrs(new_config)
+        for attr in RESTART_ATTRS.intersection(changes):
+            _log.warning("Config %s changed from %r to %r; Felix must be "
+                         "restarted to pick up the change.", attr,
+                         getattr(self.config, attr), changes.pop(attr))
+        if not changes:
+            _log.info("No config changes to apply")
+            return True
+
+        _log.warning("Applying config changes: %s", changes)
+        resync_needed = "IFACE_PREFIX" in changes
+        if resync_needed:
+            # The chains for our endpoints are named after their interfaces,
+            # minus the prefix, when the endpoints are created.  Remove our
+            # endpoints, and so their chains; the resync adds them back with
+            # chains named using the new prefix.
+            self._remove_local_endpoints(update_splitter)
+            self._forget_cached_indexes()
+        for attr, value in changes.iteritems():
+            setattr(self.config, attr, value)
+        update_splitter.on_config_update(changes, oneway=True)
+        return not resync_needed
+
+    def _remove_local_endpoints(self, update_splitter):
+        """
+        Tells the update splitter that all the endpoints on this host have
+        been deleted and removes them from the parse cache, so that the next
+        resync sends them as new endpoints.
+        """
+        for key, (_, (kind, obj_id, value)) in self._parse_cache.items():
+            if (kind == ENDPOINT and value is not None and
+                    value.host == self.config.HOSTNAME):
+                del self._parse_cache[key]
+                self._send_update(update_splitter, kind, obj_id, None)
 
     def _load_config_dict(self):
         """
@@ -349,6 +865,16 @@ class EtcdWatcher(Actor):
         return config_dict
 
 
+def _time_until(deadline):
+    """
+    :returns: the number of seconds until deadline (a time.time() value), or
+        None if deadline is None.
+    """
+    if deadline is None:
+        return None
+    return max(deadline - time.time(), 0)
+
+
 def _update_config_dict(config_dict, cfg_node):
     """
     Updates the config dict provided from the given etcd node, which
@@ -362,10 +888,119 @@ def _update_config_dict(config_dict, cfg_node):
     return config_dict
 
 
-# Intern JSON keys as we load them to reduce occupancy.
-def intern_dict(d):
-    return dict((intern(str(k)), v) for k, v in d.iteritems())
-json_decoder = json.JSONDecoder(object_hook=intern_dict)
+FAST_JSON_MODULES = ["ujson", "simplejson"]
+"""
+Faster JSON decoders to use in preference to the json module, if installed.
+Each must provide a json-compatible loads() function.
+"""
+
+
+def _load_json_decoder():
+    """
+    :returns: the loads() function of the first available module in
+        FAST_JSON_MODULES, falling back to json.loads().
+    """
+    for module_name in FAST_JSON_MODULES:
+        try:
+            module = __import__(module_name)
+        except ImportError:
+            continue
+        _log.info("Using %s to decode JSON from etcd.", module_name)
+        return module.loads
+    return json.loads
+
+decode_json = _load_json_decoder()
+"""
+Function used to decode JSON values from etcd.  May be replaced, for
+example by the benchmarks, as long as it is a drop-in for json.loads().
+"""
+
+
+def _intern_keys(obj):
+    """
+    Recursively interns the keys of any dicts in a decoded JSON object.
+
+    Only used for values that we hold on to for a long time (profiles and
+    tags), where interning the keys reduces occupancy.  Endpoint dicts are
+    discarded once the Endpoint is built, so it isn't worth the CPU for them.
+    Interning the keys after decoding, rather than via an object_hook,
+    lets the decoder use its fast path.
+    """
+    if isinstance(obj, dict):
+        return dict((futils.intern_if_ascii(k), _intern_keys(v))
+                    for k, v in obj.iteritems())
+    if isinstance(obj, list):
+        return [_intern_keys(v) for v in obj]
+    return obj
+
+
+def decode_json_interned(value):
+    """
+    Decodes a JSON value and interns the keys of any dicts in it.
+    """
+    return _intern_keys(decode_json(value))
+
+
+VALIDATION_CACHE_SIZE = 10000
+"""
+Maximum number of entries in each of the validation caches.
+
+The parse cache in the EtcdWatcher already avoids revalidating keys that
+haven't been modified.  These caches catch values that are rewritten
+unchanged, under a new modifiedIndex, for example when the orchestrator
+resyncs its state to etcd.
+"""
+
+_endpoint_validation_cache = futils.LRUCache(VALIDATION_CACHE_SIZE)
+_rules_validation_cache = futils.LRUCache(VALIDATION_CACHE_SIZE)
+_NOT_CACHED = object()
+
+
+def _validate_cached(cache, cache_key, validate_fn, *args):
+    """
+    Calls validate_fn(*args), unless the outcome is already cached under
+    cache_key, which should uniquely identify the inputs to validate_fn,
+    typically by including the raw value from etcd.
+
+    :raises ValidationFailed: if the validation fails (now or when it was
+        cached).
+    """
+    error = cache.get(cache_key, _NOT_CACHED)
+    if error is _NOT_CACHED:
+        try:
+            validate_fn(*args)
+        except ValidationFailed as e:
+            error = e.message
+        else:
+            error = None
+        cache.put(cache_key, error)
+    if error is not None:
+        raise ValidationFailed(error)
+
+
+ENDPOINT = "endpoint"
+RULES = "rules"
+TAGS = "tags"
+
+
+def parse_node(config, etcd_node):
+    """
+    Parses an etcd node, if it's a profile or endpoint.
+
+    :returns tuple: (kind, id, value) where kind is one of ENDPOINT, RULES
+        or TAGS and value is as returned by the corresponding parse_if_...
+        function, or (None, None, None) if the node is of another type.
+    """
+    endpoint_id, endpoint = parse_if_endpoint(config, etcd_node)
+    if endpoint_id:
+        return ENDPOINT, endpoint_id, endpoint
+    profile_id, rules = parse_if_rules(etcd_node)
+    if profile_id:
+        return RULES, profile_id, rules
+    profile_id, tags = parse_if_tags(etcd_node)
+    if profile_id:
+        return TAGS, profile_id, tags
+    return None, None, None
 
 
 def parse_if_endpoint(config, etcd_node):
@@ -378,15 +1013,20 @@ def parse_if_endpoint(config, etcd_node):
             _log.debug("Found deleted endpoint %s", endpoint_id)
         else:
             hostname = m.group("hostname")
-            endpoint = json_decoder.decode(etcd_node.value)
+            endpoint = decode_json(etcd_node.value)
             try:
-                validate_endpoint(config, endpoint)
+                # Validation also depends on the interface prefix.
+                _validate_cached(_endpoint_validation_cache,
+                                 (config.IFACE_PREFIX, etcd_node.value),
+                                 validate_endpoint, config, endpoint)
             except ValidationFailed as e:
                 _log.warning("Validation failed for endpoint %s, treating as "
                              "missing: %s", endpoint_id, e.message)
                 return endpoint_id, None
-            endpoint["host"] = hostname
-            endpoint["id"] = endpoint_id
+            # Endpoints on other hosts are only used for ipset membership so
+            # we only keep the fields that that needs.
+            endpoint = Endpoint.from_dict(endpoint_id, hostname, endpoint,
+                                          local=(hostname == config.HOSTNAME))
             _log.debug("Found endpoint : %s", endpoint)
         return endpoint_id, endpoint
     return None, None
@@ -457,10 +1097,11 @@ def parse_if_rules(etcd_node):
         if etcd_node.action == "delete":
             rules = None
         else:
-            rules = json_decoder.decode(etcd_node.value)
+            rules = decode_json_interned(etcd_node.value)
             rules["id"] = profile_id
             try:
-                validate_rules(rules)
+                _validate_cached(_rules_validation_cache, etcd_node.value,
+                                 validate_rules, rules)
             except ValidationFailed:
                 _log.exception("Validation failed for profile %s rules: %s",
                                profile_id, rules)
@@ -603,7 +1244,7 @@ def parse_if_tags(etcd_node):
         if etcd_node.action == "delete":
             tags = None
         else:
-            tags = json_decoder.decode(etcd_node.value)
+            tags = decode_json(etcd_node.value)
             try:
                 validate_tags(tags)
             except ValidationFailed:
@@ -32,7 +32,8 @@ import gevent
 
 from calico.felix import frules
 from calico.felix.actor import (Actor, actor_message, ResultOrExc,
-                                SplitBatchAndRetry)
+                                SplitBatchAndRetry, FailMessagesAndRetry,
+                                AdaptiveBatchDelay)
 from calico.felix.frules import FELIX_PREFIX
 from calico.felix.futils import FailedSystemCall
 
@@ -67,9 +68,12 @@ class IptablesUpdater(Actor):
     updates that are on the queue in one, atomic, batch.  This is
     dramatically faster than issuing single iptables requests.
 
-    If a request fails, it does a binary chop using the
-    SplitBatchAndRetry mechanism to report the error to the correct
-    request.
+    If a request fails, it uses the line number reported by
+    iptables-restore to find the chain, and hence the request, that
+    caused the failure.  It then fails that request and retries the
+    rest of the batch using the FailMessagesAndRetry mechanism.  If the
+    failure can't be attributed to a single request, it falls back to a
+    binary chop using the SplitBatchAndRetry mechanism.
 
     Dependency tracking
     ~~~~~~~~~~~~~~~~~~~
@@ -94,12 +98,14 @@ class IptablesUpdater(Actor):
 
     """
 
-    queue_size = 1000
-    batch_delay = 0.1
+    queue_high_water_mark = 1000
 
-    def __init__(self, table, ip_version=4):
-        super(IptablesUpdater, self).__init__(qualifier="v%d" % ip_version)
+    def __init__(self, table, config, ip_version=4):
+        super(IptablesUpdater, self).__init__(
+            qualifier="%s-v%d" % (table, ip_version))
         self.table = table
+        self.batch_delay_policy = AdaptiveBatchDelay(config.MIN_BATCH_DELAY,
+                                                     config.MAX_BATCH_DELAY)
         if ip_version == 4:
             self.restore_cmd = "iptables-restore"
             self.iptables_cmd = "iptables"
@@ -122,7 +128,15 @@ class IptablesUpdater(Actor):
         """:type UpdateBatch: object used to track index changes for this
         batch."""
         self._completion_callbacks = None
-        """List of callbacks to issue once the current batch completes."""
+        """List of (message, callback) tuples for callbacks to issue once the
+        current batch completes."""
+        self._chain_owners = None
+        """Map from chain name to the message in the current batch that
+        last updated or deleted it."""
+        self._modify_line_chains = None
+        """List of the chain that each line of the current batch's
+        iptables-restore input belongs to, or None for lines that don't
+        belong to a chain."""
 
         self._reset_batched_work()  # Avoid duplicating init logic.
 
@@ -132,6 +146,8 @@ class IptablesUpdater(Actor):
                                   self.required_chains,
                                   self.requiring_chains)
         self._completion_callbacks = []
+        self._chain_owners = {}
+        self._modify_line_chains = []
 
     def _load_unreferenced_chains(self):
         """
@@ -166,8 +182,9 @@ class IptablesUpdater(Actor):
             updates = ["--flush %s" % chain] + updates
             deps = dependent_chains.get(chain, set())
             self._batch.store_rewrite_chain(chain, updates, deps)
+            self._chain_owners[chain] = self._current_msg
         if callback:
-            self._completion_callbacks.append(callback)
+            self._completion_callbacks.append((self._current_msg, callback))
 
     # Does direct table manipulation, forbid batching with other messages.
     @actor_message(needs_own_batch=True)
@@ -204,8 +221,9 @@ class IptablesUpdater(Actor):
         _log.info("Deleting chains %s", chain_names)
         for chain in chain_names:
             self._batch.store_delete(chain)
+            self._chain_owners[chain] = self._current_msg
         if callback:
-            self._completion_callbacks.append(callback)
+            self._completion_callbacks.append((self._current_msg, callback))
 
     # It's much simpler to do cleanup in its own batch so that it doesn't have
     # to worry about in-flight updates.
@@ -264,10 +282,19 @@ class IptablesUpdater(Actor):
                 _log.error("Non-retryable %s failure. RC=%s",
                            self.restore_cmd, e.returncode)
                 if self._completion_callbacks:
-                    self._completion_callbacks[0](e)
+                    self._completion_callbacks[0][1](e)
                 final_result = ResultOrExc(None, e)
                 results[0] = final_result
             else:
+                culprit = self._find_culprit(e)
+                if culprit is not None:
+                    _log.error("Non-retryable error from a combined batch, "
+                               "caused by %s; failing it and retrying the "
+                               "rest of the batch.", culprit)
+                    for msg, callback in self._completion_callbacks:
+                        if msg is culprit:
+                            callback(e)
+                    raise FailMessagesAndRetry({culprit: e})
                 _log.error("Non-retryable error from a combined batch, "
                            "splitting the batch to narrow down culprit.")
                 raise SplitBatchAndRetry()
@@ -278,14 +305,32 @@ class IptablesUpdater(Actor):
             # If we fail due to a stray reference from an orphan chain, we
             # should catch them on the next cleanup().
             self._delete_best_effort(self._batch.chains_to_delete)
-            for c in self._completion_callbacks:
-                c(None)
+            for _, callback in self._completion_callbacks:
+                callback(None)
         finally:
             self._reset_batched_work()
 
         end = time.time()
         _log.debug("Batch time: %.2f %s", end - start, len(batch))
 
+    def _find_culprit(self, error):
+        """
+        Maps the line number of a failed iptables-restore of the batch's
+        modify input back to the message that caused the failure.
+
+        :returns Message: the message that updated the chain on the
+            failing line or None if the failure can't be attributed to a
+            single message.
+        """
+        line_number = getattr(error, "line_number", None)
+        if line_number is None:
+            return None
+        try:
+            chain = self._modify_line_chains[line_number - 1]
+        except IndexError:
+            return None
+        return self._chain_owners.get(chain)
+
     def _delete_best_effort(self, chains):
         """
         Try to delete all the chains in the input list.
@@ -352,19 +397,30 @@ class IptablesUpdater(Actor):
         # COMMIT
         #
         # The chains are created if they don't exist.
-        input_lines = []
+        #
+        # We also record the chain that each line belongs to so that we can
+        # map a failure back to the message that caused it.
+        input_lines = ["*%s" % self.table]
+        line_chains = [None]
         affected_chains = self._batch.affected_chains
         for chain in affected_chains:
             input_lines.append(":%s -" % chain)
+            line_chains.append(chain)
         for chain_name in (self._batch.chains_to_stub_out |
                            self._batch.chains_to_delete):
             assert chain_name in affected_chains
-            input_lines.extend(_stub_drop_rules(chain_name))
+            stub_lines = _stub_drop_rules(chain_name)
+            input_lines.extend(stub_lines)
+            line_chains.extend([chain_name] * len(stub_lines))
         for chain_name, chain_updates in self._batch.updates.iteritems():
             input_lines.extend(chain_updates)
-        if not input_lines:
+            line_chains.extend([chain_name] * len(chain_updates))
+        if len(input_lines) == 1:
             raise NothingToDo
-        return ["*%s" % self.table] + input_lines + ["COMMIT"]
+        input_lines.append("COMMIT")
+        line_chains.append(None)
+        self._modify_line_chains = line_chains
+        return input_lines
 
     def _calculate_ipt_delete_input(self, chains):
         """
@@ -390,7 +446,7 @@ class IptablesUpdater(Actor):
         Runs ip(6)tables-restore with the given input.  Retries iff
         the COMMIT fails.
 
-        :raises CalledProcessError: if the command fails on a non-commit
+        :raises IptablesRestoreError: if the command fails on a non-commit
             line or if it repeatedly fails and retries are exhausted.
         """
         backoff = 0.01
@@ -411,6 +467,7 @@ class IptablesUpdater(Actor):
             rc = iptables_proc.wait()
             _log.debug("%s completed with RC=%s", self.restore_cmd, rc)
             num_tries += 1
+            line_number = None
             if rc == 0:
                 success = True
             else:
@@ -449,7 +506,18 @@ class IptablesUpdater(Actor):
                 else:
                     _log.error("%s completed with output:\n%s\n%s",
                                self.restore_cmd, out, err)
-                raise CalledProcessError(cmd=cmd, returncode=rc)
+                raise IptablesRestoreError(cmd=cmd, returncode=rc,
+                                           line_number=line_number)
+
+
+class IptablesRestoreError(CalledProcessError):
+    """
+    Raised when ip(6)tables-restore fails.  Records the line number of the
+    input line that failed, if it was reported.
+    """
+    def __init__(self, returncode, cmd, line_number=None):
+        super(IptablesRestoreError, self).__init__(returncode, cmd)
+        self.line_number = line_number
 
 
 class UpdateBatch(object):
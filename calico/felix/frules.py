@@ -81,13 +81,26 @@ def install_global_rules(config, v4_filter_updater, v6_filter_updater,
 
     - ensures that all the required global tables are present;
     - applies any changes required.
+
+    v6_filter_updater may be None if the IPv6 pipeline runs in a worker
+    process, which installs its own global rules.
     """
 
-    # The interface matching string; for example, if interfaces start "tap"
-    # then this string is "tap+".
-    iface_match = config.IFACE_PREFIX + "+"
+    # The IPV4 nat table first.
+    install_global_nat_rules(config, v4_nat_updater)
 
-    # The IPV4 nat table first. This must have a felix-PREROUTING chain.
+    # Now the filter tables.
+    install_global_filter_rules(config, v4_filter_updater)
+    if v6_filter_updater is not None:
+        install_global_filter_rules(config, v6_filter_updater)
+
+
+def install_global_nat_rules(config, v4_nat_updater):
+    """
+    Set up the global rules in the IPv4 nat table.  Also used to reprogram
+    them when the metadata config changes.
+    """
+    # This must have a felix-PREROUTING chain.
     nat_pr = []
     if config.METADATA_IP is not None:
         # Need to expose the metadata server on a link-local.
@@ -103,40 +116,50 @@ def install_global_rules(config, v4_filter_updater, v6_filter_updater,
     v4_nat_updater.ensure_rule_inserted(
         "PREROUTING --jump %s" % CHAIN_PREROUTING, async=False)
 
-    # Now the filter table. This needs to have calico-filter-FORWARD and
+
+def install_global_filter_rules(config, iptables_updater):
+    """
+    Set up the global rules in the filter table of a single IP version.
+    Used directly by a worker process that runs the pipeline for one IP
+    version, and to reprogram the rules when the interface prefix changes.
+    """
+    # The interface matching string; for example, if interfaces start "tap"
+    # then this string is "tap+".
+    iface_match = config.IFACE_PREFIX + "+"
+
+    # The filter table needs to have calico-filter-FORWARD and
     # calico-filter-INPUT chains, which we must create before adding any
     # rules that send to them.
-    for iptables_updater in [v4_filter_updater, v6_filter_updater]:
-        iptables_updater.rewrite_chains(
-            {
-                CHAIN_FORWARD: [
-                    "--append %s --jump %s --in-interface %s" %
-                        (CHAIN_FORWARD, CHAIN_FROM_ENDPOINT, iface_match),
-                    "--append %s --jump %s --out-interface %s" %
-                        (CHAIN_FORWARD, CHAIN_TO_ENDPOINT, iface_match),
-                    "--append %s --jump ACCEPT --in-interface %s" %
-                        (CHAIN_FORWARD, iface_match),
-                    "--append %s --jump ACCEPT --out-interface %s" %
-                        (CHAIN_FORWARD, iface_match),
-                ],
-                CHAIN_INPUT: [
-                    "--append %s --jump %s --in-interface %s" %
-                        (CHAIN_INPUT, CHAIN_FROM_ENDPOINT, iface_match),
-                    "--append %s --jump ACCEPT --in-interface %s" %
-                        (CHAIN_INPUT, iface_match),
-                ]
-            },
-            {
-                CHAIN_FORWARD: set([CHAIN_FROM_ENDPOINT, CHAIN_TO_ENDPOINT]),
-                CHAIN_INPUT: set([CHAIN_FROM_ENDPOINT]),
-            },
-            async=False)
-        iptables_updater.ensure_rule_inserted(
-            "INPUT --jump %s" % CHAIN_INPUT,
-            async=False)
-        iptables_updater.ensure_rule_inserted(
-            "FORWARD --jump %s" % CHAIN_FORWARD,
-            async=False)
+    iptables_updater.rewrite_chains(
+        {
+            CHAIN_FORWARD: [
+                "--append %s --jump %s --in-interface %s" %
+                    (CHAIN_FORWARD, CHAIN_FROM_ENDPOINT, iface_match),
+                "--append %s --jump %s --out-interface %s" %
+                    (CHAIN_FORWARD, CHAIN_TO_ENDPOINT, iface_match),
+                "--append %s --jump ACCEPT --in-interface %s" %
+                    (CHAIN_FORWARD, iface_match),
+                "--append %s --jump ACCEPT --out-interface %s" %
+                    (CHAIN_FORWARD, iface_match),
+            ],
+            CHAIN_INPUT: [
+                "--append %s --jump %s --in-interface %s" %
+                    (CHAIN_INPUT, CHAIN_FROM_ENDPOINT, iface_match),
+                "--append %s --jump ACCEPT --in-interface %s" %
+                    (CHAIN_INPUT, iface_match),
+            ]
+        },
+        {
+            CHAIN_FORWARD: set([CHAIN_FROM_ENDPOINT, CHAIN_TO_ENDPOINT]),
+            CHAIN_INPUT: set([CHAIN_FROM_ENDPOINT]),
+        },
+        async=False)
+    iptables_updater.ensure_rule_inserted(
+        "INPUT --jump %s" % CHAIN_INPUT,
+        async=False)
+    iptables_updater.ensure_rule_inserted(
+        "FORWARD --jump %s" % CHAIN_FORWARD,
+        async=False)
 
 
 def rules_to_chain_rewrite_lines(chain_name, rules, ip_version, tag_to_ipset,
@@ -25,6 +25,7 @@ import functools
 import hashlib
 import logging
 import os
+import random
 from gevent import subprocess
 import tempfile
 import time
@@ -145,6 +146,17 @@ def net_to_ip(net_or_ip):
     return net_or_ip.split("/")[0]
 
 
+def intern_if_ascii(value):
+    """
+    :returns: value, interned if it's an ASCII string.  intern() only
+        accepts byte strings so other values are returned as they are.
+    """
+    try:
+        return intern(str(value))
+    except UnicodeEncodeError:
+        return value
+
+
 def uniquely_shorten(string, length):
     """
     Take a string and deterministically shorten it to at most length
@@ -174,3 +186,99 @@ def logging_exceptions(fn):
             log.exception("Exception in wrapped function %s", fn)
             raise
     return wrapped
+
+
+class LRUCache(object):
+    """
+    Simple, bounded, least-recently-used cache.
+
+    collections.OrderedDict isn't available on Python 2.6 so the entries
+    are kept in a circular, doubly-linked list, most recently used last.
+    Each link is a list [prev, next, key, value].
+    """
+    _PREV, _NEXT, _KEY, _VALUE = 0, 1, 2, 3
+
+    def __init__(self, max_size):
+        assert max_size > 0
+        self.max_size = max_size
+        self._links_by_key = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def get(self, key, default=None):
+        """
+        :returns: the value for key, marking it as recently used, or
+            default if it isn't in the cache.
+        """
+        link = self._links_by_key.get(key)
+        if link is None:
+            return default
+        self._unlink(link)
+        self._append(link)
+        return link[self._VALUE]
+
+    def put(self, key, value):
+        """
+        Stores value for key, evicting the least recently used entry if
+        the cache is full.
+        """
+        link = self._links_by_key.get(key)
+        if link is not None:
+            self._unlink(link)
+            link[self._VALUE] = value
+        else:
+            if len(self._links_by_key) >= self.max_size:
+                oldest = self._root[self._NEXT]
+                self._unlink(oldest)
+                del self._links_by_key[oldest[self._KEY]]
+            link = [None, None, key, value]
+            self._links_by_key[key] = link
+        self._append(link)
+
+    def clear(self):
+        self._links_by_key.clear()
+        self._root[:] = [self._root, self._root, None, None]
+
+    def __contains__(self, key):
+        return key in self._links_by_key
+
+    def __len__(self):
+        return len(self._links_by_key)
+
+    def _unlink(self, link):
+        prev_link, next_link = link[self._PREV], link[self._NEXT]
+        prev_link[self._NEXT] = next_link
+        next_link[self._PREV] = prev_link
+
+    def _append(self, link):
+        last = self._root[self._PREV]
+        link[self._PREV] = last
+        link[self._NEXT] = self._root
+        last[self._NEXT] = link
+        self._root[self._PREV] = link
+
+
+class ExponentialBackoff(object):
+    """
+    Jittered exponential backoff.  Each call to next_delay() returns a delay
+    of between half and all of the current backoff, which doubles each time,
+    up to max_delay.  The jitter spreads out the retries of many clients
+    that all saw the same failure, for example an etcd restart.
+    """
+    def __init__(self, min_delay, max_delay):
+        assert 0 < min_delay <= max_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._backoff = min_delay
+
+    def next_delay(self):
+        """
+        :returns float: the time to wait before the next retry, in seconds.
+        """
+        delay = self._backoff * random.uniform(0.5, 1.0)
+        self._backoff = min(self._backoff * 2, self.max_delay)
+        return delay
+
+    def reset(self):
+        """Called after a success; the next delay is short again."""
+        self._backoff = self.min_delay
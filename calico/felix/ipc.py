@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Metaswitch Networks
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+felix.ipc
+~~~~~~~~~
+
+Support for running part of Felix in a worker process.
+
+The main process forks the worker with start_worker(), which gives each side
+one end of a socketpair.  The main process then sends updates to the worker
+via a RemoteSplitter, which has the same messages as an UpdateSplitter.  In
+the worker, serve_splitter() reads the updates from the socket and passes
+them to the worker's own UpdateSplitter.
+
+On the wire, each batch of calls is sent as a 4-byte, big-endian length,
+followed by a pickled list of (method name, args) tuples.
+"""
+import cPickle as pickle
+import logging
+import os
+import struct
+
+import gevent
+import gevent.socket
+
+from calico.felix.actor import (Actor, actor_message, PRIORITY_HIGH,
+                                wait_for_backpressure)
+
+_log = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!I")
+
+FORWARDED_METHODS = frozenset(["apply_snapshot",
+                               "on_rules_update",
+                               "on_tags_update",
+                               "on_interface_update",
+                               "on_endpoint_update",
+                               "on_config_update"])
+"""The UpdateSplitter messages that may be sent to a worker."""
+
+
+class WorkerExited(Exception):
+    """
+    Raised when the process at the other end of an IPC channel goes away.
+    """
+    pass
+
+
+def send_msg(sock, obj):
+    """
+    Sends a picklable object over the socket.
+    """
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def recv_msg(sock):
+    """
+    Blocks until an object is received over the socket.
+
+    :raises WorkerExited: if the socket is closed by the other end.
+    """
+    length, = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return pickle.loads(_recv_exactly(sock, length))
+
+
+def _recv_exactly(sock, num_bytes):
+    chunks = []
+    while num_bytes:
+        chunk = sock.recv(min(num_bytes, 65536))
+        if not chunk:
+            raise WorkerExited("IPC channel closed by peer")
+        chunks.append(chunk)
+        num_bytes -= len(chunk)
+    return "".join(chunks)
+
+
+def start_worker(worker_fn):
+    """
+    Forks a worker process, which calls worker_fn(sock), where sock is the
+    worker's end of the IPC channel.  The worker exits when worker_fn
+    returns or raises.
+
+    Should be called before starting any actors, since the worker gets a
+    copy of all the greenlets in this process.
+
+    :returns tuple: (pid of the worker, this process's end of the channel).
+    """
+    parent_sock, worker_sock = gevent.socket.socketpair()
+    pid = gevent.fork()
+    if pid == 0:  # pragma: no cover
+        parent_sock.close()
+        try:
+            worker_fn(worker_sock)
+        except BaseException:
+            _log.exception("Worker process failed")
+        finally:
+            os._exit(1)
+    worker_sock.close()
+    _log.info("Started worker process %s", pid)
+    return pid, parent_sock
+
+
+def wait_for_exit(sock):
+    """
+    Blocks until the process at the other end of the channel exits.  Only
+    for use in the main process since the worker never sends anything back.
+
+    :raises WorkerExited: always, once the worker has gone away.
+    """
+    while sock.recv(4096):
+        _log.error("Unexpected data from worker process")
+    raise WorkerExited("Worker process exited")
+
+
+def serve_splitter(sock, update_splitter):
+    """
+    Reads calls from the channel and passes them to update_splitter.
+    Doesn't return normally.
+
+    :raises WorkerExited: if the main process goes away.
+    """
+    while True:
+        calls = recv_msg(sock)
+        for method_name, args in calls:
+            assert method_name in FORWARDED_METHODS, \
+                "Unexpected method %s" % method_name
+            getattr(update_splitter, method_name)(*args, oneway=True)
+        # Don't read more while the splitter's downstream is congested.
+        wait_for_backpressure()
+
+
+class RemoteSplitter(Actor):
+    """
+    Stands in for the UpdateSplitter of a worker process, forwarding all
+    updates to it over the IPC channel.  Calls are batched up and sent
+    once per batch.
+    """
+    def __init__(self, sock, qualifier=None):
+        super(RemoteSplitter, self).__init__(qualifier=qualifier)
+        self._sock = sock
+        self._pending_calls = []
+
+    @actor_message()
+    def apply_snapshot(self, rules_by_prof_id, tags_by_prof_id,
+                       endpoints_by_id):
+        self._pending_calls.append(
+            ("apply_snapshot",
+             (rules_by_prof_id, tags_by_prof_id, endpoints_by_id))
+        )
+
+    @actor_message()
+    def on_rules_update(self, profile_id, rules):
+        self._pending_calls.append(("on_rules_update", (profile_id, rules)))
+
+    @actor_message()
+    def on_tags_update(self, profile_id, tags):
+        self._pending_calls.append(("on_tags_update", (profile_id, tags)))
+
+    @actor_message(priority=PRIORITY_HIGH)
+    def on_interface_update(self, name):
+        self._pending_calls.append(("on_interface_update", (name,)))
+
+    @actor_message()
+    def on_endpoint_update(self, endpoint_id, endpoint):
+        self._pending_calls.append(("on_endpoint_update",
+                                    (endpoint_id, endpoint)))
+
+    @actor_message()
+    def on_config_update(self, changes):
+        self._pending_calls.append(("on_config_update", (changes,)))
+
+    def _finish_msg_batch(self, batch, results):
+        if self._pending_calls:
+            _log.debug("Sending %s calls to worker",
+                       len(self._pending_calls))
+            calls = self._pending_calls
+            self._pending_calls = []
+            # If the worker has gone away, this raises and fails the whole
+            # batch; they are one-way messages so that terminates Felix.
+            send_msg(self._sock, calls)
@@ -45,6 +45,7 @@ class IpsetManager(ReferenceManager):
         super(IpsetManager, self).__init__(qualifier=ip_type)
 
         self.ip_type = ip_type
+        self.ip_version = futils.IP_TYPE_TO_VERSION[ip_type]
 
         # State.
         self.tags_by_prof_id = {}
@@ -54,6 +55,13 @@ class IpsetManager(ReferenceManager):
         self.endpoint_ids_by_tag = defaultdict(set)
         self.endpoint_ids_by_profile_id = defaultdict(set)
 
+        # Membership changes to active ipsets, accumulated over a batch and
+        # then sent to the ActiveIpsets in _finish_msg_batch(), one message
+        # per ipset.  Maps from tag to set of IPs.  For a given tag, the
+        # added and removed sets are disjoint; the most recent change wins.
+        self._pending_adds = defaultdict(set)
+        self._pending_removes = defaultdict(set)
+
     def _create(self, tag_id):
         # Create the ActiveIpset, and put a message on the queue that will
         # trigger it to update the ipset as soon as it starts. Note that we do
@@ -64,9 +72,9 @@ class IpsetManager(ReferenceManager):
 
         members = set()
         for ep_id in self.endpoint_ids_by_tag.get(tag_id, set()):
-            ep = self.endpoints_by_ep_id.get(ep_id, {})
-            nets = self.nets_key
-            members.update(map(futils.net_to_ip, ep.get(nets, [])))
+            ep = self.endpoints_by_ep_id.get(ep_id)
+            if ep is not None:
+                members.update(ep.ips(self.ip_version))
 
         active_ipset.replace_members(members, async=True)
         return active_ipset
@@ -74,11 +82,6 @@ class IpsetManager(ReferenceManager):
     def _on_object_started(self, tag_id, ipset):
         _log.debug("ActiveIpset actor for %s started", tag_id)
 
-    @property
-    def nets_key(self):
-        nets = "ipv4_nets" if self.ip_type == IPV4 else "ipv6_nets"
-        return nets
-
     @actor_message()
     def apply_snapshot(self, tags_by_prof_id, endpoints_by_id):
         _log.info("Applying tags snapshot. %s tags, %s endpoints",
@@ -172,24 +175,25 @@ class IpsetManager(ReferenceManager):
                     self.endpoint_ids_by_tag[tag] -= endpoint_ids
                 if self._is_starting_or_live(tag):
                     # Tag is in-use, update its members.
-                    ipset = self.objects_by_id[tag]
                     for endpoint_id in endpoint_ids:
                         endpoint = self.endpoints_by_ep_id[endpoint_id]
-                        for ip in map(futils.net_to_ip,
-                                      endpoint.get(self.nets_key, [])):
+                        for ip in endpoint.ips(self.ip_version):
                             if added:
-                                ipset.add_member(ip, async=True)
+                                self._queue_add_member(tag, ip)
                             else:
-                                ipset.remove_member(ip, async=True)
+                                self._queue_remove_member(tag, ip)
 
     @actor_message()
     def on_endpoint_update(self, endpoint_id, endpoint):
-        old_endpoint = self.endpoints_by_ep_id.get(endpoint_id, {})
-        old_prof_id = old_endpoint.get("profile_id")
-        if old_prof_id:
+        old_endpoint = self.endpoints_by_ep_id.get(endpoint_id)
+        if old_endpoint is not None:
+            old_prof_id = old_endpoint.profile_id
             old_tags = set(self.tags_by_prof_id.get(old_prof_id, []))
+            old_ips = set(old_endpoint.ips(self.ip_version))
         else:
+            old_prof_id = None
             old_tags = set()
+            old_ips = set()
 
         if endpoint is None:
             _log.info("Endpoint %s deleted", endpoint_id)
@@ -209,39 +213,31 @@ class IpsetManager(ReferenceManager):
                 if not self.endpoint_ids_by_tag[tag]:
                     del self.endpoint_ids_by_tag[tag]
                 if self._is_starting_or_live(tag):
-                    for ip in map(futils.net_to_ip,
-                                  old_endpoint[self.nets_key]):
-                        ipset = self.objects_by_id[tag]
-                        ipset.remove_member(ip, async=True)
+                    for ip in old_ips:
+                        self._queue_remove_member(tag, ip)
             self.endpoints_by_ep_id.pop(endpoint_id, None)
         else:
             _log.info("Endpoint %s update received", endpoint_id)
-            new_prof_id = endpoint["profile_id"]
+            new_prof_id = endpoint.profile_id
             new_tags = set(self.tags_by_prof_id.get(new_prof_id, []))
 
             # Calculate impact on tags due to any change of profile or IP
             # address and queue updates to ipsets.
-            old_ips = set(map(futils.net_to_ip,
-                              old_endpoint.get(self.nets_key, [])))
-            new_ips = set(map(futils.net_to_ip,
-                              endpoint.get(self.nets_key, [])))
+            new_ips = set(endpoint.ips(self.ip_version))
             for removed_ip in old_ips - new_ips:
                 for tag in old_tags:
                     if self._is_starting_or_live(tag):
-                        ipset = self.objects_by_id[tag]
-                        ipset.remove_member(removed_ip, async=True)
+                        self._queue_remove_member(tag, removed_ip)
             for tag in old_tags - new_tags:
                 self.endpoint_ids_by_tag[tag].discard(endpoint_id)
                 if self._is_starting_or_live(tag):
-                    ipset = self.objects_by_id[tag]
                     for ip in old_ips:
-                        ipset.remove_member(ip, async=True)
+                        self._queue_remove_member(tag, ip)
             for tag in new_tags:
                 self.endpoint_ids_by_tag[tag].add(endpoint_id)
                 if self._is_starting_or_live(tag):
-                    ipset = self.objects_by_id[tag]
                     for ip in new_ips:
-                        ipset.add_member(ip, async=True)
+                        self._queue_add_member(tag, ip)
 
             self.endpoints_by_ep_id[endpoint_id] = endpoint
             if old_prof_id and old_prof_id != new_prof_id:
@@ -253,6 +249,43 @@ class IpsetManager(ReferenceManager):
 
         _log.info("Endpoint update complete")
 
+    def _queue_add_member(self, tag, ip):
+        """
+        Records that the given IP should be added to the ipset for the given
+        tag at the end of this batch.
+        """
+        removes = self._pending_removes.get(tag)
+        if removes:
+            removes.discard(ip)
+        self._pending_adds[tag].add(ip)
+
+    def _queue_remove_member(self, tag, ip):
+        """
+        Records that the given IP should be removed from the ipset for the
+        given tag at the end of this batch.
+        """
+        adds = self._pending_adds.get(tag)
+        if adds:
+            adds.discard(ip)
+        self._pending_removes[tag].add(ip)
+
+    def _finish_msg_batch(self, batch, results):
+        """
+        Sends the accumulated membership changes to the ActiveIpsets; one
+        message per ipset.
+        """
+        super(IpsetManager, self)._finish_msg_batch(batch, results)
+        for tag in set(self._pending_adds) | set(self._pending_removes):
+            added = self._pending_adds.get(tag, set())
+            removed = self._pending_removes.get(tag, set())
+            if (added or removed) and self._is_starting_or_live(tag):
+                _log.debug("Updating ipset for tag %s: %s added, %s removed",
+                           tag, len(added), len(removed))
+                ipset = self.objects_by_id[tag]
+                ipset.update_members(added, removed, oneway=True)
+        self._pending_adds = defaultdict(set)
+        self._pending_removes = defaultdict(set)
+
 
 class ActiveIpset(RefCountedActor):
 
@@ -298,18 +331,18 @@ class ActiveIpset(RefCountedActor):
         self.members = members
 
     @actor_message()
-    def add_member(self, member):
-        _log.info("Adding member %s to ipset %s", member, self.name)
-        if member not in self.members:
-            self.members.add(member)
+    def update_members(self, added_members, removed_members):
+        """
+        Applies a delta to the members of the ipset.
 
-    @actor_message()
-    def remove_member(self, member):
-        _log.info("Removing member %s from ipset %s", member, self.name)
-        try:
-            self.members.remove(member)
-        except KeyError:
-            _log.info("%s was not in ipset %s", member, self.name)
+        :param set added_members: members to add.
+        :param set removed_members: members to remove; disjoint from
+            added_members.
+        """
+        _log.info("Adding %s and removing %s members of ipset %s",
+                  len(added_members), len(removed_members), self.name)
+        self.members.difference_update(removed_members)
+        self.members.update(added_members)
 
     @actor_message()
     def on_unreferenced(self):
@@ -327,9 +360,9 @@ class ActiveIpset(RefCountedActor):
 
     def _finish_msg_batch(self, batch, results):
         # No need to combine members of the batch (although we could). None of
-        # the add_members / remove_members / replace_members calls actually
-        # does any work, just updating state. The _finish_msg_batch call will
-        # then program the real changes.
+        # the update_members / replace_members calls actually does any work,
+        # just updating state. The _finish_msg_batch call will then program
+        # the real changes.
         if not self.stopped and self.members != self.programmed_members:
             self._sync_to_ipset()
 
@@ -308,6 +308,10 @@ class RefHelper(object):
 
 
 class RefCountedActor(Actor):
+    # There can be many, short-lived instances of each subclass, aggregate
+    # their stats.
+    per_class_stats = True
+
     def __init__(self, qualifier=None):
         super(RefCountedActor, self).__init__(qualifier=qualifier)
 
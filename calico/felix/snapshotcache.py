@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Metaswitch Networks
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+felix.snapshotcache
+~~~~~~~~~~~~~~~~~~~
+
+On-disk copy of the EtcdWatcher's parse cache, so that a restarted Felix can
+program the dataplane from its last known state, without waiting to read the
+whole of etcd.
+
+The file is a sequence of records, each a 4-byte, big-endian length followed
+by a pickle.  The first record is a header dict, which includes the format
+version; the rest are lists of up to RECORD_SIZE (key, modifiedIndex, parsed
+value) tuples, terminated by an empty list so that truncated files are
+detected.  The file is written to a temporary file and renamed into place.
+"""
+import cPickle as pickle
+import logging
+import os
+import struct
+
+import gevent
+
+from calico import common
+
+_log = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct("!I")
+
+FORMAT_VERSION = 1
+"""Incremented whenever the file format or the parsed values change."""
+
+RECORD_SIZE = 1000
+"""Number of entries in each record."""
+
+
+class CorruptSnapshotCache(Exception):
+    pass
+
+
+def save(path, header, parse_cache):
+    """
+    Writes the parse cache to a file.  Yields to other greenlets between
+    records so the caller must not modify parse_cache until this returns.
+
+    :param dict header: picklable metadata, returned as-is by load().
+    :param dict parse_cache: map from etcd key to (modifiedIndex, parsed
+        value).
+    :raises EnvironmentError: if the file can't be written.
+    """
+    tmp_path = path + ".tmp"
+    common.mkdir_p(os.path.dirname(path) or ".")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    with os.fdopen(fd, "wb") as f:
+        header = dict(header, version=FORMAT_VERSION)
+        _write_record(f, header)
+        record = []
+        for key, (mod_index, parsed) in parse_cache.iteritems():
+            record.append((key, mod_index, parsed))
+            if len(record) >= RECORD_SIZE:
+                _write_record(f, record)
+                record = []
+                gevent.sleep(0)
+        if record:
+            _write_record(f, record)
+        _write_record(f, [])
+    os.rename(tmp_path, path)
+    _log.info("Saved %s entries to %s", len(parse_cache), path)
+
+
+def load(path):
+    """
+    Reads a file written by save().
+
+    :returns tuple: (header, parse_cache) or None if there is no file, or
+        it is unreadable, corrupt or from another version of Felix.
+    """
+    try:
+        with open(path, "rb") as f:
+            header = _read_record(f)
+            if (not isinstance(header, dict) or
+                    header.get("version") != FORMAT_VERSION):
+                _log.warning("Ignoring snapshot cache %s from a different "
+                             "version", path)
+                return None
+            parse_cache = {}
+            while True:
+                record = _read_record(f)
+                if not record:
+                    break
+                for key, mod_index, parsed in record:
+                    parse_cache[key] = (mod_index, parsed)
+    except IOError as e:
+        _log.info("No snapshot cache loaded from %s: %r", path, e)
+        return None
+    except Exception:
+        # Unpickling garbage can raise almost anything.
+        _log.exception("Ignoring corrupt snapshot cache %s", path)
+        return None
+    _log.info("Loaded %s entries from %s", len(parse_cache), path)
+    return header, parse_cache
+
+
+def _write_record(f, obj):
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    f.write(_LENGTH.pack(len(data)))
+    f.write(data)
+
+
+def _read_record(f):
+    length, = _LENGTH.unpack(_read_exactly(f, _LENGTH.size))
+    return pickle.loads(_read_exactly(f, length))
+
+
+def _read_exactly(f, num_bytes):
+    data = f.read(num_bytes)
+    if len(data) != num_bytes:
+        raise CorruptSnapshotCache("Truncated snapshot cache")
+    return data
@@ -18,25 +18,48 @@ felix.splitter
 ~~~~~~~~~~~~~
 
 Simple object that just splits notifications out for IPv4 and IPv6.
+
+Endpoints on other hosts are only needed for ipset membership so they are
+only passed to the ipset managers.
 """
 import functools
 import logging
 import gevent
-from calico.felix.actor import Actor, actor_message
+from calico import common
+from calico.felix import frules
+from calico.felix.actor import Actor, actor_message, PRIORITY_HIGH
+from calico.felix.config import LOGGING_ATTRS, METADATA_ATTRS
 
 _log = logging.getLogger(__name__)
 
 
 class UpdateSplitter(Actor):
+    # The EtcdWatcher sends updates without waiting for each one, so it
+    # relies on this to stop it getting too far ahead.
+    queue_high_water_mark = 1000
+
     def __init__(self, config, ipsets_mgrs, rules_managers, endpoint_managers,
-                 iptables_updaters):
+                 iptables_updaters, remote_splitters=(), nat_updaters=()):
+        """
+        :param remote_splitters: RemoteSplitters for worker processes that
+            run the pipelines for other IP versions.  Every update is passed
+            on to them as-is.
+        :param nat_updaters: IptablesUpdaters for the nat tables, if this
+            process owns them.
+        """
         super(UpdateSplitter, self).__init__()
         self.config = config
         self.ipsets_mgrs = ipsets_mgrs
         self.iptables_updaters = iptables_updaters
+        self.nat_updaters = nat_updaters
         self.rules_mgrs = rules_managers
         self.endpoint_mgrs = endpoint_managers
+        self.remote_splitters = remote_splitters
         self._cleanup_scheduled = False
+        # IDs of the endpoints on this host that we've passed to the
+        # endpoint managers.  They don't need to hear about endpoints on
+        # other hosts.
+        self._local_endpoint_ids = set()
 
     @actor_message()
     def apply_snapshot(self, rules_by_prof_id, tags_by_prof_id,
@@ -56,14 +79,24 @@ class UpdateSplitter(Actor):
                                      async=True)
 
         # Step 2: fire in update events into the endpoint manager, which will
-        # recursively trigger activation of profiles and tags.
+        # recursively trigger activation of profiles and tags.  It only
+        # needs to know about our local endpoints.
         _log.info("Applying snapshot. STAGE 2: endpoints->endpoint mgr.")
+        local_endpoints_by_id = {}
+        for endpoint_id, endpoint in endpoints_by_id.iteritems():
+            if endpoint.host == self.config.HOSTNAME:
+                local_endpoints_by_id[endpoint_id] = endpoint
+        self._local_endpoint_ids = set(local_endpoints_by_id.keys())
         for ep_mgr in self.endpoint_mgrs:
-            ep_mgr.apply_snapshot(endpoints_by_id, async=True)
+            ep_mgr.apply_snapshot(local_endpoints_by_id, async=True)
+        for remote_splitter in self.remote_splitters:
+            remote_splitter.apply_snapshot(rules_by_prof_id, tags_by_prof_id,
+                                           endpoints_by_id, oneway=True)
 
         _log.info("Applying snapshot. DONE. %s rules, %s tags, "
-                  "%s endpoints", len(rules_by_prof_id), len(tags_by_prof_id),
-                  len(endpoints_by_id))
+                  "%s endpoints (%s local)", len(rules_by_prof_id),
+                  len(tags_by_prof_id), len(endpoints_by_id),
+                  len(local_endpoints_by_id))
 
         # Since we don't wait for all the above processing to finish, set a
         # timer to clean up orphaned ipsets and tables later.  If the snapshot
@@ -108,7 +141,9 @@ class UpdateSplitter(Actor):
         """
         _log.info("Profile update: %s", profile_id)
         for rules_mgr in self.rules_mgrs:
-            rules_mgr.on_rules_update(profile_id, rules, async=True)
+            rules_mgr.on_rules_update(profile_id, rules, oneway=True)
+        for remote_splitter in self.remote_splitters:
+            remote_splitter.on_rules_update(profile_id, rules, oneway=True)
 
     @actor_message()
     def on_tags_update(self, profile_id, tags):
@@ -119,13 +154,17 @@ class UpdateSplitter(Actor):
         """
         _log.info("Tags for profile %s updated", profile_id)
         for ipset_mgr in self.ipsets_mgrs:
-            ipset_mgr.on_tags_update(profile_id, tags, async=True)
+            ipset_mgr.on_tags_update(profile_id, tags, oneway=True)
+        for remote_splitter in self.remote_splitters:
+            remote_splitter.on_tags_update(profile_id, tags, oneway=True)
 
-    @actor_message()
+    @actor_message(priority=PRIORITY_HIGH)
     def on_interface_update(self, name):
         _log.info("Interface %s state changed", name)
         for endpoint_mgr in self.endpoint_mgrs:
-            endpoint_mgr.on_interface_update(name, async=True)
+            endpoint_mgr.on_interface_update(name, oneway=True)
+        for remote_splitter in self.remote_splitters:
+            remote_splitter.on_interface_update(name, oneway=True)
 
     @actor_message()
     def on_endpoint_update(self, endpoint_id, endpoint):
@@ -135,6 +174,57 @@ class UpdateSplitter(Actor):
         """
         _log.info("Endpoint update for %s.", endpoint_id)
         for ipset_mgr in self.ipsets_mgrs:
-            ipset_mgr.on_endpoint_update(endpoint_id, endpoint, async=True)
+            ipset_mgr.on_endpoint_update(endpoint_id, endpoint, oneway=True)
+        for remote_splitter in self.remote_splitters:
+            remote_splitter.on_endpoint_update(endpoint_id, endpoint,
+                                               oneway=True)
+
+        # The endpoint managers only handle endpoints on this host.
+        if endpoint is not None and endpoint.host == self.config.HOSTNAME:
+            self._local_endpoint_ids.add(endpoint_id)
+        elif endpoint_id in self._local_endpoint_ids:
+            # Deleted or moved to another host; either way, it's gone as far
+            # as the endpoint managers are concerned.
+            self._local_endpoint_ids.discard(endpoint_id)
+            endpoint = None
+        else:
+            _log.debug("Endpoint %s is not local", endpoint_id)
+            return
         for endpoint_mgr in self.endpoint_mgrs:
-            endpoint_mgr.on_endpoint_update(endpoint_id, endpoint, async=True)
+            endpoint_mgr.on_endpoint_update(endpoint_id, endpoint,
+                                            oneway=True)
+
+    @actor_message()
+    def on_config_update(self, changes):
+        """
+        Applies config that has changed in etcd.
+
+        The other actors may see the new config before they have processed
+        updates that were queued ahead of this.  They must not depend on
+        that order; for example, endpoints keep the chain names that they
+        were created with when the interface prefix changes.
+
+        :param dict changes: map from Config attribute name to new value.
+        """
+        _log.info("Config updated: %s", changes)
+        # Updates the config of a worker process.  In the main process, the
+        # EtcdWatcher already updated the (shared) config.
+        for attr, value in changes.iteritems():
+            setattr(self.config, attr, value)
+        for remote_splitter in self.remote_splitters:
+            remote_splitter.on_config_update(changes, oneway=True)
+
+        changed_attrs = set(changes)
+        if changed_attrs & LOGGING_ATTRS:
+            common.complete_logging(self.config.LOGFILE,
+                                    self.config.LOGLEVFILE,
+                                    self.config.LOGLEVSYS,
+                                    self.config.LOGLEVSCR)
+        if changed_attrs & METADATA_ATTRS:
+            _log.info("Reprogramming global nat rules")
+            for nat_updater in self.nat_updaters:
+                frules.install_global_nat_rules(self.config, nat_updater)
+        if "IFACE_PREFIX" in changed_attrs:
+            _log.info("Reprogramming global filter rules")
+            for ipt_updater in self.iptables_updaters:
+                frules.install_global_filter_rules(self.config, ipt_updater)
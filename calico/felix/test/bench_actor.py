@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+# Copyright 2015 Metaswitch Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+felix.test.bench_actor
+~~~~~~~~~~~~~~~~~~~~~~
+
+Benchmarks for the Actor framework.  Not run as part of the UTs, run with:
+
+    python -m calico.felix.test.bench_actor [num messages [scenario ...]]
+
+Each scenario drives a synthetic message storm through some actors and
+reports the throughput, the p50/p99 latency of each message (from being
+sent to being processed) and the peak RSS of the process.  Scenarios are run
+in their own child process so that their peak memory can be measured
+independently.
+"""
+import functools
+import gc
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import gevent
+from gevent.event import Event
+
+from calico.felix.actor import (Actor, actor_message, ResultOrExc,
+                                SplitBatchAndRetry)
+from calico.felix.refcount import ReferenceManager, RefCountedActor
+
+_log = logging.getLogger(__name__)
+
+CHAIN_LENGTH = 5
+"""Number of actors in the chain scenario."""
+
+BAD_MSG_INTERVAL = 1000
+"""In the split scenario, one message in this many fails."""
+
+REF_BATCH_SIZE = 100
+"""Number of references acquired at once in the refcount scenario."""
+
+
+class LatencyActor(Actor):
+    """
+    Actor that records the time taken for each message to reach it,
+    optionally forwarding the messages to another LatencyActor.
+    """
+    def __init__(self, qualifier=None, next_actor=None):
+        super(LatencyActor, self).__init__(qualifier=qualifier)
+        self.next_actor = next_actor
+        self.latencies = []
+
+    @actor_message()
+    def record(self, sent_time):
+        if self.next_actor is not None:
+            self.next_actor.record(sent_time, oneway=True)
+        else:
+            self.latencies.append(time.time() - sent_time)
+
+    @actor_message(needs_own_batch=True)
+    def record_own_batch(self, sent_time):
+        self.latencies.append(time.time() - sent_time)
+
+    @actor_message()
+    def flush(self):
+        pass
+
+
+class SplittingActor(Actor):
+    """
+    Actor that can only report a failure by splitting its batch, like the
+    IptablesUpdater when it can't tell which message failed.
+    """
+    def __init__(self):
+        super(SplittingActor, self).__init__()
+        self.latencies = []
+
+    @actor_message()
+    def record(self, sent_time, bad):
+        self.latencies.append(time.time() - sent_time)
+        return bad
+
+    def _finish_msg_batch(self, batch, results):
+        if any(r.result for r in results):
+            if len(batch) > 1:
+                raise SplitBatchAndRetry()
+            results[0] = ResultOrExc(None, ValueError("Bad message"))
+
+
+class BenchRefActor(RefCountedActor):
+    @actor_message()
+    def on_started(self):
+        self._notify_ready()
+
+
+class BenchRefMgr(ReferenceManager):
+    def _create(self, object_id):
+        return BenchRefActor(qualifier=object_id)
+
+    def _on_object_started(self, object_id, obj):
+        obj.on_started(oneway=True)
+
+
+def bench_async(num_msgs):
+    actor = LatencyActor().start()
+    results = []
+    for _ in xrange(num_msgs):
+        results.append(actor.record(time.time(), async=True))
+    for r in results:
+        r.get()
+    return actor.latencies
+
+
+def bench_oneway(num_msgs):
+    actor = LatencyActor().start()
+    for _ in xrange(num_msgs):
+        actor.record(time.time(), oneway=True)
+    # Messages are processed in order so, once this returns, all the one-way
+    # messages have been processed too.
+    actor.flush(async=False)
+    return actor.latencies
+
+
+def bench_sync(num_msgs):
+    actor = LatencyActor().start()
+    for _ in xrange(num_msgs):
+        actor.record(time.time(), async=False)
+    return actor.latencies
+
+
+def bench_own_batch(num_msgs):
+    actor = LatencyActor().start()
+    for _ in xrange(num_msgs):
+        actor.record_own_batch(time.time(), oneway=True)
+    actor.flush(async=False)
+    return actor.latencies
+
+
+def bench_split(num_msgs):
+    actor = SplittingActor().start()
+    results = []
+    for ii in xrange(num_msgs):
+        results.append(actor.record(time.time(),
+                                    ii % BAD_MSG_INTERVAL == 0,
+                                    async=True))
+    for r in results:
+        try:
+            r.get()
+        except ValueError:
+            pass
+    # Messages are re-executed when a batch is split, only count the last
+    # execution of each message.
+    return actor.latencies[-num_msgs:]
+
+
+def bench_chain(num_msgs):
+    tail = LatencyActor(qualifier=str(CHAIN_LENGTH - 1)).start()
+    head = tail
+    for ii in reversed(xrange(CHAIN_LENGTH - 1)):
+        head = LatencyActor(qualifier=str(ii), next_actor=head).start()
+    for _ in xrange(num_msgs):
+        head.record(time.time(), oneway=True)
+    while len(tail.latencies) < num_msgs:
+        gevent.sleep(0.001)
+    return tail.latencies
+
+
+def bench_refcount(num_msgs):
+    """
+    Acquires and releases num_msgs references, each to a new
+    RefCountedActor, REF_BATCH_SIZE at a time.  Latency is from the incref
+    request to the callback.
+    """
+    mgr = BenchRefMgr().start()
+    latencies = []
+    all_acquired = Event()
+
+    def on_acquired(sent_time, num_expected, obj_id, obj):
+        latencies.append(time.time() - sent_time)
+        if len(latencies) == num_expected:
+            all_acquired.set()
+
+    for batch_start in xrange(0, num_msgs, REF_BATCH_SIZE):
+        batch_end = min(batch_start + REF_BATCH_SIZE, num_msgs)
+        ids = ["ref-%s" % ii for ii in xrange(batch_start, batch_end)]
+        all_acquired.clear()
+        for obj_id in ids:
+            callback = functools.partial(on_acquired, time.time(), batch_end)
+            mgr.get_and_incref(obj_id, callback=callback, async=True)
+        all_acquired.wait()
+        for obj_id in ids:
+            mgr.decref(obj_id, oneway=True)
+    # Wait for the last batch to be cleaned up.
+    while mgr.stopping_objects_by_id:
+        gevent.sleep(0.001)
+    return latencies
+
+
+def bench_burst(num_msgs):
+    """
+    Queues a burst of num_msgs messages before the actor starts, then lets
+    it process them.
+    """
+    actor = LatencyActor()
+    results = []
+    for _ in xrange(num_msgs):
+        results.append(actor.record(time.time(), async=True))
+    actor.start()
+    for r in results:
+        r.get()
+    return actor.latencies
+
+
+SCENARIOS = [
+    ("async", bench_async),
+    ("oneway", bench_oneway),
+    ("sync", bench_sync),
+    ("own_batch", bench_own_batch),
+    ("split", bench_split),
+    ("chain", bench_chain),
+    ("refcount", bench_refcount),
+    ("burst", bench_burst),
+]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * pct / 100.0),
+                len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_scenario(name, num_msgs):
+    """
+    Runs the named scenario in this process.
+
+    :returns str: a line describing the results.
+    """
+    fn = dict(SCENARIOS)[name]
+    gc.collect()
+    start = time.time()
+    latencies = fn(num_msgs)
+    duration = time.time() - start
+    latencies.sort()
+    return "%-10s %10.0f %10.3f %10.3f %10.1f" % (
+        name, num_msgs / duration, percentile(latencies, 50) * 1000,
+        percentile(latencies, 99) * 1000, peak_rss_mb())
+
+
+def main(argv):
+    # Only log errors, as we would in production.
+    logging.basicConfig(level=logging.ERROR, stream=sys.stderr)
+    if len(argv) > 1 and argv[1] == "--child":
+        print run_scenario(argv[2], int(argv[3]))
+        return
+    num_msgs = int(argv[1]) if len(argv) > 1 else 100000
+    names = argv[2:] or [name for name, _ in SCENARIOS]
+    print "%-10s %10s %10s %10s %10s" % ("scenario", "msgs/s", "p50 ms",
+                                         "p99 ms", "peak MB")
+    for name in names:
+        child = subprocess.Popen([sys.executable, "-m",
+                                  "calico.felix.test.bench_actor",
+                                  "--child", name, str(num_msgs)],
+                                 stdout=subprocess.PIPE,
+                                 cwd=os.getcwd())
+        out, _ = child.communicate()
+        sys.stdout.write(out)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
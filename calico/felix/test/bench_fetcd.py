@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Copyright 2015 Metaswitch Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+felix.test.bench_fetcd
+~~~~~~~~~~~~~~~~~~~~~~
+
+Benchmark of snapshot parsing.  Builds a synthetic etcd dump of endpoints
+spread over many hosts, plus a profile per host, and reports the time taken
+to decode the endpoints alone and to load the whole dump with the original
+decoder (json with an interning object_hook),
+with the current decoder and then again as a resync, where nothing has
+changed so every key is served from the parse cache.  Not run as part of
+the UTs, run with:
+
+    python -m calico.felix.test.bench_fetcd [num endpoints]
+"""
+import gc
+import json
+import logging
+import sys
+import time
+
+import mock
+
+from calico.datamodel_v1 import (READY_KEY, POLICY_DIR, HOST_DIR,
+                                 key_for_endpoint, key_for_profile_rules,
+                                 key_for_profile_tags, dir_for_host)
+from calico.felix import fetcd
+
+_log = logging.getLogger(__name__)
+
+ENDPOINTS_PER_HOST = 50
+"""Number of endpoints on each host in the dump."""
+
+
+def _intern_dict(d):
+    return dict((intern(str(k)), v) for k, v in d.iteritems())
+_old_decoder = json.JSONDecoder(object_hook=_intern_dict)
+
+
+def old_decode_json(value):
+    """The decoder used before decode_json was introduced."""
+    return _old_decoder.decode(value)
+
+
+def node(key, value=None, is_dir=False, modified_index=1):
+    return mock.Mock(key=key, value=value, dir=is_dir, action="get",
+                     modifiedIndex=modified_index)
+
+
+def build_tree(num_endpoints):
+    """
+    :returns dict: mapping from each directory that the EtcdWatcher reads
+        to a fake etcd result for it.
+    """
+    num_hosts = max(1, num_endpoints // ENDPOINTS_PER_HOST)
+    policy = []
+    tree = {
+        READY_KEY: mock.Mock(value="true", etcd_index=1000000),
+        POLICY_DIR: mock.Mock(children=policy),
+    }
+    host_nodes = []
+    for host_num in xrange(num_hosts):
+        hostname = "host%d" % host_num
+        profile_id = "prof%d" % host_num
+        rules = {
+            "inbound_rules": [{"src_tag": profile_id, "action": "allow"},
+                              {"protocol": "tcp", "dst_ports": [80, 443],
+                               "src_net": "10.0.0.0/8"}],
+            "outbound_rules": [{"action": "allow"}],
+        }
+        policy.append(node(key_for_profile_rules(profile_id),
+                           json.dumps(rules)))
+        policy.append(node(key_for_profile_tags(profile_id),
+                           json.dumps([profile_id])))
+        host_nodes.append(node(dir_for_host(hostname), is_dir=True))
+        endpoints = []
+        for ep_num in xrange(ENDPOINTS_PER_HOST):
+            ii = host_num * ENDPOINTS_PER_HOST + ep_num
+            endpoint = {
+                "state": "active",
+                "name": "tap%08x" % ii,
+                "mac": "aa:bb:%02x:%02x:%02x:%02x" % (
+                    (ii >> 24) & 0xff, (ii >> 16) & 0xff,
+                    (ii >> 8) & 0xff, ii & 0xff),
+                "profile_id": profile_id,
+                "ipv4_nets": ["10.%d.%d.%d/32" % ((ii >> 16) & 0xff,
+                                                  (ii >> 8) & 0xff,
+                                                  ii & 0xff)],
+                "ipv6_nets": ["2001:db8::%x/128" % ii],
+                "ipv4_gateway": "10.0.0.1",
+                "ipv6_gateway": "2001:db8::1",
+            }
+            endpoints.append(node(key_for_endpoint(hostname, "orch",
+                                                   "wl%d" % ii, "ep%d" % ii),
+                                  json.dumps(endpoint)))
+        tree[dir_for_host(hostname)] = mock.Mock(children=endpoints)
+    tree[HOST_DIR] = mock.Mock(children=host_nodes)
+    return tree
+
+
+def create_watcher(tree):
+    config = mock.Mock()
+    config.HOSTNAME = "host0"
+    config.IFACE_PREFIX = "tap"
+    config.SNAPSHOT_CACHE_PATH = None
+    watcher = fetcd.EtcdWatcher(config)
+    watcher.client = mock.Mock()
+    watcher.client.read.side_effect = \
+        lambda key, recursive=False: tree[key]
+    return watcher
+
+
+def time_load(watcher):
+    gc.collect()
+    start = time.time()
+    snapshot = watcher._load_snapshot()
+    duration = time.time() - start
+    assert snapshot is not None
+    return duration
+
+
+def time_decode(tree, decode):
+    values = [child.value for key, result in tree.iteritems()
+              if key.startswith(HOST_DIR)
+              for child in result.children if child.value]
+    gc.collect()
+    start = time.time()
+    for value in values:
+        decode(value)
+    return time.time() - start
+
+
+def main(argv):
+    # Only log errors, as we would in production.
+    logging.basicConfig(level=logging.ERROR, stream=sys.stderr)
+    num_endpoints = int(argv[1]) if len(argv) > 1 else 50000
+    tree = build_tree(num_endpoints)
+    print "Decoder: %s.%s" % (fetcd.decode_json.__module__,
+                              fetcd.decode_json.__name__)
+
+    print "%-20s %8.2fs" % ("old decode only",
+                            time_decode(tree, old_decode_json))
+    print "%-20s %8.2fs" % ("new decode only",
+                            time_decode(tree, fetcd.decode_json))
+
+    with mock.patch("calico.felix.fetcd.decode_json", old_decode_json):
+        old_time = time_load(create_watcher(tree))
+    print "%-20s %8.2fs" % ("old decoder", old_time)
+
+    watcher = create_watcher(tree)
+    print "%-20s %8.2fs" % ("new decoder", time_load(watcher))
+    print "%-20s %8.2fs" % ("resync (cached)", time_load(watcher))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Copyright 2015 Metaswitch Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+felix.test.bench_fiptables
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Benchmark of IptablesUpdater's handling of a failed batch.  Sends a batch of
+chain rewrites, one of which contains a bad rule, to an IptablesUpdater with
+a fake iptables-restore and reports the number of restores and the time taken
+to isolate the bad message, both with the failing line mapped back to its
+message and by bisecting the batch.  Not run as part of the UTs, run with:
+
+    python -m calico.felix.test.bench_fiptables [num messages]
+"""
+import logging
+import sys
+import time
+
+import mock
+
+from calico.felix import fiptables
+from calico.felix.test.stub_utils import FakeRestore
+
+_log = logging.getLogger(__name__)
+
+RESTORE_COST = 0.01
+"""Simulated fixed cost of each iptables-restore, in seconds."""
+
+
+def bench_bad_chain(num_msgs, bisect):
+    """
+    Sends a batch of num_msgs chain rewrites, with one bad chain in the
+    middle, and waits for them all to be processed.
+
+    :param bisect: If True, disables mapping of the failing line back to
+        its message, forcing the updater to bisect the batch.
+    :returns: tuple of (number of restores, time taken).
+    """
+    config = mock.Mock()
+    config.MIN_BATCH_DELAY = 0
+    config.MAX_BATCH_DELAY = 0
+    updater = fiptables.IptablesUpdater("filter", config)
+    restore = FakeRestore(cost=RESTORE_COST)
+    updater._execute_iptables = restore
+    if bisect:
+        updater._find_culprit = lambda error: None
+    bad_index = num_msgs // 2
+    results = []
+    for ii in xrange(num_msgs):
+        target = "BAD" if ii == bad_index else "ACCEPT"
+        chain = "felix-bench-%s" % ii
+        results.append(updater.rewrite_chains(
+            {chain: ["--append %s --jump %s" % (chain, target)]}, {},
+            async=True))
+    start = time.time()
+    updater.start()
+    for result in results:
+        try:
+            result.get()
+        except fiptables.CalledProcessError:
+            pass
+    return restore.num_calls, time.time() - start
+
+
+def main(argv):
+    # Only log critical errors, so that logging doesn't skew the timings.
+    logging.basicConfig(level=logging.CRITICAL, stream=sys.stderr)
+    num_msgs = int(argv[1]) if len(argv) > 1 else 1000
+    for name, bisect in [("isolate", False), ("bisect", True)]:
+        num_calls, duration = bench_bad_chain(num_msgs, bisect)
+        print "%-8s %5d msgs, 1 bad: %4d restores, %.3fs" % (
+            name, num_msgs, num_calls, duration)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
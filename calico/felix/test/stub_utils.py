@@ -22,6 +22,11 @@ import logging
 import random
 
 from collections import namedtuple
+
+import gevent
+
+from calico.felix import fiptables
+
 CommandOutput = namedtuple('CommandOutput', ['stdout', 'stderr'])
 
 # Logger
@@ -54,3 +59,26 @@ def get_mac():
 # Exception raised when tests reach the end.
 class TestOverException(Exception):
     pass
+
+
+class FakeRestore(object):
+    """
+    Stand-in for IptablesUpdater._execute_iptables that fails on any line
+    containing "BAD", as iptables-restore would.
+    """
+    def __init__(self, cost=0):
+        """
+        :param cost: simulated time taken by each restore, in seconds.
+        """
+        self.num_calls = 0
+        self.cost = cost
+
+    def __call__(self, input_lines):
+        self.num_calls += 1
+        if self.cost:
+            gevent.sleep(self.cost)
+        for ii, line in enumerate(input_lines):
+            if "BAD" in line:
+                raise fiptables.IptablesRestoreError(
+                    returncode=2, cmd=["iptables-restore"],
+                    line_number=ii + 1)
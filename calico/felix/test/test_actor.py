@@ -19,13 +19,16 @@ felix.test.test_actor
 Tests of the Actor framework.
 """
 
+import functools
 import logging
 import itertools
 from contextlib import nested
 
+import gevent.local
 from gevent.event import AsyncResult
 import mock
-from calico.felix.actor import actor_message, ResultOrExc, SplitBatchAndRetry
+from calico.felix.actor import (actor_message, ResultOrExc,
+                                SplitBatchAndRetry, FailMessagesAndRetry)
 from calico.felix.test.base import BaseTestCase
 from calico.felix import actor
 
@@ -38,6 +41,8 @@ log = logging.getLogger(__name__)
 class TestActor(BaseTestCase):
     def setUp(self):
         super(TestActor, self).setUp()
+        # Stats are registered by actor name, make sure we start afresh.
+        actor._stats_by_name.clear()
         self._actor = ActorForTesting()
         mock.patch.object(self._actor, "_start_msg_batch",
                           wraps=self._actor._start_msg_batch).start()
@@ -107,6 +112,78 @@ class TestActor(BaseTestCase):
             ResultOrExc(result='b', exception=None),
         ])
 
+    def test_oneway(self):
+        """
+        Tests one-way messages are processed but have no result.
+        """
+        num_refs = len(actor._refs)
+        self.assertEqual(self._actor.do_a(oneway=True), None)
+        self.assertEqual(len(actor._refs), num_refs)
+        self.run_actor_loop()
+        self.assertEqual(self._actor.actions, ["sb", "a", "fb"])
+        self.assertFalse(self._m_exit.called)
+
+    def test_oneway_exception(self):
+        """
+        Tests an exception from a one-way message goes to the actor's
+        handler rather than to the other messages in the batch.
+        """
+        f_a = self._actor.do_a(async=True)
+        self._actor.do_exc(oneway=True)
+        with mock.patch.object(self._actor, "_on_oneway_exception",
+                               autospec=True) as m_on_exc:
+            self.run_actor_loop()
+        self.assertEqual("a", f_a.get())
+        m_on_exc.assert_called_once_with(mock.ANY, EXPECTED_EXCEPTION)
+        self.assertEqual(m_on_exc.call_args[0][0].name, "do_exc")
+
+    def test_oneway_exception_default(self):
+        """
+        Tests the default handling of a failed one-way message is to exit.
+        """
+        self._actor.do_exc(oneway=True)
+        self.run_actor_loop()
+        self._m_exit.assert_called_once_with(1)
+        self._m_exit.reset_mock()
+
+    def test_oneway_merged(self):
+        """
+        Tests a one-way message superseding an async one still reports
+        the result to the async caller.
+        """
+        f_1 = self._actor.do_set("k", 1, async=True)
+        self._actor.do_set("k", 2, oneway=True)
+        self.run_actor_loop()
+        self.assertEqual(f_1.get(), 2)
+
+    def test_priority(self):
+        """
+        Tests high-priority messages jump ahead of normal ones but
+        ordering is preserved within each priority.
+        """
+        self._actor.do_a(async=True)
+        self._actor.do_b(async=True)
+        self._actor.do_urgent(1, async=True)
+        self._actor.do_a(async=True)
+        self._actor.do_urgent(2, async=True)
+        self.assertEqual(self._actor._event_queue.qsize(), 5)
+        self.run_actor_loop()
+        self.assertEqual(self._actor.actions,
+                         ["sb", "urgent 1", "urgent 2", "a", "b", "a", "fb"])
+        self.assertTrue(self._actor._event_queue.empty())
+
+    def test_priority_own_batch(self):
+        """
+        Tests a high-priority message overtakes a needs_own_batch message.
+        """
+        self._actor.do_own_batch(async=True)
+        self._actor.do_urgent(1, async=True)
+        self.run_actor_loop()
+        self.assertEqual(self._actor.batches, [
+            ["sb", "urgent 1", "fb"],
+            ["sb", "own", "fb"],
+        ])
+
     def test_split_batch(self):
         """
         Tests an exception raised by an event method is returned to the
@@ -145,6 +222,27 @@ class TestActor(BaseTestCase):
             ["sb", "b", "a", "fb"],
         ])
 
+    def test_fail_messages_and_retry(self):
+        f_a1 = self._actor.do_a(async=True)
+        f_b = self._actor.do_b(async=True)
+        f_a2 = self._actor.do_a(async=True)
+
+        def fail_b(batch):
+            for msg in batch:
+                if msg.name == "do_b":
+                    return FailMessagesAndRetry({msg: EXPECTED_EXCEPTION})
+        self._actor._finish_side_effects = iter([fail_b, None])
+        self.run_actor_loop()
+        self.assertEqual(self._actor.batches, [
+            ["sb", "a", "b", "a", "fb"],
+            ["sb", "a", "a", "fb"],
+        ])
+        self.assertEqual(f_a1.get(), "a")
+        self.assertEqual(f_a2.get(), "a")
+        self.assertRaises(ExpectedException, f_b.get)
+        self.assertEqual(
+            self._actor._stats.counters["failed and retried"], 1)
+
     def test_split_batch_exc(self):
         f_a = self._actor.do_a(async=True)
         f_exc = self._actor.do_exc(async=True)
@@ -180,6 +278,33 @@ class TestActor(BaseTestCase):
             ["sb", "a", "b", "fb"],
         ])
 
+    def test_merge_superseded(self):
+        f_1 = self._actor.do_set("k1", 1, async=True)
+        f_2 = self._actor.do_set("k2", 2, async=True)
+        f_a = self._actor.do_a(async=True)
+        f_3 = self._actor.do_set("k1", 3, async=True)
+        self.run_actor_loop()
+        # The first update to k1 should be dropped but its caller should
+        # still get a result.
+        self.assertEqual(self._actor.actions,
+                         ["sb", "set k2=2", "a", "set k1=3", "fb"])
+        self.assertEqual(f_1.get(), 3)
+        self.assertEqual(f_2.get(), 2)
+        self.assertEqual(f_a.get(), "a")
+        self.assertEqual(f_3.get(), 3)
+        self.assertEqual(self._actor._stats.counters["merged messages"], 1)
+
+    def test_merge_not_across_own_batch(self):
+        self._actor.do_set("k1", 1, async=True)
+        self._actor.do_own_batch(async=True)
+        self._actor.do_set("k1", 2, async=True)
+        self.run_actor_loop()
+        self.assertEqual(self._actor.batches, [
+            ["sb", "set k1=1", "fb"],
+            ["sb", "own", "fb"],
+            ["sb", "set k1=2", "fb"],
+        ])
+
     def test_blocking_call(self):
         self._actor.start()  # Really start it.
         self._actor.do_a(async=False)
@@ -214,6 +339,17 @@ class TestActor(BaseTestCase):
             self.step_actor(self._actor)
             m_sleep.assert_called_once_with(1)
 
+    def test_batch_delay_policy(self):
+        m_policy = mock.Mock(spec=actor.AdaptiveBatchDelay)
+        m_policy.get_delay.return_value = 0.5
+        self._actor.batch_delay_policy = m_policy
+        with mock.patch("gevent.sleep", autospec=True) as m_sleep:
+            self._actor.do_a(async=True)
+            self._actor.do_b(async=True)
+            self.step_actor(self._actor)
+            m_sleep.assert_called_once_with(0.5)
+        m_policy.record_batch.assert_called_once_with(2, mock.ANY, mock.ANY)
+
     @mock.patch("gevent.sleep", autospec=True)
     def test_yield(self, m_sleep):
         self._actor.max_ops_before_yield = 2
@@ -226,6 +362,256 @@ class TestActor(BaseTestCase):
     def test_wait_and_check_no_input(self):
         actor.wait_and_check([])
 
+    def test_msg_caller(self):
+        with nested(mock.patch.object(self._actor._event_queue, "put",
+                                      autospec=True),
+                    mock.patch("calico.felix.actor.actor_storage",
+                               gevent.local.local())) as (m_put, _):
+            self._actor.do_a(async=True)
+        msg = m_put.call_args[0][0]
+        self.assertTrue(msg.caller.startswith("test_actor.py:"))
+        self.assertTrue(msg.caller.endswith(":test_msg_caller"))
+
+    def test_msg_caller_actor(self):
+        msg = actor.Message(functools.partial(ActorForTesting.do_a.func),
+                            [], ("Foo", 1234, None), "Bar",
+                            needs_own_batch=False)
+        self.assertEqual(msg.caller, "Foo (processing 1234)")
+
+    def test_msg_caller_not_formatted(self):
+        # The caller is only formatted if debug logs are enabled.
+        with nested(mock.patch.object(actor._log, "isEnabledFor",
+                                      autospec=True, return_value=False),
+                    mock.patch.object(actor.Message, "caller",
+                                      new_callable=mock.PropertyMock)) as \
+                (_, m_caller):
+            self._actor.do_a(async=True)
+            self._actor._step()
+        self.assertFalse(m_caller.called)
+
+    def test_stats(self):
+        self._actor.do_a(async=True)
+        self._actor.do_b(async=True)
+        self._actor.do_a(async=True)
+        self._actor.do_own_batch(async=True)
+        self.run_actor_loop()
+        stats = actor.get_actor_stats("ActorForTesting")
+        self.assertTrue(stats is self._actor._stats)
+        self.assertEqual(stats.messages, 4)
+        self.assertEqual(stats.batches, 2)
+        self.assertEqual(stats.max_queue_len, 4)
+        self.assertEqual(stats.splits, 0)
+        # One batch of size 1, one of size 3.
+        self.assertEqual(stats.batch_size_hist[0], 1)
+        self.assertEqual(stats.batch_size_hist[2], 1)
+        self.assertEqual(stats.method_times["do_a"][0], 2)
+        self.assertEqual(stats.method_times["do_b"][0], 1)
+        self.assertEqual(stats.method_times["_finish_msg_batch"][0], 2)
+        self.assertTrue(stats.total_time >= 0)
+
+    def test_stats_split(self):
+        self._actor.do_a(async=True)
+        self._actor.do_b(async=True)
+        self._actor._finish_side_effects = iter([
+            SplitBatchAndRetry(),
+            None,
+            None,
+        ])
+        self.run_actor_loop()
+        stats = self._actor._stats
+        self.assertEqual(stats.splits, 1)
+        # Re-executed messages are counted again.
+        self.assertEqual(stats.messages, 4)
+        self.assertEqual(stats.batches, 3)
+
+    def test_per_class_stats(self):
+        class PerClassActor(ActorForTesting):
+            per_class_stats = True
+        a1 = PerClassActor(qualifier="1")
+        a2 = PerClassActor(qualifier="2")
+        self.assertTrue(a1._stats is a2._stats)
+        self.assertEqual(a1._stats.name, "PerClassActor")
+        self.assertEqual(ActorForTesting(qualifier="3")._stats.name,
+                         "ActorForTesting(3)")
+
+    def test_dump_stats(self):
+        self._actor.do_a(async=True)
+        self.run_actor_loop()
+        self._actor._stats.counters["foo"] += 1
+        with mock.patch("calico.felix.actor._log", autospec=True) as m_log:
+            actor.dump_actor_stats()
+        logged = "\n".join(c[0][1] for c in m_log.info.call_args_list[1:])
+        self.assertTrue("ActorForTesting: 1 msgs in 1 batches" in logged)
+        self.assertTrue("do_a: 1 calls" in logged)
+        self.assertTrue("foo: 1" in logged)
+
+
+class TestTracing(BaseTestCase):
+    def setUp(self):
+        super(TestTracing, self).setUp()
+        actor._stats_by_name.clear()
+        self._actor = ActorForTesting(qualifier="1")
+        self._actor2 = ActorForTesting(qualifier="2")
+
+    def test_single_hop(self):
+        with actor.start_trace("event 1", "test event") as trace:
+            self._actor.do_a(async=True)
+            self.assertEqual(trace.pending, 2)
+        self.assertEqual(trace.pending, 1)
+        # Messages sent outside the context don't carry the trace.
+        self._actor.do_b(async=True)
+        self.step_actor(self._actor)
+        self.assertEqual(trace.pending, 0)
+        self.assertEqual(trace.num_hops, 1)
+        self.assertEqual([h[:2] for h in trace.hops],
+                         [("ActorForTesting(1)", "do_a")])
+        stats = actor.get_actor_stats(actor.TRACE_STATS_NAME)
+        self.assertEqual(stats.method_times["test event"][0], 1)
+
+    def test_propagation(self):
+        with mock.patch("calico.felix.actor._log", autospec=True) as m_log:
+            with actor.start_trace("event 1", "test event") as trace:
+                self._actor.do_forward(self._actor2, async=True)
+            self.step_actor(self._actor)
+            self.assertEqual(trace.pending, 1)
+            self.assertFalse(m_log.info.called)
+            self.step_actor(self._actor2)
+        self.assertEqual(trace.pending, 0)
+        self.assertEqual([h[:2] for h in trace.hops],
+                         [("ActorForTesting(1)", "do_forward"),
+                          ("ActorForTesting(2)", "do_a")])
+        m_log.info.assert_called_once_with(
+            "%s programmed in %.1f ms (%d hops)", "event 1", mock.ANY, 2)
+
+    def test_finish_batch_propagation(self):
+        self._actor.forward_on_finish = self._actor2
+        with actor.start_trace("event 1", "test event") as trace:
+            self._actor.do_a(async=True)
+        self.step_actor(self._actor)
+        self.assertEqual(trace.pending, 1)
+        self.step_actor(self._actor2)
+        self.assertEqual(trace.pending, 0)
+        self.assertEqual(trace.num_hops, 2)
+
+    def test_merged(self):
+        with actor.start_trace("event 1", "test event") as trace1:
+            self._actor.do_set("k", 1, async=True)
+        with actor.start_trace("event 2", "test event") as trace2:
+            self._actor.do_set("k", 2, async=True)
+        self.step_actor(self._actor)
+        self.assertEqual(trace1.pending, 0)
+        self.assertEqual(trace2.pending, 0)
+
+
+class TestBackpressure(BaseTestCase):
+    def setUp(self):
+        super(TestBackpressure, self).setUp()
+        actor._stats_by_name.clear()
+        self._producer = ActorForTesting(qualifier="producer")
+        self._consumer = ActorForTesting(qualifier="consumer")
+        self._consumer.queue_high_water_mark = 2
+
+    def tearDown(self):
+        # Make sure we don't leave congested actors in the context of the
+        # main greenlet.
+        actor._greenlet_context().congested_peers = None
+        super(TestBackpressure, self).tearDown()
+
+    def test_congested_and_drained(self):
+        for _ in xrange(3):
+            self._consumer.do_a(oneway=True)
+        self.assertFalse(self._consumer._drained.is_set())
+        self.assertEqual(self._consumer._stats.counters["congested"], 1)
+        self.assertEqual(actor._greenlet_context().congested_peers,
+                         set([self._consumer]))
+        self.step_actor(self._consumer)
+        self.assertTrue(self._consumer._drained.is_set())
+
+    def test_not_congested(self):
+        for _ in xrange(2):
+            self._consumer.do_a(oneway=True)
+        self.assertTrue(self._consumer._drained.is_set())
+        self.assertFalse(actor._greenlet_context().congested_peers)
+
+    def test_wait_for_backpressure(self):
+        self._consumer.start()
+        for _ in xrange(5):
+            self._consumer.do_a(oneway=True)
+        actor.wait_for_backpressure()
+        self.assertTrue(self._consumer._drained.is_set())
+        self.assertEqual(self._consumer._event_queue.qsize(), 0)
+        self.assertEqual(self._consumer.actions.count("a"), 5)
+        self.assertEqual(
+            self._consumer._stats.counters["backpressure waits"], 1)
+        self.assertFalse(actor._greenlet_context().congested_peers)
+
+    def test_wait_for_backpressure_timeout(self):
+        for _ in xrange(3):
+            self._consumer.do_a(oneway=True)
+        with mock.patch.object(self._consumer, "greenlet"):
+            actor.wait_for_backpressure(timeout=0.001)
+        self.assertEqual(
+            self._consumer._stats.counters["backpressure timeouts"], 1)
+        self.assertFalse(actor._greenlet_context().congested_peers)
+
+    def test_actor_waits_after_batch(self):
+        self._consumer.queue_high_water_mark = 0
+        self._producer.do_forward(self._consumer, async=True)
+        with mock.patch("calico.felix.actor.wait_for_backpressure",
+                        autospec=True) as m_wait:
+            self.step_actor(self._producer)
+        m_wait.assert_called_once_with()
+
+    def test_queue_gauges(self):
+        self._consumer.do_a(oneway=True)
+        self._consumer.do_b(oneway=True)
+        queue_len, queue_mem = self._consumer._stats.queue_gauges()
+        self.assertEqual(queue_len, 2)
+        self.assertTrue(queue_mem > 0)
+        with mock.patch("calico.felix.actor._log", autospec=True) as m_log:
+            actor.dump_actor_stats()
+        logged = "\n".join(c[0][0] % c[0][1:]
+                           for c in m_log.info.call_args_list)
+        self.assertTrue("2 msgs queued" in logged)
+        self.assertTrue("queued now: 2 msgs" in logged)
+
+
+class TestAdaptiveBatchDelay(BaseTestCase):
+    def setUp(self):
+        super(TestAdaptiveBatchDelay, self).setUp()
+        self.policy = actor.AdaptiveBatchDelay(0.001, 0.1)
+
+    def test_first_batch(self):
+        self.assertEqual(self.policy.get_delay(100), 0.001)
+
+    def test_idle(self):
+        # Single slow message, followed by a long gap.
+        self.policy.record_batch(1, 100, 100.05)
+        self.assertEqual(self.policy.get_delay(101), 0.001)
+
+    def test_busy(self):
+        # Back-to-back batches of 100 messages, each taking 50ms.
+        now = 100
+        for _ in xrange(5):
+            self.policy.record_batch(100, now, now + 0.05)
+            now += 0.06
+        self.assertAlmostEqual(self.policy.get_delay(now - 0.005), 0.05)
+
+    def test_busy_clamped(self):
+        now = 100
+        for _ in xrange(5):
+            self.policy.record_batch(100, now, now + 1)
+            now += 1.01
+        self.assertEqual(self.policy.get_delay(now - 0.005), 0.1)
+
+    def test_trickle(self):
+        # Messages arriving much more slowly than we can process them.
+        now = 100
+        for _ in xrange(5):
+            self.policy.record_batch(1, now, now + 0.001)
+            now += 0.05
+        self.assertEqual(self.policy.get_delay(now - 0.005), 0.001)
+
 
 class TestExcpetionTracking(BaseTestCase):
     def test_exception(self):
@@ -236,11 +622,26 @@ class TestExcpetionTracking(BaseTestCase):
         self._m_exit.reset_mock()
 
     def test_no_exception(self):
+        num_refs = len(actor._refs)
         ar = actor.TrackedAsyncResult("foo")
         ar.set("foo")
+        # Results are only tracked once they fail.
+        self.assertEqual(len(actor._refs), num_refs)
         del ar  # Enough to trigger cleanup in CPython, with exact ref counts.
         self.assertFalse(self._m_exit.called)
 
+    def test_exception_retrieved(self):
+        num_refs = len(actor._refs)
+        a = ActorForTesting()
+        result = a.do_exc(async=True)
+        self.step_actor(a)
+        self.assertEqual(len(actor._refs), num_refs + 1)
+        self.assertRaises(ExpectedException, result.get)
+        del result
+        # The message must not keep the result alive.
+        self.assertEqual(len(actor._refs), num_refs)
+        self.assertFalse(self._m_exit.called)
+
 
 class ActorForTesting(actor.Actor):
     def __init__(self, qualifier=None):
@@ -252,6 +653,7 @@ class ActorForTesting(actor.Actor):
         self.unreferenced = False
         self.on_unref_result = mock.Mock(autospec=AsyncResult)
         self.started = False
+        self.forward_on_finish = None
 
     def start(self):
         self.started = True
@@ -282,6 +684,20 @@ class ActorForTesting(actor.Actor):
     def do_c2(self):
         return "c2"
 
+    @actor_message()
+    def do_forward(self, other_actor):
+        other_actor.do_a(oneway=True)
+
+    @actor_message(merge_key=lambda key, value: key)
+    def do_set(self, key, value):
+        self._batch_actions.append("set %s=%s" % (key, value))
+        return value
+
+    @actor_message(priority=actor.PRIORITY_HIGH)
+    def do_urgent(self, n):
+        self._batch_actions.append("urgent %s" % n)
+        return n
+
     @actor_message(needs_own_batch=True)
     def do_own_batch(self):
         self._batch_actions.append("own")
@@ -305,7 +721,11 @@ class ActorForTesting(actor.Actor):
         self.actions.extend(self._batch_actions)
         self.batches.append(list(self._batch_actions))
         self._batch_actions = []
+        if self.forward_on_finish is not None:
+            self.forward_on_finish.do_a(oneway=True)
         result = next(self._finish_side_effects)
+        if callable(result):
+            result = result(batch)
         if isinstance(result, Exception):
             raise result
 
@@ -101,6 +101,8 @@ class TestConfig(unittest.TestCase):
             self.assertEqual(config.HOSTNAME, host)
             self.assertEqual(config.IFACE_PREFIX, "blah")
             self.assertEqual(config.RESYNC_INT_SEC, 123)
+            self.assertEqual(config.SNAPSHOT_CACHE_PATH,
+                             "/var/lib/calico/felix_snapshot")
 
     def test_invalid_port(self):
 
@@ -136,6 +138,64 @@ class TestConfig(unittest.TestCase):
 
         self.assertEqual(config.LOGFILE, None)
 
+    @patch.dict("os.environ", {"FELIX_SNAPSHOTCACHEPATH": "None"})
+    def test_no_snapshot_cache(self):
+        config = Config("calico/felix/test/data/felix_missing.cfg")
+        self.assertEqual(config.SNAPSHOT_CACHE_PATH, None)
+
+    def test_batch_delays(self):
+        config = Config("calico/felix/test/data/felix_missing.cfg")
+        cfg_dict = { "InterfacePrefix": "blah",
+                     "MinBatchDelayMillis": "5",
+                     "MaxBatchDelayMillis": "250" }
+        config.update_config(cfg_dict)
+        self.assertEqual(config.MIN_BATCH_DELAY, 0.005)
+        self.assertEqual(config.MAX_BATCH_DELAY, 0.25)
+
+        config = Config("calico/felix/test/data/felix_missing.cfg")
+        cfg_dict = { "InterfacePrefix": "blah",
+                     "MinBatchDelayMillis": "200" }
+        with self.assertRaisesRegexp(ConfigException,
+                                     "Invalid MinBatchDelayMillis"):
+            config.update_config(cfg_dict)
+
+    def test_resync_interval(self):
+        config = Config("calico/felix/test/data/felix_missing.cfg")
+        config.update_config({ "InterfacePrefix": "blah",
+                               "ResyncIntervalSecs": "0" })
+        self.assertEqual(config.RESYNC_INT_SEC, 0)
+
+        config = Config("calico/felix/test/data/felix_missing.cfg")
+        cfg_dict = { "InterfacePrefix": "blah",
+                     "ResyncIntervalSecs": "-1" }
+        with self.assertRaisesRegexp(ConfigException,
+                                     "Invalid ResyncIntervalSecs"):
+            config.update_config(cfg_dict)
+
+        config = Config("calico/felix/test/data/felix_missing.cfg")
+        cfg_dict = { "InterfacePrefix": "blah",
+                     "ResyncIntervalSecs": "abc" }
+        with self.assertRaisesRegexp(ConfigException,
+                                     "Invalid ResyncIntervalSecs"):
+            config.update_config(cfg_dict)
+
+    def test_shard_ip_versions(self):
+        config = Config("calico/felix/test/data/felix_missing.cfg")
+        config.update_config({ "InterfacePrefix": "blah" })
+        self.assertFalse(config.SHARD_IP_VERSIONS)
+
+        config = Config("calico/felix/test/data/felix_missing.cfg")
+        config.update_config({ "InterfacePrefix": "blah",
+                               "ShardIpVersions": "True" })
+        self.assertTrue(config.SHARD_IP_VERSIONS)
+
+        config = Config("calico/felix/test/data/felix_missing.cfg")
+        cfg_dict = { "InterfacePrefix": "blah",
+                     "ShardIpVersions": "yes please" }
+        with self.assertRaisesRegexp(ConfigException,
+                                     "Invalid ShardIpVersions"):
+            config.update_config(cfg_dict)
+
     def xtest_no_metadata(self):
         # Metadata can be excluded by explicitly saying "none"
         host = socket.gethostname()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Copyright 2015 Metaswitch Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+felix.test.test_dispatch
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Tests for the DispatchChains actor.
+"""
+import logging
+
+import mock
+
+from calico.felix.dispatch import DispatchChains
+from calico.felix.endpoint import interface_to_suffix
+from calico.felix.fiptables import IptablesUpdater
+from calico.felix.frules import CHAIN_FROM_ENDPOINT, CHAIN_TO_ENDPOINT
+from calico.felix.test.base import BaseTestCase
+
+_log = logging.getLogger(__name__)
+
+
+class TestDispatchChains(BaseTestCase):
+    def setUp(self):
+        super(TestDispatchChains, self).setUp()
+        self.m_config = mock.Mock()
+        self.m_config.IFACE_PREFIX = "tap"
+        self.m_config.MIN_BATCH_DELAY = 0
+        self.m_config.MAX_BATCH_DELAY = 0
+        self.m_ipt = mock.Mock(spec=IptablesUpdater)
+        self.dispatch = DispatchChains(self.m_config, 4, self.m_ipt)
+
+    def add(self, iface_name):
+        suffix = interface_to_suffix(self.m_config, iface_name)
+        self.dispatch.on_endpoint_added(iface_name, suffix, async=True)
+
+    def test_removal_after_prefix_change(self):
+        self.add("tap1")
+        self.add("tap2")
+        self.step_actor(self.dispatch)
+        # The endpoints are removed after the config has changed, as they
+        # are when the EtcdWatcher sees the change.
+        self.m_config.IFACE_PREFIX = "veth"
+        self.dispatch.on_endpoint_removed("tap1", async=True)
+        self.step_actor(self.dispatch)
+        updates, deps = self.m_ipt.rewrite_chains.call_args[0]
+        # The remaining interface still jumps to its chains, with the names
+        # they were created with.
+        self.assertEqual(updates, {
+            CHAIN_FROM_ENDPOINT: [
+                "--append felix-FROM-ENDPOINT --in-interface tap2 "
+                "--goto felix-from-2",
+                "--append felix-FROM-ENDPOINT --jump DROP",
+            ],
+            CHAIN_TO_ENDPOINT: [
+                "--append felix-TO-ENDPOINT --out-interface tap2 "
+                "--goto felix-to-2",
+                "--append felix-TO-ENDPOINT --jump DROP",
+            ],
+        })
+        self.assertEqual(deps, {
+            CHAIN_FROM_ENDPOINT: set(["felix-from-2"]),
+            CHAIN_TO_ENDPOINT: set(["felix-to-2"]),
+        })
+
+    def test_snapshot(self):
+        self.dispatch.apply_snapshot({"tap1": "1"}, async=True)
+        self.step_actor(self.dispatch)
+        _, deps = self.m_ipt.rewrite_chains.call_args[0]
+        self.assertEqual(deps[CHAIN_TO_ENDPOINT], set(["felix-to-1"]))
+        # Re-adding the same mapping doesn't rewrite the chains.
+        self.dispatch.on_endpoint_added("tap1", "1", async=True)
+        self.step_actor(self.dispatch)
+        self.assertEqual(self.m_ipt.rewrite_chains.call_count, 1)
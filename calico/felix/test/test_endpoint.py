@@ -32,7 +32,7 @@ from mock import Mock, MagicMock, patch
 
 from calico.felix.actor import actor_message, ResultOrExc, SplitBatchAndRetry
 from calico.felix.test.base import BaseTestCase
-from calico.felix import endpoint
+from calico.felix import endpoint, futils
 from calico.felix import config
 
 _log = logging.getLogger(__name__)
@@ -50,3 +50,27 @@ class TestEndpointManager(BaseTestCase):
         self.m_rules_mgr = Mock(autospec=RulesManager)
         self.ep_mgr = EndpointManager(self.m_config, self.m_ipt_upds,
                                       self.m_disp_chns, self.m_rules_mgr)
+
+
+class TestLocalEndpoint(BaseTestCase):
+    def setUp(self):
+        super(TestLocalEndpoint, self).setUp()
+        self.m_config = Mock(spec=config.Config)
+        self.m_ipt_upd = Mock(spec=IptablesUpdater)
+        self.m_disp_chns = Mock(spec=DispatchChains)
+        self.m_rules_mgr = Mock(spec=RulesManager)
+        self.local_ep = endpoint.LocalEndpoint(self.m_config, "ep1",
+                                               futils.IPV4, self.m_ipt_upd,
+                                               self.m_disp_chns,
+                                               self.m_rules_mgr)
+
+    def test_kick_before_endpoint(self):
+        """
+        Tests an interface kick that overtakes the first endpoint update
+        is ignored.
+        """
+        with patch.object(self.local_ep, "_configure_interface",
+                          autospec=True) as m_conf:
+            self.local_ep.on_interface_update(async=True)
+            self.step_actor(self.local_ep)
+        self.assertFalse(m_conf.called)
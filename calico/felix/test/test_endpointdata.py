@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Copyright 2015 Metaswitch Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+felix.test.test_endpointdata
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Tests of the Endpoint record.
+"""
+import cPickle as pickle
+import logging
+
+from calico.felix.endpointdata import Endpoint
+from calico.felix.test.base import BaseTestCase
+
+_log = logging.getLogger(__name__)
+
+ENDPOINT_DICT = {
+    u"state": u"active",
+    u"name": u"tap1234",
+    u"mac": u"aa:bb:cc:dd:ee:ff",
+    u"profile_id": u"prof1",
+    u"ipv4_nets": [u"10.0.0.1/32"],
+    u"ipv6_nets": [u"dead::beef/128"],
+    u"ipv6_gateway": u"dead::1",
+}
+
+
+class TestEndpoint(BaseTestCase):
+    def test_from_dict(self):
+        ep = Endpoint.from_dict("ep1", u"host1", ENDPOINT_DICT)
+        self.assertEqual(ep.id, "ep1")
+        self.assertEqual(ep.host, "host1")
+        self.assertEqual(ep.profile_id, "prof1")
+        self.assertEqual(ep.name, "tap1234")
+        self.assertEqual(ep.mac, "aa:bb:cc:dd:ee:ff")
+        self.assertEqual(ep.state, "active")
+        self.assertEqual(ep.ipv6_gateway, "dead::1")
+        self.assertEqual(ep.ips(4), ("10.0.0.1",))
+        self.assertEqual(ep.ips(6), ("dead::beef",))
+        self.assertEqual(ep.nets(4), ("10.0.0.1/32",))
+        self.assertEqual(ep.nets(6), ("dead::beef/128",))
+
+    def test_from_dict_remote(self):
+        ep = Endpoint.from_dict("ep1", u"host1", ENDPOINT_DICT, local=False)
+        self.assertEqual(ep, Endpoint("ep1", "host1", "prof1",
+                                      ipv4_ips=("10.0.0.1",),
+                                      ipv6_ips=("dead::beef",)))
+        self.assertEqual(ep.nets(4), ())
+        self.assertEqual(ep.name, None)
+
+    def test_interned(self):
+        ep1 = Endpoint.from_dict("ep1", u"host1", ENDPOINT_DICT)
+        ep2 = Endpoint.from_dict("ep2", u"host1", dict(ENDPOINT_DICT))
+        self.assertTrue(ep1.profile_id is ep2.profile_id)
+        self.assertTrue(ep1.host is ep2.host)
+
+    def test_non_ascii_profile(self):
+        data = dict(ENDPOINT_DICT)
+        data["profile_id"] = u"profé"
+        ep = Endpoint.from_dict("ep1", u"host1", data)
+        self.assertEqual(ep.profile_id, u"profé")
+
+    def test_immutable(self):
+        ep = Endpoint("ep1", "host1", "prof1")
+        self.assertRaises(AttributeError, setattr, ep, "profile_id", "p2")
+        self.assertRaises(AttributeError, delattr, ep, "profile_id")
+        self.assertRaises(AttributeError, setattr, ep, "foo", "bar")
+
+    def test_equality(self):
+        ep1 = Endpoint.from_dict("ep1", "host1", ENDPOINT_DICT)
+        ep2 = Endpoint.from_dict("ep1", "host1", dict(ENDPOINT_DICT))
+        ep3 = Endpoint.from_dict("ep1", "host2", ENDPOINT_DICT)
+        self.assertEqual(ep1, ep2)
+        self.assertFalse(ep1 != ep2)
+        self.assertEqual(hash(ep1), hash(ep2))
+        self.assertNotEqual(ep1, ep3)
+        self.assertNotEqual(ep1, None)
+
+    def test_pickle(self):
+        ep = Endpoint.from_dict("ep1", "host1", ENDPOINT_DICT)
+        self.assertEqual(pickle.loads(pickle.dumps(ep, 2)), ep)
+        self.assertEqual(pickle.loads(pickle.dumps(ep)), ep)
@@ -52,6 +52,35 @@ class TestBasic(BaseTestCase):
         m_config.HOSTNAME = "myhost"
         m_config.IFACE_PREFIX = "tap"
         m_config.METADATA_IP = None
+        m_config.MIN_BATCH_DELAY = 0.0
+        m_config.MAX_BATCH_DELAY = 0.1
+        m_config.SHARD_IP_VERSIONS = False
         self.assertRaises(TestException,
                           felix._main_greenlet, m_config)
         m_load.assert_called_once_with(async=False)
+
+    @mock.patch("calico.felix.fetcd.EtcdWatcher.load_config")
+    @mock.patch("gevent.Greenlet.start", autospec=True)
+    @mock.patch("calico.felix.felix.IptablesUpdater", autospec=True)
+    @mock.patch("calico.felix.felix.start_worker", autospec=True)
+    @mock.patch("calico.felix.felix.install_global_rules", autospec=True)
+    @mock.patch("gevent.iwait", autospec=True, side_effect=TestException())
+    def test_main_greenlet_sharded(self, m_iwait, m_install, m_start_worker,
+                                   m_IptablesUpdater, m_start, m_load):
+        m_IptablesUpdater.return_value.greenlet = mock.Mock()
+        m_start_worker.return_value = (1234, mock.Mock())
+        m_config = mock.Mock(spec=config.Config)
+        m_config.HOSTNAME = "myhost"
+        m_config.IFACE_PREFIX = "tap"
+        m_config.METADATA_IP = None
+        m_config.MIN_BATCH_DELAY = 0.0
+        m_config.MAX_BATCH_DELAY = 0.1
+        m_config.SHARD_IP_VERSIONS = True
+        self.assertRaises(TestException,
+                          felix._main_greenlet, m_config)
+        self.assertEqual(m_start_worker.call_count, 1)
+        # Only the IPv4 iptables updaters are created in this process.
+        self.assertEqual([c[1]["ip_version"] for c in
+                          m_IptablesUpdater.call_args_list], [4, 4])
+        m_install.assert_called_once_with(m_config, mock.ANY, None,
+                                          mock.ANY)
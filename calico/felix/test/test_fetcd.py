@@ -0,0 +1,681 @@
+# -*- coding: utf-8 -*-
+# Copyright 2015 Metaswitch Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+felix.test.test_fetcd
+~~~~~~~~~~~~~~~~~~~~~
+
+Tests for the etcd polling code.
+"""
+import json
+import logging
+
+import gevent
+import mock
+
+from calico.datamodel_v1 import (READY_KEY, POLICY_DIR, HOST_DIR,
+                                 CONFIG_DIR, key_for_endpoint, key_for_profile,
+                                 key_for_profile_rules,
+                                 key_for_profile_tags, dir_for_host)
+from calico.felix import fetcd
+from calico.felix.config import Config
+from calico.felix.endpointdata import Endpoint
+from calico.felix.test.base import BaseTestCase
+
+_log = logging.getLogger(__name__)
+
+ENDPOINT = {
+    "state": "active",
+    "name": "tap1234",
+    "mac": "aa:bb:cc:dd:ee:ff",
+    "profile_id": "prof1",
+    "ipv4_nets": ["10.0.0.1/32"],
+    "ipv6_nets": [],
+}
+
+RULES = {
+    "inbound_rules": [],
+    "outbound_rules": [],
+}
+
+
+def node(key, value=None, is_dir=False, modified_index=10,
+         action="get"):
+    return mock.Mock(key=key, value=value, dir=is_dir, action=action,
+                     modifiedIndex=modified_index)
+
+
+class TestLoadSnapshot(BaseTestCase):
+    def setUp(self):
+        super(TestLoadSnapshot, self).setUp()
+        self.m_config = mock.Mock()
+        self.m_config.HOSTNAME = "hostname"
+        self.m_config.IFACE_PREFIX = "tap"
+        self.m_config.SNAPSHOT_CACHE_PATH = None
+        self.watcher = fetcd.EtcdWatcher(self.m_config)
+        self.watcher.client = mock.Mock()
+        self.watcher.client.read.side_effect = self.read
+        self.tree = {
+            READY_KEY: mock.Mock(value="true", etcd_index=1000),
+            POLICY_DIR: mock.Mock(children=[
+                node(key_for_profile_rules("prof1"), json.dumps(RULES)),
+                node(key_for_profile_tags("prof1"), '["tag1"]'),
+            ]),
+            HOST_DIR: mock.Mock(children=[
+                node(dir_for_host("host2"), is_dir=True),
+                node(dir_for_host("hostname"), is_dir=True),
+                node(dir_for_host("gone"), is_dir=True),
+            ]),
+            dir_for_host("hostname"): mock.Mock(children=[
+                node(key_for_endpoint("hostname", "orch", "wl1", "ep1"),
+                     json.dumps(ENDPOINT)),
+                node(dir_for_host("hostname") + "/config/foo", "bar"),
+            ]),
+            dir_for_host("host2"): mock.Mock(children=[
+                node(key_for_endpoint("host2", "orch", "wl2", "ep2"),
+                     json.dumps(ENDPOINT)),
+                node(key_for_endpoint("host2", "orch", "wl2", "bad"),
+                     '{"state": "active"}'),
+            ]),
+        }
+        self.reads = []
+
+    def read(self, key, recursive=False):
+        self.reads.append((key, recursive))
+        try:
+            return self.tree[key]
+        except KeyError:
+            raise fetcd.EtcdKeyNotFound()
+
+    def test_load_snapshot(self):
+        rules_by_id, tags_by_id, endpoints_by_id, index = \
+            self.watcher._load_snapshot()
+        self.assertEqual(index, 1000)
+        self.assertEqual(rules_by_id.keys(), ["prof1"])
+        self.assertEqual(tags_by_id, {"prof1": ["tag1"]})
+        self.assertEqual(sorted(endpoints_by_id.keys()), ["ep1", "ep2"])
+        # Local endpoints are complete.
+        self.assertEqual(endpoints_by_id["ep1"],
+                         Endpoint("ep1", "hostname", "prof1",
+                                  ipv4_ips=("10.0.0.1",),
+                                  ipv4_nets=("10.0.0.1/32",),
+                                  name="tap1234",
+                                  mac="aa:bb:cc:dd:ee:ff",
+                                  state="active"))
+        # Remote endpoints only have what we need for the ipsets.
+        self.assertEqual(endpoints_by_id["ep2"],
+                         Endpoint("ep2", "host2", "prof1",
+                                  ipv4_ips=("10.0.0.1",)))
+        # Endpoints are read one host at a time, our own host first.
+        self.assertEqual(self.reads, [
+            (READY_KEY, False),
+            (POLICY_DIR, True),
+            (HOST_DIR, False),
+            (dir_for_host("hostname"), True),
+            (dir_for_host("host2"), True),
+            (dir_for_host("gone"), True),
+        ])
+
+    def test_load_snapshot_empty(self):
+        del self.tree[POLICY_DIR]
+        del self.tree[dir_for_host("hostname")]
+        # A read of an empty directory returns the directory itself.
+        self.tree[HOST_DIR] = mock.Mock(children=[node(HOST_DIR,
+                                                       is_dir=True)])
+        self.assertEqual(self.watcher._load_snapshot(),
+                         ({}, {}, {}, 1000))
+
+    def test_load_snapshot_not_ready(self):
+        self.tree[READY_KEY].value = "false"
+        self.assertEqual(self.watcher._load_snapshot(), None)
+
+    def test_resync_uses_cache(self):
+        first = self.watcher._load_snapshot()
+        with mock.patch("calico.felix.fetcd.decode_json",
+                        autospec=True) as m_decode:
+            second = self.watcher._load_snapshot()
+        # Nothing changed so nothing was decoded and the same (immutable)
+        # values are returned.
+        self.assertFalse(m_decode.called)
+        self.assertEqual(second, first)
+        self.assertTrue(second[2]["ep1"] is first[2]["ep1"])
+
+    def test_resync_reparses_modified_keys(self):
+        self.watcher._load_snapshot()
+        ep_key = key_for_endpoint("hostname", "orch", "wl1", "ep1")
+        updated = dict(ENDPOINT, profile_id="prof2")
+        self.tree[dir_for_host("hostname")].children = [
+            node(ep_key, json.dumps(updated), modified_index=11),
+        ]
+        _, _, endpoints_by_id, _ = self.watcher._load_snapshot()
+        self.assertEqual(endpoints_by_id["ep1"].profile_id, "prof2")
+        self.assertEqual(self.watcher._parse_cache[ep_key][0], 11)
+
+    def test_resync_after_silent_cluster_change(self):
+        self.watcher.client.expected_cluster_id = "cluster1"
+        self.watcher._load_snapshot()
+        old_cache = self.watcher._parse_cache
+        # Reconnected to a new cluster without seeing EtcdClusterIdChanged.
+        # The new value happens to have the same modifiedIndex.
+        self.watcher.client.expected_cluster_id = "cluster2"
+        self.tree[POLICY_DIR].children[1] = node(key_for_profile_tags("prof1"),
+                                                 '["tag2"]')
+        self.watcher._load_snapshot()
+        m_splitter = mock.Mock()
+        self.watcher._apply_snapshot_delta(old_cache, m_splitter)
+        m_splitter.on_tags_update.assert_called_once_with("prof1", ["tag2"],
+                                                          oneway=True)
+        self.assertFalse(m_splitter.on_rules_update.called)
+        self.assertEqual(self.watcher._cache_cluster_id, "cluster2")
+
+    def test_resync_prunes_cache(self):
+        self.watcher._load_snapshot()
+        del self.tree[POLICY_DIR]
+        self.watcher._load_snapshot()
+        self.assertFalse(key_for_profile_rules("prof1") in
+                         self.watcher._parse_cache)
+        self.assertTrue(key_for_endpoint("hostname", "orch", "wl1", "ep1")
+                        in self.watcher._parse_cache)
+
+    def test_event_updates_cache(self):
+        m_splitter = mock.Mock()
+        key = key_for_profile_tags("prof1")
+        self.watcher._on_etcd_event(node(key, '["a"]', modified_index=20,
+                                         action="set"),
+                                    m_splitter)
+        m_splitter.on_tags_update.assert_called_once_with("prof1", ["a"],
+                                                          oneway=True)
+        self.assertEqual(self.watcher._parse_cache[key],
+                         (20, (fetcd.TAGS, "prof1", ["a"])))
+        self.watcher._on_etcd_event(node(key, modified_index=21,
+                                         action="delete"),
+                                    m_splitter)
+        self.assertFalse(key in self.watcher._parse_cache)
+
+    def test_profile_delete_updates_cache(self):
+        self.watcher._load_snapshot()
+        m_splitter = mock.Mock()
+        response = node(key_for_profile("prof1"), action="delete",
+                        is_dir=True)
+        self.assertTrue(self.watcher._on_etcd_event(response, m_splitter))
+        self.assertFalse(key_for_profile_rules("prof1") in
+                         self.watcher._parse_cache)
+        self.assertFalse(key_for_profile_tags("prof1") in
+                         self.watcher._parse_cache)
+
+    def test_resync_sends_delta(self):
+        self.watcher._load_snapshot()
+        old_cache = self.watcher._parse_cache
+        ep_key = key_for_endpoint("hostname", "orch", "wl1", "ep1")
+        self.tree[dir_for_host("hostname")].children = [
+            # Rewritten but unchanged.
+            node(ep_key, json.dumps(ENDPOINT), modified_index=11),
+            node(key_for_endpoint("hostname", "orch", "wl3", "ep3"),
+                 json.dumps(ENDPOINT), modified_index=12),
+        ]
+        self.tree[POLICY_DIR].children = [
+            node(key_for_profile_tags("prof1"), '["tag2"]', modified_index=13)
+        ]
+        self.watcher._load_snapshot()
+        m_splitter = mock.Mock()
+        self.watcher._apply_snapshot_delta(old_cache, m_splitter)
+        m_splitter.on_rules_update.assert_called_once_with("prof1", None,
+                                                           oneway=True)
+        m_splitter.on_tags_update.assert_called_once_with("prof1", ["tag2"],
+                                                          oneway=True)
+        m_splitter.on_endpoint_update.assert_called_once_with(
+            "ep3", self.watcher._parse_cache[key_for_endpoint(
+                "hostname", "orch", "wl3", "ep3")][1][2],
+            oneway=True
+        )
+        self.assertFalse(m_splitter.apply_snapshot.called)
+
+    def test_resync_after_cluster_change_compares_values(self):
+        self.watcher._load_snapshot()
+        self.watcher._forget_cached_indexes()
+        old_cache = self.watcher._parse_cache
+        # Same indexes, but the new cluster has a different value.
+        self.tree[POLICY_DIR].children[1] = node(key_for_profile_tags("prof1"),
+                                                 '["tag2"]')
+        self.watcher._load_snapshot()
+        m_splitter = mock.Mock()
+        self.watcher._apply_snapshot_delta(old_cache, m_splitter)
+        m_splitter.on_tags_update.assert_called_once_with("prof1", ["tag2"],
+                                                          oneway=True)
+        self.assertFalse(m_splitter.on_rules_update.called)
+        self.assertFalse(m_splitter.on_endpoint_update.called)
+
+
+class TestPolling(BaseTestCase):
+    def setUp(self):
+        super(TestPolling, self).setUp()
+        self.m_config = mock.Mock()
+        self.m_config.HOSTNAME = "hostname"
+        self.m_config.IFACE_PREFIX = "tap"
+        self.m_config.SNAPSHOT_CACHE_PATH = None
+        self.m_config.RESYNC_INT_SEC = 0
+        self.watcher = fetcd.EtcdWatcher(self.m_config)
+        self.watcher.client = mock.Mock()
+        self.m_splitter = mock.Mock()
+        self.tags_key = key_for_profile_tags("prof1")
+        self.responses = [
+            node(self.tags_key, '["a"]', modified_index=11, action="set"),
+            node(self.tags_key, '["b"]', modified_index=12, action="set"),
+        ]
+
+    def test_poll_for_updates(self):
+        self.watcher.client.read.side_effect = self.responses + [
+            fetcd.ReadTimeoutError(None, None, "timeout"),
+            fetcd.EtcdEventIndexCleared(),
+        ]
+        with mock.patch.object(self.watcher, "_reconnect") as m_reconnect:
+            with mock.patch("calico.felix.fetcd.RECONNECT_AFTER_TIMEOUT",
+                            False):
+                self.watcher._poll_for_updates(10, self.m_splitter)
+        # The client is kept across the timeout.
+        self.assertFalse(m_reconnect.called)
+        # Polls don't wait for the events to be processed and each one
+        # follows on from the previous response.
+        self.assertEqual(
+            [c[1]["waitIndex"] for c in
+             self.watcher.client.read.call_args_list],
+            [11, 12, 13, 13]
+        )
+        self.assertEqual(self.m_splitter.on_tags_update.mock_calls, [
+            mock.call("prof1", ["a"], oneway=True),
+            mock.call("prof1", ["b"], oneway=True),
+        ])
+
+    @mock.patch("gevent.sleep", autospec=True)
+    def test_poll_backoff(self, m_sleep):
+        self.watcher.client.read.side_effect = [
+            fetcd.urllib3.exceptions.HTTPError(),
+            fetcd.urllib3.exceptions.HTTPError(),
+            self.responses[0],
+            fetcd.urllib3.exceptions.HTTPError(),
+            fetcd.EtcdEventIndexCleared(),
+        ]
+        counters = self.watcher._stats.counters
+        num_errors = counters["etcd HTTP errors"]
+        with mock.patch.object(self.watcher, "_reconnect") as m_reconnect:
+            with mock.patch("random.uniform", autospec=True,
+                            side_effect=lambda low, high: high):
+                self.watcher._poll_for_updates(10, self.m_splitter)
+        self.assertEqual(m_reconnect.call_count, 3)
+        # The backoff is reset by the successful read.
+        self.assertEqual(m_sleep.mock_calls,
+                         [mock.call(1), mock.call(2), mock.call(1)])
+        # Stats are shared between watchers, so check the increase.
+        self.assertEqual(counters["etcd HTTP errors"], num_errors + 3)
+
+    @mock.patch("time.time", autospec=True)
+    def test_periodic_resync_time(self, m_time):
+        m_time.return_value = 1000
+        self.m_config.RESYNC_INT_SEC = 100
+        with mock.patch("random.uniform", autospec=True,
+                        side_effect=lambda low, high: low) as m_uniform:
+            self.assertEqual(self.watcher._next_periodic_resync_time(), 1075)
+        m_uniform.assert_called_once_with(0.75, 1.25)
+        self.assertEqual(fetcd._time_until(1075), 75)
+        self.assertEqual(fetcd._time_until(900), 0)
+
+    @mock.patch("calico.felix.fetcd._time_until")
+    def test_periodic_resync(self, m_time_until):
+        self.m_config.RESYNC_INT_SEC = 100
+        # The deadline passes after the first batch.
+        m_time_until.side_effect = [100, 0]
+
+        def read(*args, **kwargs):
+            if self.watcher.client.read.call_count == 1:
+                return self.responses[0]
+            # No more events; only the periodic resync stops the polling.
+            gevent.sleep(10)
+
+        self.watcher.client.read.side_effect = read
+        counters = self.watcher._stats.counters
+        num_resyncs = counters["periodic resyncs"]
+        self.watcher._poll_for_updates(10, self.m_splitter)
+        self.m_splitter.on_tags_update.assert_called_once_with(
+            "prof1", ["a"], oneway=True)
+        self.assertEqual(counters["periodic resyncs"], num_resyncs + 1)
+
+    @mock.patch("calico.felix.fetcd._time_until")
+    def test_periodic_resync_after_cluster_change(self, m_time_until):
+        self.m_config.RESYNC_INT_SEC = 100
+        m_time_until.side_effect = [100, 0]
+        self.watcher.client.read.side_effect = [
+            self.responses[0],
+            fetcd.EtcdClusterIdChanged(),
+        ]
+        self.watcher._poll_for_updates(10, self.m_splitter)
+        # The cluster change isn't lost to the periodic resync.
+        self.assertEqual(self.watcher._parse_cache[self.tags_key][0], None)
+
+    @mock.patch("calico.felix.fetcd._time_until")
+    def test_periodic_resync_after_exception(self, m_time_until):
+        self.m_config.RESYNC_INT_SEC = 100
+        m_time_until.side_effect = [100, 0]
+        self.watcher.client.read.side_effect = [
+            self.responses[0],
+            RuntimeError(),
+        ]
+        self.assertRaises(RuntimeError, self.watcher._poll_for_updates, 10,
+                          self.m_splitter)
+
+    def test_periodic_resync_disabled(self):
+        self.assertEqual(self.watcher._next_periodic_resync_time(), None)
+        self.assertEqual(fetcd._time_until(None), None)
+
+    @mock.patch("calico.felix.fetcd.urllib3")
+    def test_reconnect_after_timeout(self, m_urllib3):
+        m_urllib3.__version__ = "1.7.1"
+        self.assertTrue(fetcd._urllib3_reuses_timed_out_connections())
+        m_urllib3.__version__ = "1.10.2"
+        self.assertFalse(fetcd._urllib3_reuses_timed_out_connections())
+        m_urllib3.__version__ = "dev"
+        self.assertTrue(fetcd._urllib3_reuses_timed_out_connections())
+
+    def test_batch_then_resync(self):
+        self.assertFalse(self.watcher._on_etcd_events(
+            self.responses + [fetcd._RESYNC], self.m_splitter
+        ))
+        # Events before the resync are still processed.
+        self.assertEqual(self.m_splitter.on_tags_update.call_count, 2)
+        self.assertEqual(self.watcher._parse_cache[self.tags_key][0], 12)
+
+    def test_batch_then_cluster_changed(self):
+        self.assertFalse(self.watcher._on_etcd_events(
+            self.responses + [fetcd._CLUSTER_CHANGED], self.m_splitter
+        ))
+        self.assertEqual(self.watcher._parse_cache[self.tags_key][0], None)
+
+    def test_batch_then_exception(self):
+        self.assertRaises(RuntimeError, self.watcher._on_etcd_events,
+                          self.responses + [RuntimeError()], self.m_splitter)
+
+    def test_batch_stops_at_unexpected_event(self):
+        responses = [node(READY_KEY, "false", action="set")] + self.responses
+        self.assertFalse(self.watcher._on_etcd_events(responses,
+                                                      self.m_splitter))
+        self.assertFalse(self.m_splitter.on_tags_update.called)
+
+
+class TestSnapshotCache(BaseTestCase):
+    def setUp(self):
+        super(TestSnapshotCache, self).setUp()
+        self.m_config = mock.Mock()
+        self.m_config.HOSTNAME = "hostname"
+        self.m_config.IFACE_PREFIX = "tap"
+        self.m_config.SNAPSHOT_CACHE_PATH = "/path/to/snapshot"
+        self.watcher = fetcd.EtcdWatcher(self.m_config)
+        self.watcher.client = mock.Mock()
+        self.watcher.client.expected_cluster_id = "cluster"
+        self.m_splitter = mock.Mock()
+        self.endpoint = Endpoint("ep1", "hostname", "prof1")
+        self.header = {
+            "etcd_index": 20,
+            "cluster_id": "cluster",
+            "hostname": "hostname",
+            "iface_prefix": "tap",
+        }
+        self.parse_cache = {
+            key_for_profile_rules("prof1"):
+                (10, (fetcd.RULES, "prof1", RULES)),
+            key_for_profile_tags("prof1"):
+                (11, (fetcd.TAGS, "prof1", ["a"])),
+            key_for_endpoint("hostname", "orch", "wl1", "ep1"):
+                (12, (fetcd.ENDPOINT, "ep1", self.endpoint)),
+            key_for_endpoint("hostname", "orch", "wl1", "bad"):
+                (13, (fetcd.ENDPOINT, "bad", None)),
+        }
+
+    @mock.patch("calico.felix.snapshotcache.load", autospec=True)
+    def test_apply_cached_snapshot(self, m_load):
+        m_load.return_value = (self.header, self.parse_cache)
+        self.assertEqual(
+            self.watcher._apply_cached_snapshot(self.m_splitter),
+            self.header
+        )
+        m_load.assert_called_once_with("/path/to/snapshot")
+        self.m_splitter.apply_snapshot.assert_called_once_with(
+            {"prof1": RULES}, {"prof1": ["a"]}, {"ep1": self.endpoint},
+            async=False
+        )
+        self.assertTrue(self.watcher._parse_cache is self.parse_cache)
+        self.assertEqual(self.watcher._cache_cluster_id, "cluster")
+        # Nothing has changed so there's nothing to save.
+        with mock.patch("calico.felix.snapshotcache.save",
+                        autospec=True) as m_save:
+            self.watcher._maybe_save_snapshot_cache()
+        self.assertFalse(m_save.called)
+
+    @mock.patch("calico.felix.snapshotcache.load", autospec=True)
+    def test_cached_snapshot_other_config(self, m_load):
+        self.header["iface_prefix"] = "veth"
+        m_load.return_value = (self.header, self.parse_cache)
+        self.assertEqual(
+            self.watcher._apply_cached_snapshot(self.m_splitter), None
+        )
+        self.assertFalse(self.m_splitter.apply_snapshot.called)
+
+    @mock.patch("calico.felix.snapshotcache.load", autospec=True)
+    def test_no_cached_snapshot(self, m_load):
+        m_load.return_value = None
+        self.assertEqual(
+            self.watcher._apply_cached_snapshot(self.m_splitter), None
+        )
+        self.m_config.SNAPSHOT_CACHE_PATH = None
+        self.assertEqual(
+            self.watcher._apply_cached_snapshot(self.m_splitter), None
+        )
+        self.assertEqual(m_load.call_count, 1)
+
+    @mock.patch("time.time", autospec=True)
+    @mock.patch("calico.felix.snapshotcache.save", autospec=True)
+    def test_save_rate_limited(self, m_save, m_time):
+        m_time.return_value = 1000
+        self.watcher._parse_cache = self.parse_cache
+        self.watcher._cache_cluster_id = "cluster"
+        self.watcher._applied_index = 20
+        self.watcher._maybe_save_snapshot_cache()
+        m_save.assert_called_once_with("/path/to/snapshot", self.header,
+                                       self.parse_cache)
+        self.watcher._applied_index = 21
+        m_time.return_value = 1000 + fetcd.SNAPSHOT_SAVE_INTERVAL - 1
+        self.watcher._maybe_save_snapshot_cache()
+        self.assertEqual(m_save.call_count, 1)
+        m_time.return_value = 1000 + fetcd.SNAPSHOT_SAVE_INTERVAL
+        self.watcher._maybe_save_snapshot_cache()
+        self.assertEqual(m_save.call_count, 2)
+
+    @mock.patch("calico.felix.snapshotcache.save", autospec=True)
+    def test_save_failure(self, m_save):
+        m_save.side_effect = IOError()
+        self.watcher._applied_index = 20
+        self.watcher._maybe_save_snapshot_cache()
+        self.assertEqual(self.watcher._saved_index, None)
+
+
+class TestConfigReload(BaseTestCase):
+    def setUp(self):
+        super(TestConfigReload, self).setUp()
+        self.config = Config("calico/felix/test/data/felix_empty.cfg")
+        self.config.HOSTNAME = "hostname"
+        self.config.SNAPSHOT_CACHE_PATH = None
+        self.config_dict = {"InterfacePrefix": "tap"}
+        self.config.update_config(dict(self.config_dict))
+        self.watcher = fetcd.EtcdWatcher(self.config)
+        self.watcher._load_config_dict = mock.Mock(
+            side_effect=lambda: dict(self.config_dict)
+        )
+        self.m_splitter = mock.Mock()
+        self.local_ep = Endpoint("ep1", "hostname", "prof1")
+        self.remote_ep = Endpoint("ep2", "host2", "prof1")
+        self.local_key = key_for_endpoint("hostname", "orch", "wl1", "ep1")
+        self.remote_key = key_for_endpoint("host2", "orch", "wl2", "ep2")
+        self.watcher._parse_cache = {
+            self.local_key: (10, (fetcd.ENDPOINT, "ep1", self.local_ep)),
+            self.remote_key: (11, (fetcd.ENDPOINT, "ep2", self.remote_ep)),
+        }
+
+    def on_config_event(self, key, value):
+        return self.watcher._on_etcd_event(
+            node(CONFIG_DIR + "/" + key, value, action="set"),
+            self.m_splitter
+        )
+
+    def test_log_level_change(self):
+        self.config_dict["LogSeverityScreen"] = "debug"
+        self.assertTrue(self.on_config_event("LogSeverityScreen", "debug"))
+        self.assertEqual(self.config.LOGLEVSCR, logging.DEBUG)
+        self.m_splitter.on_config_update.assert_called_once_with(
+            {"LOGLEVSCR": logging.DEBUG}, oneway=True)
+        self.assertFalse(self.m_splitter.on_endpoint_update.called)
+
+    def test_per_host_config_change(self):
+        self.config_dict["MetadataPort"] = "9697"
+        self.assertTrue(self.watcher._on_etcd_event(
+            node(self.watcher.my_config_dir + "/MetadataPort", "9697",
+                 action="set"),
+            self.m_splitter
+        ))
+        self.assertEqual(self.config.METADATA_PORT, "9697")
+        self.m_splitter.on_config_update.assert_called_once_with(
+            {"METADATA_PORT": "9697"}, oneway=True)
+
+    def test_no_change(self):
+        self.assertTrue(self.on_config_event("Unrelated", "foo"))
+        self.assertFalse(self.m_splitter.on_config_update.called)
+
+    def test_restart_required(self):
+        self.config_dict["MaxBatchDelayMillis"] = "200"
+        self.assertTrue(self.on_config_event("MaxBatchDelayMillis", "200"))
+        self.assertEqual(self.config.MAX_BATCH_DELAY, 0.1)
+        self.assertFalse(self.m_splitter.on_config_update.called)
+
+    def test_invalid_config_ignored(self):
+        self.config_dict["MetadataPort"] = "bad"
+        self.config_dict["LogSeverityScreen"] = "debug"
+        self.assertTrue(self.on_config_event("MetadataPort", "bad"))
+        self.assertEqual(self.config.METADATA_PORT, "8775")
+        self.assertEqual(self.config.LOGLEVSCR, logging.ERROR)
+        self.assertFalse(self.m_splitter.on_config_update.called)
+
+    def test_non_integer_config_ignored(self):
+        self.config_dict["ResyncIntervalSecs"] = "abc"
+        self.assertTrue(self.on_config_event("ResyncIntervalSecs", "abc"))
+        self.assertEqual(self.config.RESYNC_INT_SEC, 1800)
+        self.assertFalse(self.m_splitter.on_config_update.called)
+
+    def test_read_failure_triggers_resync(self):
+        self.watcher._load_config_dict.side_effect = fetcd.EtcdException()
+        self.assertFalse(self.on_config_event("LogSeverityScreen", "debug"))
+        self.assertFalse(self.m_splitter.on_config_update.called)
+
+    def test_iface_prefix_change(self):
+        self.config_dict["InterfacePrefix"] = "veth"
+        self.assertFalse(self.on_config_event("InterfacePrefix", "veth"))
+        self.assertEqual(self.config.IFACE_PREFIX, "veth")
+        # The local endpoint is removed before the config changes and left
+        # out of the cache so that the resync sends it again.
+        self.assertEqual(self.m_splitter.mock_calls, [
+            mock.call.on_endpoint_update("ep1", None, oneway=True),
+            mock.call.on_config_update({"IFACE_PREFIX": "veth"},
+                                       oneway=True),
+        ])
+        self.assertEqual(self.watcher._parse_cache, {
+            self.remote_key: (None, (fetcd.ENDPOINT, "ep2", self.remote_ep)),
+        })
+
+    def test_resync_reloads_config(self):
+        self.watcher._snapshot_applied = True
+        self.watcher._load_snapshot = mock.Mock(return_value=None)
+        self.config_dict["LogSeverityScreen"] = "debug"
+        self.assertEqual(self.watcher._resync(self.m_splitter), None)
+        self.m_splitter.on_config_update.assert_called_once_with(
+            {"LOGLEVSCR": logging.DEBUG}, oneway=True)
+
+
+class TestDecodeJson(BaseTestCase):
+    def test_decode_json_interned(self):
+        key = "".join(["in", "bound_rules"])
+        rules = fetcd.decode_json_interned(
+            '{"%s": [{"%s": 1}], "outbound_rules": []}' % (key, key)
+        )
+        self.assertEqual(rules, {key: [{key: 1}], "outbound_rules": []})
+        interned = intern(key)
+        self.assertTrue([k for k in rules if k == key][0] is interned)
+        self.assertTrue(rules[key][0].keys()[0] is interned)
+
+    def test_decode_json_interned_non_ascii(self):
+        # Non-ASCII keys can't be interned so they're left as they are.
+        self.assertEqual(fetcd.decode_json_interned('{"caf\\u00e9": [1]}'),
+                         {u"caf\u00e9": [1]})
+
+    def test_rules_with_non_ascii_key(self):
+        node = mock.Mock(key=key_for_profile_rules("prof1"),
+                         value='{"inbound_rules": [{"caf\\u00e9": 1}], '
+                               '"outbound_rules": []}',
+                         action="set")
+        # The key is kept as it is, rather than failing to decode.
+        self.assertEqual(fetcd.parse_if_rules(node),
+                         ("prof1", {"id": "prof1",
+                                    "inbound_rules": [{u"caf\u00e9": 1}],
+                                    "outbound_rules": []}))
+
+    def test_fallback_to_json(self):
+        with mock.patch("calico.felix.fetcd.FAST_JSON_MODULES",
+                        ["calico_no_such_module"]):
+            self.assertTrue(fetcd._load_json_decoder() is json.loads)
+
+
+class TestValidationCache(BaseTestCase):
+    def setUp(self):
+        super(TestValidationCache, self).setUp()
+        self.m_config = mock.Mock()
+        self.m_config.HOSTNAME = "hostname"
+        self.m_config.IFACE_PREFIX = "tap"
+        fetcd._endpoint_validation_cache.clear()
+        fetcd._rules_validation_cache.clear()
+
+    def test_endpoint_validated_once(self):
+        key = key_for_endpoint("hostname", "orch", "wl1", "ep1")
+        with mock.patch("calico.felix.fetcd.validate_endpoint",
+                        wraps=fetcd.validate_endpoint) as m_validate:
+            # Rewriting the same value under a new index doesn't revalidate.
+            for index in (1, 2):
+                _, endpoint = fetcd.parse_if_endpoint(
+                    self.m_config,
+                    node(key, json.dumps(ENDPOINT), modified_index=index)
+                )
+                self.assertEqual(endpoint.name, "tap1234")
+            self.assertEqual(m_validate.call_count, 1)
+            # But the outcome depends on the interface prefix.
+            self.m_config.IFACE_PREFIX = "veth"
+            _, endpoint = fetcd.parse_if_endpoint(
+                self.m_config, node(key, json.dumps(ENDPOINT))
+            )
+            self.assertEqual(endpoint, None)
+            self.assertEqual(m_validate.call_count, 2)
+
+    def test_invalid_rules_cached(self):
+        key = key_for_profile_rules("prof1")
+        with mock.patch("calico.felix.fetcd.validate_rules",
+                        wraps=fetcd.validate_rules) as m_validate:
+            for _ in xrange(2):
+                self.assertEqual(
+                    fetcd.parse_if_rules(node(key, '{"inbound_rules": []}')),
+                    ("prof1", None)
+                )
+            self.assertEqual(m_validate.call_count, 1)
@@ -20,8 +20,14 @@ Tests of iptables handling function.
 """
 
 import logging
+from subprocess import CalledProcessError
+
+import mock
+
 from calico.felix import fiptables
+from calico.felix.config import Config
 from calico.felix.test.base import BaseTestCase
+from calico.felix.test.stub_utils import FakeRestore
 
 _log = logging.getLogger(__name__)
 
@@ -62,4 +68,77 @@ class TestIptablesUpdater(BaseTestCase):
         for inp, exp in EXTRACT_UNREF_TESTS:
             output = fiptables.extract_unreffed_chains(inp)
             self.assertEqual(exp, output, "Expected\n\n%s\n\nTo parse as: %s\n"
-                                          "but got: %s" % (inp, exp, output))
\ No newline at end of file
+                                          "but got: %s" % (inp, exp, output))
+
+    def test_stats_per_table(self):
+        m_config = mock.Mock(spec=Config)
+        m_config.MIN_BATCH_DELAY = 0
+        m_config.MAX_BATCH_DELAY = 0
+        filter_updater = fiptables.IptablesUpdater("filter", m_config)
+        nat_updater = fiptables.IptablesUpdater("nat", m_config)
+        self.assertEqual(filter_updater.name, "IptablesUpdater(filter-v4)")
+        self.assertEqual(nat_updater.name, "IptablesUpdater(nat-v4)")
+        self.assertFalse(filter_updater._stats is nat_updater._stats)
+
+
+class TestIptablesUpdaterBatches(BaseTestCase):
+    def setUp(self):
+        super(TestIptablesUpdaterBatches, self).setUp()
+        m_config = mock.Mock(spec=Config)
+        m_config.MIN_BATCH_DELAY = 0
+        m_config.MAX_BATCH_DELAY = 0
+        self.ipt = fiptables.IptablesUpdater("filter", m_config)
+        self.restore = FakeRestore()
+        self._restore_patch = mock.patch.object(self.ipt,
+                                                "_execute_iptables",
+                                                side_effect=self.restore)
+        self._restore_patch.start()
+
+    def tearDown(self):
+        self._restore_patch.stop()
+        super(TestIptablesUpdaterBatches, self).tearDown()
+
+    def send_rewrites(self, num_msgs, bad_indexes):
+        results = []
+        for ii in xrange(num_msgs):
+            rule = "-A chain-%s -j %s" % (ii, "BAD" if ii in bad_indexes
+                                               else "ACCEPT")
+            results.append(self.ipt.rewrite_chains(
+                {"chain-%s" % ii: [rule]}, {}, async=True))
+        self.step_actor(self.ipt)
+        return results
+
+    def assert_only_failed(self, results, bad_indexes):
+        for ii, result in enumerate(results):
+            if ii in bad_indexes:
+                self.assertRaises(CalledProcessError, result.get)
+            else:
+                result.get()
+
+    def test_bad_chain_isolated(self):
+        """
+        Tests a single bad chain in a large batch fails only its message,
+        with a single retry.
+        """
+        results = self.send_rewrites(1000, set([567]))
+        self.assert_only_failed(results, set([567]))
+        self.assertEqual(self.restore.num_calls, 2)
+        self.assertTrue("chain-0" in self.ipt.explicitly_prog_chains)
+        self.assertFalse("chain-567" in self.ipt.explicitly_prog_chains)
+
+    def test_multiple_bad_chains(self):
+        results = self.send_rewrites(100, set([10, 90]))
+        self.assert_only_failed(results, set([10, 90]))
+        self.assertEqual(self.restore.num_calls, 3)
+
+    def test_unattributable_failure_splits(self):
+        """
+        Tests we fall back to splitting the batch if the failing line
+        isn't known.
+        """
+        with mock.patch.object(self.ipt, "_find_culprit", autospec=True,
+                               return_value=None):
+            results = self.send_rewrites(8, set([3]))
+        self.assert_only_failed(results, set([3]))
+        # Bisecting 8 messages takes several restores.
+        self.assertTrue(self.restore.num_calls > 3)
@@ -126,3 +126,63 @@ class TestFutils(unittest.TestCase):
                                           "should have given output "
                                           "%r but got %r" %
                                           (inp, length, exp, output))
+
+    def test_intern_if_ascii(self):
+        value = "".join(["prof", "ile1"])
+        self.assertTrue(futils.intern_if_ascii(value) is intern("profile1"))
+        self.assertTrue(futils.intern_if_ascii(u"profile1") is
+                        intern("profile1"))
+        non_ascii = u"caf\u00e9"
+        self.assertTrue(futils.intern_if_ascii(non_ascii) is non_ascii)
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_put(self):
+        cache = futils.LRUCache(2)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.get("a", "default"), "default")
+        cache.put("a", 1)
+        cache.put("a", 2)
+        self.assertEqual(cache.get("a"), 2)
+        self.assertEqual(len(cache), 1)
+        self.assertTrue("a" in cache)
+
+    def test_eviction(self):
+        cache = futils.LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # Using "a" makes "b" the least recently used.
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertFalse("b" in cache)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        # Updating "a" makes "c" the least recently used.
+        cache.put("a", 4)
+        cache.put("d", 5)
+        self.assertFalse("c" in cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_clear(self):
+        cache = futils.LRUCache(2)
+        cache.put("a", 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("b"), 2)
+
+
+class TestExponentialBackoff(unittest.TestCase):
+    def test_backoff(self):
+        backoff = futils.ExponentialBackoff(1, 5)
+        with mock.patch("random.uniform", autospec=True,
+                        side_effect=lambda low, high: high):
+            self.assertEqual([backoff.next_delay() for _ in xrange(5)],
+                             [1, 2, 4, 5, 5])
+            backoff.reset()
+            self.assertEqual(backoff.next_delay(), 1)
+
+    def test_jitter(self):
+        backoff = futils.ExponentialBackoff(4, 4)
+        for _ in xrange(100):
+            self.assertTrue(2 <= backoff.next_delay() <= 4)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Copyright 2015 Metaswitch Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+felix.test.test_ipc
+~~~~~~~~~~~~~~~~~~~
+
+Tests of the IPC channel to worker processes.
+"""
+import logging
+
+import gevent.socket
+import mock
+
+from calico.felix import ipc
+from calico.felix.splitter import UpdateSplitter
+from calico.felix.test.base import BaseTestCase
+
+_log = logging.getLogger(__name__)
+
+
+class TestChannel(BaseTestCase):
+    def setUp(self):
+        super(TestChannel, self).setUp()
+        self.sock_a, self.sock_b = gevent.socket.socketpair()
+
+    def tearDown(self):
+        self.sock_a.close()
+        self.sock_b.close()
+        super(TestChannel, self).tearDown()
+
+    def test_round_trip(self):
+        ipc.send_msg(self.sock_a, [("on_tags_update", ("prof1", ["a"]))])
+        self.assertEqual(ipc.recv_msg(self.sock_b),
+                         [("on_tags_update", ("prof1", ["a"]))])
+
+    def test_large_msg(self):
+        msg = dict(("ep%s" % i, {"name": "tap%s" % i}) for i in xrange(20000))
+        sender = gevent.spawn(ipc.send_msg, self.sock_a, msg)
+        self.assertEqual(ipc.recv_msg(self.sock_b), msg)
+        sender.get()
+
+    def test_closed(self):
+        self.sock_a.close()
+        self.assertRaises(ipc.WorkerExited, ipc.recv_msg, self.sock_b)
+
+    def test_wait_for_exit(self):
+        self.sock_a.close()
+        self.assertRaises(ipc.WorkerExited, ipc.wait_for_exit, self.sock_b)
+
+    def test_remote_splitter(self):
+        remote = ipc.RemoteSplitter(self.sock_a, qualifier="v6")
+        remote.apply_snapshot({"prof1": {}}, {"prof1": ["a"]}, {},
+                              oneway=True)
+        remote.on_endpoint_update("ep1", {"name": "tap1"}, oneway=True)
+        remote.on_interface_update("tap1", oneway=True)
+        self.step_actor(remote)
+        # All the calls are sent together, high priority first.
+        self.assertEqual(ipc.recv_msg(self.sock_b), [
+            ("on_interface_update", ("tap1",)),
+            ("apply_snapshot", ({"prof1": {}}, {"prof1": ["a"]}, {})),
+            ("on_endpoint_update", ("ep1", {"name": "tap1"})),
+        ])
+
+    def test_serve_splitter(self):
+        m_splitter = mock.Mock(spec=UpdateSplitter)
+        ipc.send_msg(self.sock_a, [
+            ("on_rules_update", ("prof1", {"inbound_rules": []})),
+            ("on_endpoint_update", ("ep1", None)),
+        ])
+        self.sock_a.close()
+        self.assertRaises(ipc.WorkerExited, ipc.serve_splitter, self.sock_b,
+                          m_splitter)
+        m_splitter.on_rules_update.assert_called_once_with(
+            "prof1", {"inbound_rules": []}, oneway=True)
+        m_splitter.on_endpoint_update.assert_called_once_with(
+            "ep1", None, oneway=True)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright 2015 Metaswitch Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+felix.test.test_ipsets
+~~~~~~~~~~~~~~~~~~~~~~
+
+Tests of the ipsets module.
+"""
+import logging
+
+import mock
+
+from calico.felix.endpointdata import Endpoint
+from calico.felix.futils import IPV4
+from calico.felix.ipsets import IpsetManager, ActiveIpset
+from calico.felix.refcount import LIVE
+from calico.felix.test.base import BaseTestCase
+
+_log = logging.getLogger(__name__)
+
+
+def endpoint(profile_id, *ips):
+    return Endpoint.from_dict("ep", "host", {
+        "profile_id": profile_id,
+        "ipv4_nets": ["%s/32" % ip for ip in ips],
+    }, local=False)
+
+
+class TestIpsetManager(BaseTestCase):
+    def setUp(self):
+        super(TestIpsetManager, self).setUp()
+        self.mgr = IpsetManager(IPV4)
+        self.m_ipset = mock.Mock(spec=ActiveIpset)
+        self.m_ipset.ref_mgmt_state = LIVE
+        self.mgr.objects_by_id["tag1"] = self.m_ipset
+
+    def step_mgr(self):
+        self.step_actor(self.mgr)
+
+    def test_tag_update_sends_one_message(self):
+        for ii in xrange(100):
+            self.mgr.on_endpoint_update("ep%s" % ii,
+                                        endpoint("prof1", "10.0.0.%s" % ii),
+                                        async=True)
+        self.mgr.on_tags_update("prof1", ["tag1"], async=True)
+        self.step_mgr()
+        self.m_ipset.update_members.assert_called_once_with(
+            set("10.0.0.%s" % ii for ii in xrange(100)),
+            set(),
+            oneway=True)
+
+    def test_add_then_remove(self):
+        self.mgr.on_tags_update("prof1", ["tag1"], async=True)
+        self.mgr.on_endpoint_update("ep1", endpoint("prof1", "10.0.0.1"),
+                                    async=True)
+        self.mgr.on_endpoint_update("ep2", endpoint("prof1", "10.0.0.2"),
+                                    async=True)
+        self.mgr.on_endpoint_update("ep1", None, async=True)
+        self.step_mgr()
+        self.m_ipset.update_members.assert_called_once_with(
+            set(["10.0.0.2"]), set(["10.0.0.1"]), oneway=True)
+
+        # Next batch should start with a clean slate.
+        self.m_ipset.reset_mock()
+        self.mgr.on_endpoint_update("ep2", endpoint("prof1", "10.0.0.3"),
+                                    async=True)
+        self.step_mgr()
+        self.m_ipset.update_members.assert_called_once_with(
+            set(["10.0.0.3"]), set(["10.0.0.2"]), oneway=True)
+
+    def test_no_message_for_inactive_tag(self):
+        self.mgr.on_tags_update("prof1", ["tag2"], async=True)
+        self.mgr.on_endpoint_update("ep1", endpoint("prof1", "10.0.0.1"),
+                                    async=True)
+        self.step_mgr()
+        self.assertFalse(self.m_ipset.update_members.called)
+
+
+class TestActiveIpset(BaseTestCase):
+    def test_update_members(self):
+        ipset = ActiveIpset("tag1", IPV4)
+        ipset.members = set(["10.0.0.1", "10.0.0.2"])
+        with mock.patch.object(ipset, "_sync_to_ipset",
+                               autospec=True) as m_sync, \
+                mock.patch.object(ipset, "_notify_ready", autospec=True):
+            ipset.update_members(set(["10.0.0.3"]), set(["10.0.0.1"]),
+                                 async=True)
+            self.step_actor(ipset)
+        self.assertEqual(ipset.members, set(["10.0.0.2", "10.0.0.3"]))
+        m_sync.assert_called_once_with()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Copyright 2015 Metaswitch Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+felix.test.test_snapshotcache
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Tests for the on-disk snapshot cache.
+"""
+import logging
+import os
+import shutil
+import tempfile
+
+import mock
+
+from calico.felix import snapshotcache
+from calico.felix.endpointdata import Endpoint
+from calico.felix.test.base import BaseTestCase
+
+_log = logging.getLogger(__name__)
+
+PARSE_CACHE = {
+    "/calico/v1/host/h/workload/o/w/endpoint/ep1":
+        (10, ("endpoint", "ep1", Endpoint("ep1", "h", "prof1",
+                                          ipv4_ips=("10.0.0.1",)))),
+    "/calico/v1/policy/profile/prof1/tags": (11, ("tags", "prof1", ["a"])),
+}
+
+
+class TestSnapshotCache(BaseTestCase):
+    def setUp(self):
+        super(TestSnapshotCache, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "subdir", "snapshot")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(TestSnapshotCache, self).tearDown()
+
+    def test_round_trip(self):
+        with mock.patch("calico.felix.snapshotcache.RECORD_SIZE", 1):
+            snapshotcache.save(self.path, {"etcd_index": 12}, PARSE_CACHE)
+        header, parse_cache = snapshotcache.load(self.path)
+        self.assertEqual(header, {"etcd_index": 12,
+                                  "version": snapshotcache.FORMAT_VERSION})
+        self.assertEqual(parse_cache, PARSE_CACHE)
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_missing(self):
+        self.assertEqual(snapshotcache.load(self.path), None)
+
+    def test_truncated(self):
+        snapshotcache.save(self.path, {}, PARSE_CACHE)
+        with open(self.path, "rb") as f:
+            data = f.read()
+        with open(self.path, "wb") as f:
+            f.write(data[:-10])
+        self.assertEqual(snapshotcache.load(self.path), None)
+
+    def test_other_version(self):
+        with mock.patch("calico.felix.snapshotcache.FORMAT_VERSION", 0):
+            snapshotcache.save(self.path, {}, PARSE_CACHE)
+        self.assertEqual(snapshotcache.load(self.path), None)
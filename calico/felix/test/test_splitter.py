@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright 2015 Metaswitch Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+felix.test.test_splitter
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Tests for the UpdateSplitter.
+"""
+import logging
+
+import mock
+
+from calico.felix.endpoint import EndpointManager
+from calico.felix.endpointdata import Endpoint
+from calico.felix.ipsets import IpsetManager
+from calico.felix.splitter import UpdateSplitter
+from calico.felix.test.base import BaseTestCase
+
+_log = logging.getLogger(__name__)
+
+LOCAL_EP = Endpoint("ep1", "hostname", "prof1")
+REMOTE_EP = Endpoint("ep2", "other", "prof1")
+
+
+class TestUpdateSplitter(BaseTestCase):
+    def setUp(self):
+        super(TestUpdateSplitter, self).setUp()
+        self.m_config = mock.Mock()
+        self.m_config.HOSTNAME = "hostname"
+        self.m_ipset_mgr = mock.Mock(spec=IpsetManager)
+        self.m_ep_mgr = mock.Mock(spec=EndpointManager)
+        self.splitter = UpdateSplitter(self.m_config,
+                                       [self.m_ipset_mgr],
+                                       [],
+                                       [self.m_ep_mgr],
+                                       [])
+
+    def test_snapshot_only_local_endpoints(self):
+        with mock.patch("gevent.spawn_later", autospec=True):
+            self.splitter.apply_snapshot({}, {}, {"ep1": LOCAL_EP,
+                                                  "ep2": REMOTE_EP},
+                                         async=True)
+            self.step_actor(self.splitter)
+        self.m_ipset_mgr.apply_snapshot.assert_called_once_with(
+            {}, {"ep1": LOCAL_EP, "ep2": REMOTE_EP}, async=True)
+        self.m_ep_mgr.apply_snapshot.assert_called_once_with(
+            {"ep1": LOCAL_EP}, async=True)
+
+    def test_remote_endpoint_update(self):
+        self.splitter.on_endpoint_update("ep2", REMOTE_EP, async=True)
+        self.splitter.on_endpoint_update("ep2", None, async=True)
+        self.step_actor(self.splitter)
+        self.assertEqual(self.m_ipset_mgr.on_endpoint_update.mock_calls, [
+            mock.call("ep2", REMOTE_EP, oneway=True),
+            mock.call("ep2", None, oneway=True),
+        ])
+        self.assertFalse(self.m_ep_mgr.on_endpoint_update.called)
+
+    def test_local_endpoint_update(self):
+        self.splitter.on_endpoint_update("ep1", LOCAL_EP, async=True)
+        self.splitter.on_endpoint_update("ep1", None, async=True)
+        self.step_actor(self.splitter)
+        self.assertEqual(self.m_ep_mgr.on_endpoint_update.mock_calls, [
+            mock.call("ep1", LOCAL_EP, oneway=True),
+            mock.call("ep1", None, oneway=True),
+        ])
+
+    def test_endpoint_moved_away(self):
+        self.splitter.on_endpoint_update("ep1", LOCAL_EP, async=True)
+        self.splitter.on_endpoint_update("ep1", REMOTE_EP, async=True)
+        self.step_actor(self.splitter)
+        self.assertEqual(self.m_ep_mgr.on_endpoint_update.mock_calls, [
+            mock.call("ep1", LOCAL_EP, oneway=True),
+            mock.call("ep1", None, oneway=True),
+        ])
+        self.m_ipset_mgr.on_endpoint_update.assert_called_with(
+            "ep1", REMOTE_EP, oneway=True)
+
+    @mock.patch("calico.common.complete_logging", autospec=True)
+    @mock.patch("calico.felix.frules.install_global_filter_rules",
+                autospec=True)
+    @mock.patch("calico.felix.frules.install_global_nat_rules",
+                autospec=True)
+    def test_config_update(self, m_install_nat, m_install_filter,
+                           m_complete_logging):
+        m_remote = mock.Mock()
+        m_nat_updater = mock.Mock()
+        m_filter_updater = mock.Mock()
+        splitter = UpdateSplitter(self.m_config, [], [], [],
+                                  [m_filter_updater],
+                                  remote_splitters=[m_remote],
+                                  nat_updaters=[m_nat_updater])
+        splitter.on_config_update({"LOGLEVSCR": logging.DEBUG}, async=True)
+        self.step_actor(splitter)
+        self.assertEqual(self.m_config.LOGLEVSCR, logging.DEBUG)
+        m_remote.on_config_update.assert_called_once_with(
+            {"LOGLEVSCR": logging.DEBUG}, oneway=True)
+        self.assertEqual(m_complete_logging.call_count, 1)
+        self.assertFalse(m_install_nat.called)
+        self.assertFalse(m_install_filter.called)
+
+        # Only the rules that depend on the changed config are reprogrammed.
+        splitter.on_config_update({"METADATA_PORT": "9697"}, async=True)
+        self.step_actor(splitter)
+        m_install_nat.assert_called_once_with(self.m_config, m_nat_updater)
+        self.assertFalse(m_install_filter.called)
+        splitter.on_config_update({"IFACE_PREFIX": "veth"}, async=True)
+        self.step_actor(splitter)
+        m_install_filter.assert_called_once_with(self.m_config,
+                                                 m_filter_updater)
+        self.assertEqual(self.m_config.IFACE_PREFIX, "veth")
+        self.assertEqual(m_install_nat.call_count, 1)
+        self.assertEqual(m_complete_logging.call_count, 1)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright 2015 Metaswitch Networks
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+test.bench_common
+~~~~~~~~~~~~~~~~~
+
+Benchmark of the IP address and CIDR validation functions, comparing the
+socket.inet_pton() fast path against the netaddr-only implementation.  Not
+run as part of the UTs, run with:
+
+    python -m calico.test.bench_common [num addresses]
+"""
+import sys
+import time
+
+import netaddr
+import netaddr.core
+
+import calico.common as common
+
+
+def netaddr_validate_ip_addr(addr, version):
+    """validate_ip_addr as it was before the fast path."""
+    try:
+        netaddr.IPAddress(addr, version=version)
+        return True
+    except (netaddr.core.AddrFormatError, ValueError, TypeError):
+        return False
+
+
+def netaddr_validate_cidr(cidr, version):
+    """validate_cidr as it was before the fast path."""
+    try:
+        netaddr.IPNetwork(cidr, version=version)
+        return True
+    except (netaddr.core.AddrFormatError, ValueError, TypeError):
+        return False
+
+
+def build_inputs(num_addrs):
+    """
+    :returns list: (function name, value, version) tuples resembling the
+        values in endpoint and rules data.
+    """
+    inputs = []
+    for ii in xrange(num_addrs):
+        v4 = "10.%d.%d.%d" % ((ii >> 16) & 0xff, (ii >> 8) & 0xff, ii & 0xff)
+        v6 = "2001:db8::%x" % ii
+        inputs.append(("cidr", v4 + "/32", 4))
+        inputs.append(("cidr", v6 + "/128", 6))
+        inputs.append(("ip", v4, 4))
+        inputs.append(("ip", v6, 6))
+    return inputs
+
+
+def time_validation(inputs, validate_ip_addr, validate_cidr):
+    fns = {"ip": validate_ip_addr, "cidr": validate_cidr}
+    start = time.time()
+    for fn_name, value, version in inputs:
+        assert fns[fn_name](value, version)
+    return time.time() - start
+
+
+def main(argv):
+    num_addrs = int(argv[1]) if len(argv) > 1 else 50000
+    inputs = build_inputs(num_addrs)
+    old_time = time_validation(inputs, netaddr_validate_ip_addr,
+                               netaddr_validate_cidr)
+    new_time = time_validation(inputs, common.validate_ip_addr,
+                               common.validate_cidr)
+    print "%d validations" % len(inputs)
+    print "%-20s %8.2fs" % ("netaddr", old_time)
+    print "%-20s %8.2fs" % ("inet_pton", new_time)
+    print "%-20s %8.1fx" % ("speedup", old_time / max(new_time, 1e-9))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
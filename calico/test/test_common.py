@@ -19,8 +19,13 @@ test.test_common
 Test common utility code.
 """
 import logging
+import logging.handlers
 import mock
+import netaddr
 import os
+import random
+import shutil
+import tempfile
 import unittest
 
 import calico.common as common
@@ -111,3 +116,96 @@ class TestCommon(unittest.TestCase):
         self.assertTrue(common.validate_cidr("2001::a/64", None))
 
         self.assertFalse(common.validate_cidr(None, None))
+
+    def test_validate_ip_matches_netaddr(self):
+        # The fast path must give exactly the same answers as netaddr.  Try
+        # a mix of well-formed addresses and random mutations of them.
+        rand = random.Random(1234)
+        for candidate in _random_ip_strings(rand, 5000):
+            for version in (4, 6, None):
+                try:
+                    netaddr.IPAddress(candidate, version=version)
+                    ip_ok = True
+                except (netaddr.core.AddrFormatError, ValueError, TypeError):
+                    ip_ok = False
+                try:
+                    netaddr.IPNetwork(candidate, version=version)
+                    cidr_ok = True
+                except (netaddr.core.AddrFormatError, ValueError, TypeError):
+                    cidr_ok = False
+                self.assertEqual(common.validate_ip_addr(candidate, version),
+                                 ip_ok, "%r, v%s" % (candidate, version))
+                self.assertEqual(common.validate_cidr(candidate, version),
+                                 cidr_ok, "%r, v%s" % (candidate, version))
+
+    def test_fast_validate_leading_zero_prefix(self):
+        # Unusual forms are left to netaddr.
+        self.assertFalse(common._fast_validate("10.0.0.0", "08", 4))
+        self.assertFalse(common._fast_validate("10.0.0.0", "33", 4))
+        self.assertFalse(common._fast_validate("10.0.0.0", "", 4))
+        self.assertTrue(common._fast_validate("10.0.0.0", "8", 4))
+        self.assertTrue(common._fast_validate("::", "0", 6))
+
+    def test_complete_logging_repeated(self):
+        root_logger = logging.Logger("root")
+        m_syslog = mock.Mock(spec=logging.handlers.SysLogHandler)
+        m_stream = mock.Mock(spec=logging.StreamHandler)
+        m_syslog.level = m_stream.level = logging.NOTSET
+        root_logger.addHandler(m_syslog)
+        root_logger.addHandler(m_stream)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            log_path = os.path.join(tmp_dir, "felix.log")
+            with mock.patch("logging.getLogger", autospec=True,
+                            return_value=root_logger):
+                common.complete_logging(log_path, logging.DEBUG, None,
+                                        logging.INFO)
+                m_syslog.setLevel.assert_called_with(common._DISABLED_LEVEL)
+                m_stream.setLevel.assert_called_with(logging.INFO)
+                file_handler = root_logger.handlers[-1]
+                self.assertEqual(file_handler.level, logging.DEBUG)
+
+                # Syslog can be re-enabled, the file handler is reused.
+                common.complete_logging(log_path, logging.INFO,
+                                        logging.ERROR, None)
+                m_syslog.setLevel.assert_called_with(logging.ERROR)
+                m_stream.setLevel.assert_called_with(common._DISABLED_LEVEL)
+                self.assertEqual(root_logger.handlers,
+                                 [m_syslog, m_stream, file_handler])
+                self.assertEqual(file_handler.level, logging.INFO)
+                self.assertEqual(root_logger.level, logging.INFO)
+
+                # Moving the log file replaces the file handler.
+                new_path = os.path.join(tmp_dir, "felix2.log")
+                common.complete_logging(new_path, logging.INFO,
+                                        logging.ERROR, None)
+                self.assertEqual(len(root_logger.handlers), 3)
+                self.assertEqual(root_logger.handlers[-1].baseFilename,
+                                 new_path)
+                root_logger.handlers[-1].close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+def _random_ip_strings(rand, count):
+    """
+    Generates strings that look more or less like IP addresses or CIDRs.
+    """
+    chars = "0123456789abcdefABCDEF.:/% x-"
+    for _ in xrange(count):
+        if rand.random() < 0.5:
+            s = ".".join(str(rand.randint(0, 300)) for _ in
+                         xrange(rand.choice((2, 3, 4, 4, 4, 5))))
+        else:
+            s = ":".join("%x" % rand.randint(0, 0x1ffff) for _ in
+                         xrange(rand.randint(1, 9)))
+            if rand.random() < 0.3:
+                s = s.replace(":", "::", 1)
+        if rand.random() < 0.5:
+            s += "/%s" % rand.choice(("0", "8", "24", "32", "64", "128",
+                                      "129", "033", "", "x", "-1"))
+        if rand.random() < 0.2:
+            # Mutate a character.
+            pos = rand.randint(0, len(s))
+            s = s[:pos] + rand.choice(chars) + s[pos + 1:]
+        yield s